@@ -0,0 +1,48 @@
+"""Add sample_id to Observation model
+
+Revision ID: 2c9e4f7b8a13
+Revises: 5b2e8d7a94c1
+Create Date: 2026-10-18 23:05:41.218604
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2c9e4f7b8a13'
+down_revision = '5b2e8d7a94c1'
+
+from alembic import op
+from sqlalchemy import sql
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('observation', sa.Column('sample_id', sa.Integer(), nullable=True))
+
+    # Copy the sample id from the variation of each observation.
+    observation = sql.table('observation',
+                            sql.column('variation_id', sa.Integer()),
+                            sql.column('sample_id', sa.Integer()))
+    variation = sql.table('variation',
+                          sql.column('id', sa.Integer()),
+                          sql.column('sample_id', sa.Integer()))
+    op.execute(observation.update().values(
+        sample_id=sql.select([variation.c.sample_id]).where(
+            variation.c.id == observation.c.variation_id).as_scalar()))
+
+    op.alter_column('observation', 'sample_id',
+               existing_type=sa.Integer(),
+               nullable=False)
+    op.create_foreign_key('observation_sample_id_fkey', 'observation', 'sample', ['sample_id'], ['id'], ondelete='CASCADE')
+    op.create_index('ix_observation_sample_id', 'observation', ['sample_id'])
+
+    # The covering observation_frequency index supersedes observation_allele.
+    op.drop_index('observation_allele', 'observation')
+    op.create_index('observation_frequency', 'observation', ['chromosome', 'position', 'allele_key', 'sample_id', 'zygosity', 'support'])
+
+
+def downgrade():
+    op.drop_index('observation_frequency', 'observation')
+    op.create_index('observation_allele', 'observation', ['chromosome', 'position', 'allele_key'])
+    op.drop_index('ix_observation_sample_id', 'observation')
+    op.drop_constraint('observation_sample_id_fkey', 'observation', type_='foreignkey')
+    op.drop_column('observation', 'sample_id')
@@ -0,0 +1,42 @@
+"""Partition observation and region tables by chromosome
+
+Revision ID: 4a6d1e3c9b20
+Revises: 2c9e4f7b8a13
+Create Date: 2026-10-19 09:12:47.603318
+
+On PostgreSQL (version 11 or later), the observation and region tables can
+optionally be partitioned by chromosome. This is done only if requested:
+
+    alembic -x partition=chromosome upgrade head
+
+Every chromosome in the database at the time of upgrading gets a partition,
+all other chromosomes end up in a default partition. The chromosome becomes
+part of the primary key, so the upgrade is refused if any observation or
+region has no chromosome.
+
+Partitioning can also be done at any later time with the `varda partition`
+command, see :mod:`varda.partitioning`.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a6d1e3c9b20'
+down_revision = '2c9e4f7b8a13'
+
+from alembic import context, op
+
+from varda import partitioning
+
+
+def upgrade():
+    partition = context.get_x_argument(as_dictionary=True).get('partition')
+    if partition is None:
+        return
+    if partition != 'chromosome':
+        raise ValueError('Unknown partitioning: %s' % partition)
+    partitioning.partition(op.get_bind())
+
+
+def downgrade():
+    if partitioning.is_partitioned(op.get_bind()):
+        partitioning.unpartition(op.get_bind())
@@ -0,0 +1,198 @@
+"""
+Benchmark calculating the frequency of a variant.
+
+Compares a :class:`varda.utils.FrequencyCalculator`, created once per batch
+of lookups, to the original implementation of
+:func:`varda.utils.calculate_frequency` (ORM queries on the region and
+observation bins, joining the coverage and variation tables), on an SQLite
+database with some samples. Run from the repository root::
+
+    $ python benchmarks/frequency_lookup.py
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from __future__ import division
+
+import collections
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+import binning
+from sqlalchemy import func, Index
+
+from varda import create_app, db
+from varda.alleles import allele_key
+from varda.models import (Coverage, DataSource, Observation, Region, Sample,
+                          update_generations, User, Variation)
+from varda.utils import FrequencyCalculator
+
+
+# Index used by the original implementation, since dropped.
+Index('region_location', Region.bin, Region.chromosome, Region.begin)
+
+
+# Chromosomes and their lengths.
+CHROMOSOMES = [('chr%d' % i, 250000000 - i * 8000000) for i in range(1, 23)]
+
+# Number of samples, the first half of which have a coverage profile.
+SAMPLES = 40
+
+# Number of regions and observations per sample.
+REGIONS = 5000
+OBSERVATIONS = 5000
+
+# Number of lookups per measurement.
+NUMBER = 2000
+
+
+def random_position():
+    chromosome, length = random.choice(CHROMOSOMES)
+    return chromosome, random.randint(1, length)
+
+
+def baseline_frequency(chromosome, position, reference, observed, samples):
+    """
+    Original implementation of :func:`varda.utils.calculate_frequency`.
+    """
+    end_position = position + max(1, len(reference)) - 1
+    bins = binning.containing_bins(position - 1, end_position)
+    sample_ids = [sample.id for sample in samples if sample.coverage_profile]
+    coverage = Region.query.join(Coverage).filter(
+        Region.bin.in_(bins),
+        Region.chromosome == chromosome,
+        Region.begin <= position,
+        Region.end >= end_position,
+        Coverage.sample_id.in_(sample_ids)).count() if sample_ids else 0
+    coverage += sum(sample.pool_size for sample in samples
+                    if not sample.coverage_profile)
+    if not coverage:
+        return 0, {}
+    counts = collections.Counter(dict(db.session.query(
+        Observation.zygosity, func.sum(Observation.support)
+    ).join(Variation).filter(
+        Observation.bin.in_(bins),
+        Observation.chromosome == chromosome,
+        Observation.position == position,
+        Observation.reference == reference,
+        Observation.observed == observed,
+        Variation.sample_id.in_([sample.id for sample in samples])
+    ).group_by(Observation.zygosity)))
+    return coverage, {zygosity: counts[zygosity] / coverage
+                      for zygosity in (None, 'homozygous', 'heterozygous')}
+
+
+def calculator_frequency(lookups):
+    """
+    Current implementation, one calculator for the batch of lookups.
+    """
+    calculator = FrequencyCalculator(lookups[0][-1])
+    results = []
+    for chromosome, position, reference, observed, _ in lookups:
+        coverage, frequency = calculator(chromosome, position, reference,
+                                         observed)
+        results.append((coverage, frequency if coverage else {}))
+    return results
+
+
+def main():
+    random.seed(1)
+    directory = tempfile.mkdtemp()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+            directory, 'varda.db'),
+        'DATA_DIR': directory})
+
+    try:
+        with app.app_context():
+            db.create_all()
+
+            user = User('Benchmark', 'benchmark')
+            variants = []
+            for i in range(SAMPLES):
+                coverage_profile = i < SAMPLES // 2
+                sample = Sample(user, 'Sample %d' % i,
+                                coverage_profile=coverage_profile,
+                                pool_size=1 if coverage_profile else 10)
+                sample.active = True
+                data_source = DataSource(user, 'Observations %d' % i, 'vcf',
+                                         empty=True)
+                variation = Variation(sample, data_source)
+                db.session.add(variation)
+                if coverage_profile:
+                    data_source = DataSource(user, 'Coverage %d' % i, 'bed',
+                                             empty=True)
+                    coverage = Coverage(sample, data_source)
+                    db.session.add(coverage)
+                db.session.commit()
+
+                if coverage_profile:
+                    regions = []
+                    for _ in range(REGIONS):
+                        chromosome, begin = random_position()
+                        end = begin + random.randint(100, 2000)
+                        regions.append(
+                            {'coverage_id': coverage.id,
+                             'chromosome': chromosome,
+                             'begin': begin, 'end': end,
+                             'bin': binning.assign_bin(begin - 1, end)})
+                    db.session.execute(Region.__table__.insert(), regions)
+
+                observations = []
+                for _ in range(OBSERVATIONS):
+                    chromosome, position = random_position()
+                    reference, observed = random.choice(
+                        [('A', 'C'), ('G', 'T'), ('', 'AT'), ('CA', '')])
+                    observations.append(
+                        {'variation_id': variation.id,
+                         'sample_id': sample.id,
+                         'chromosome': chromosome, 'position': position,
+                         'reference': reference, 'observed': observed,
+                         'allele_key': allele_key(reference, observed),
+                         'bin': binning.assign_bin(
+                             position - 1,
+                             position + max(1, len(reference)) - 1),
+                         'zygosity': random.choice(['heterozygous',
+                                                    'homozygous']),
+                         'support': 1})
+                    if random.random() < 0.05:
+                        variants.append((chromosome, position, reference,
+                                         observed))
+                db.session.execute(Observation.__table__.insert(),
+                                   observations)
+                update_generations(db.session, {'observation', 'region'})
+                db.session.commit()
+            db.session.execute('ANALYZE')
+            db.session.commit()
+
+            samples = Sample.query.filter_by(active=True).all()
+            lookups = [variant + (samples,) for variant in
+                       random.sample(variants, NUMBER)]
+
+            def baseline(lookups):
+                return [baseline_frequency(*lookup) for lookup in lookups]
+
+            timings = []
+            results = []
+            for f in (baseline, calculator_frequency):
+                results.append(f(lookups))
+                timings.append(timeit.timeit(lambda: f(lookups),
+                                             number=1) / NUMBER)
+            assert results[0] == results[1]
+
+            db.session.remove()
+    finally:
+        shutil.rmtree(directory)
+
+    print '%12s %12s' % ('baseline', 'calculator')
+    print '%10.3fms %10.3fms' % tuple(t * 1000 for t in timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark moving indels to the left in long short tandem repeats.
+
+Compares :func:`varda.utils.move_left` to the per-base implementation it
+replaced, both on a string and on a memory-mapped reference genome. Run
+from the repository root::
+
+    $ python benchmarks/move_left.py
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+from varda.genome import Genome
+from varda.utils import move_left
+
+
+# Repeat units and number of repeats.
+REPEATS = [('A', 50), ('CA', 500), ('AAG', 2000), ('GATA', 5000)]
+
+# Number of calls per measurement.
+NUMBER = 20
+
+
+def move_left_per_base(context, position, sequence):
+    """
+    Previous implementation of :func:`varda.utils.move_left`.
+    """
+    def lookup(p):
+        if position <= p < position + len(sequence):
+            return sequence[p - position].upper()
+        return context[p - 1].upper()
+
+    move = 0
+    while (position - move > 1 and
+           lookup(position - move - 1) ==
+           lookup(position + len(sequence) - move - 1)):
+        move += 1
+
+    if not move:
+        return position, sequence
+
+    return (position - move,
+            context[position - move - 1
+                    :min(position, position - move + len(sequence)) - 1]
+            + sequence[:-move])
+
+
+def random_sequence(length):
+    return ''.join(random.choice('ACGT') for _ in range(length))
+
+
+def main():
+    random.seed(1)
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'genome.fa')
+        contexts = {}
+        with open(filename, 'w') as fasta:
+            for unit, repeats in REPEATS:
+                name = 'str_%s' % unit
+                context = (random_sequence(10000) + unit * repeats +
+                           random_sequence(10000))
+                contexts[name] = context
+                fasta.write('>%s\n' % name)
+                for i in range(0, len(context), 60):
+                    fasta.write(context[i:i + 60] + '\n')
+
+        genome = Genome()
+        genome.init(filename, as_raw=True, mmap=True)
+
+        print '%-10s %8s %12s %12s %12s %12s' % (
+            'unit', 'length', 'str old', 'str new', 'mmap old', 'mmap new')
+        for unit, repeats in REPEATS:
+            name = 'str_%s' % unit
+            # Deletion of one repeat unit at the end of the repeat.
+            position = 10000 + len(unit) * (repeats - 1) + 1
+            sequence = unit
+            timings = []
+            for context in (contexts[name], genome[name]):
+                results = []
+                for f in (move_left_per_base, move_left):
+                    results.append(f(context, position, sequence))
+                    timings.append(timeit.timeit(
+                        lambda: f(context, position, sequence),
+                        number=NUMBER) / NUMBER)
+                assert results[0] == results[1]
+            print '%-10s %8d %10.3fms %10.3fms %10.3fms %10.3fms' % (
+                (unit, len(unit) * repeats) +
+                tuple(t * 1000 for t in timings))
+        genome.close_mapping()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Benchmark looking up regions covering a variant.
+
+Compares :func:`varda.utils.covering_regions` to the query on bins it
+replaced, on an SQLite database with a few exome-sized coverage profiles.
+The other scenarios add some multi-Mb regions (as merged from, e.g., whole
+genome coverage), which end up in coarse bins and widen the scan of the new
+query unless they are split on import (see :func:`varda.tasks.split_regions`).
+Only executing the queries is measured. Run from the repository root::
+
+    $ python benchmarks/region_lookup.py
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+import binning
+from sqlalchemy import distinct, func, Index
+
+from varda import create_app, db
+from varda.models import (Coverage, DataSource, Region, Sample, User,
+                          update_generations)
+from varda.tasks import split_regions
+from varda.utils import covering_regions
+
+
+# Chromosomes and their lengths.
+CHROMOSOMES = [('chr%d' % i, 250000000 - i * 8000000) for i in range(1, 23)]
+
+# Number of coverage profiles and of regions per profile (typical for an
+# exome enrichment kit).
+PROFILES = 4
+REGIONS = 200000
+
+# Number of long regions per profile in the other scenarios, and their length.
+LONG_REGIONS = 20
+LONG_LENGTH = 5000000
+
+# Number of lookups per measurement.
+NUMBER = 2000
+
+
+# Index used by the previous implementation (created with the others).
+Index('region_location', Region.bin, Region.chromosome, Region.begin)
+
+
+def exome_regions(long_regions=0):
+    """
+    Generate BED-like regions as tuples of chromosome, begin, and end.
+    """
+    genome_size = sum(length for _, length in CHROMOSOMES)
+    for chromosome, length in CHROMOSOMES:
+        count = REGIONS * length // genome_size
+        gap = length // count
+        position = 1
+        for _ in range(count):
+            position += random.randint(gap // 2, gap * 3 // 2)
+            region_length = min(int(random.lognormvariate(5, 0.7)), 10000)
+            yield chromosome, position, position + region_length - 1
+    for _ in range(long_regions):
+        chromosome, length = random.choice(CHROMOSOMES)
+        begin = random.randint(1, length - LONG_LENGTH)
+        yield chromosome, begin, begin + LONG_LENGTH - 1
+
+
+def bin_lookup(chromosome, begin, end, sample_ids):
+    """
+    Query of the previous implementation of the region lookup in
+    :func:`varda.utils.calculate_frequency`.
+    """
+    bins = binning.containing_bins(begin - 1, end)
+    return Region.query.join(Coverage).filter(
+        Region.bin.in_(bins),
+        Region.chromosome == chromosome,
+        Region.begin <= begin,
+        Region.end >= end,
+        Coverage.sample_id.in_(sample_ids)
+    ).with_entities(func.count(distinct(Region.coverage_id)))
+
+
+def span_lookup(chromosome, begin, end, sample_ids):
+    """
+    Query of the current implementation of the region lookup in
+    :func:`varda.utils.calculate_frequency`.
+    """
+    return covering_regions(chromosome, begin, end).join(Coverage).filter(
+        Coverage.sample_id.in_(sample_ids)
+    ).with_entities(func.count(distinct(Region.coverage_id)))
+
+
+def run(directory, long_regions, split):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+            directory, 'varda-%d-%d.db' % (long_regions, split)),
+        'DATA_DIR': directory})
+
+    with app.app_context():
+        db.create_all()
+
+        user = User('Benchmark', 'benchmark')
+        sample_ids = []
+        for i in range(PROFILES):
+            sample = Sample(user, 'Sample %d' % i, coverage_profile=True)
+            data_source = DataSource(user, 'Coverage %d' % i, 'bed',
+                                     empty=True)
+            coverage = Coverage(sample, data_source)
+            db.session.add(coverage)
+            db.session.commit()
+            sample_ids.append(sample.id)
+            regions = exome_regions(long_regions)
+            if split:
+                regions = split_regions(regions)
+            db.session.execute(Region.__table__.insert(), [
+                {'coverage_id': coverage.id, 'chromosome': chromosome,
+                 'begin': begin, 'end': end,
+                 'bin': binning.assign_bin(begin - 1, end)}
+                for chromosome, begin, end in regions])
+            update_generations(db.session, {'region'})
+            db.session.commit()
+        db.session.execute('ANALYZE')
+        db.session.commit()
+
+        lookups = []
+        for _ in range(NUMBER):
+            chromosome, length = random.choice(CHROMOSOMES)
+            begin = random.randint(1, length)
+            lookups.append((chromosome, begin,
+                            begin + random.choice([0, 0, 0, 5, 50]),
+                            sample_ids))
+
+        timings = []
+        results = []
+        for f in (bin_lookup, span_lookup):
+            # Compile the queries beforehand, so only executing them is
+            # measured.
+            statements = [str(f(*lookup).statement.compile(
+                db.engine, compile_kwargs={'literal_binds': True}))
+                for lookup in lookups]
+            results.append([db.session.execute(statement).scalar()
+                            for statement in statements])
+            timings.append(timeit.timeit(
+                lambda: [db.session.execute(statement).scalar()
+                         for statement in statements],
+                number=1) / NUMBER)
+        assert results[0] == results[1]
+
+        db.session.remove()
+
+    if long_regions:
+        scenario = 'exome + %d %dMb regions' % (long_regions,
+                                                LONG_LENGTH // 1000000)
+        if split:
+            scenario += ' (split)'
+    else:
+        scenario = 'exome'
+    print '%-32s %10.3fms %10.3fms' % (
+        (scenario,) + tuple(t * 1000 for t in timings))
+
+
+def main():
+    random.seed(1)
+    directory = tempfile.mkdtemp()
+    try:
+        print '%-32s %12s %12s' % ('scenario', 'bins', 'span')
+        run(directory, 0, True)
+        run(directory, LONG_REGIONS, False)
+        run(directory, LONG_REGIONS, True)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -42,7 +42,7 @@ def monkey_patch_fixture():
 
 
 class _EmptyUpload(object):
-    def read(self):
+    def read(self, size=-1):
         return ''
 
 
@@ -0,0 +1,49 @@
+"""
+Tests for the `alleles` module.
+"""
+
+
+import random
+
+from nose.tools import assert_equal, assert_raises
+
+from varda.alleles import allele_key, is_packed, unpack_allele_key
+
+
+class TestAlleles:
+    def test_packed(self):
+        """
+        Pack short alleles into their key.
+        """
+        random.seed(1)
+        alleles = [('', ''), ('A', 'T'), ('', 'CAG'), ('ACGT', ''),
+                   ('A' * 15, 'T' * 12), ('T' * 12, 'G' * 15)]
+        for _ in range(1000):
+            reference_length = random.randint(0, 15)
+            observed_length = random.randint(0, 27 - reference_length)
+            alleles.append(
+                (''.join(random.choice('ACGT')
+                         for _ in range(reference_length)),
+                 ''.join(random.choice('ACGT')
+                         for _ in range(min(observed_length, 15)))))
+        keys = set()
+        for reference, observed in alleles:
+            key = allele_key(reference, observed)
+            assert is_packed(key)
+            assert key < 2 ** 63
+            assert_equal(unpack_allele_key(key), (reference, observed))
+            keys.add(key)
+        assert_equal(len(keys), len(set(alleles)))
+
+    def test_unpacked(self):
+        """
+        Use hash-based keys for alleles that cannot be packed.
+        """
+        for reference, observed in [('N', 'A'), ('a', 'T'), ('A' * 16, ''),
+                                    ('A' * 14, 'T' * 14)]:
+            key = allele_key(reference, observed)
+            assert not is_packed(key)
+            assert key >= -2 ** 63
+            assert_equal(key, allele_key(reference, observed))
+            with assert_raises(ValueError):
+                unpack_allele_key(key)
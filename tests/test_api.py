@@ -5,16 +5,20 @@ Todo: Look at http://packages.python.org/Flask-Testing/
 """
 
 
+import gzip
 from StringIO import StringIO
 import json
+import os
 import tempfile
 import time
 
 from nose.tools import *
+import sqlalchemy
 import vcf
 
-from varda import create_app, db
-from varda.models import Annotation, Group, Sample, User
+from varda import create_app, credentials_cache, db
+from varda.models import (Annotation, DataSource, Group, Observation, Region,
+                          Sample, User)
 
 
 TEST_SETTINGS = {
@@ -144,6 +148,31 @@ class TestApi():
         r = self.client.post(self.uri_samples + 'abc', headers=[auth_header()])
         assert_equal(r.status_code, 404)
 
+    def test_script_root(self):
+        """
+        Test resource URIs with the application mounted under a script root.
+        """
+        base_url = 'http://localhost/proxied/'
+
+        r = self.client.post(self.uri_groups, data={'name': 'Test group'},
+                             base_url=base_url, headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        group = json.loads(r.data)['group']['uri']
+        assert group.startswith('/proxied' + self.uri_groups)
+
+        r = self.client.post(self.uri_samples, data={'name': 'Test sample',
+                                                     'groups': group},
+                             base_url=base_url, headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        sample = json.loads(r.data)['sample']
+        assert sample['uri'].startswith('/proxied' + self.uri_samples)
+        assert_equal([{'uri': group}], sample['groups'])
+
+        r = self.client.get(sample['uri'][len('/proxied'):],
+                            base_url=base_url, headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        assert_equal(sample['uri'], json.loads(r.data)['sample']['uri'])
+
     def test_authentication(self):
         """
         Test authentication stuff.
@@ -166,6 +195,33 @@ class TestApi():
         r = self.client.get(self.uri_root, headers=[auth_header(login='user', password='test')])
         assert_equal(r.status_code, 200)
 
+    def test_authentication_cache(self):
+        """
+        Test caching of verified credentials.
+        """
+        r = self.client.get(self.uri_authentication, headers=[auth_header(login='user', password='test')])
+        assert_equal(r.status_code, 200)
+        user = json.loads(r.data)['authentication']['user']['uri']
+        assert_equal(len(credentials_cache), 1)
+
+        r = self.client.get(self.uri_authentication, headers=[auth_header(login='user', password='incorrect')])
+        assert_equal(None, json.loads(r.data)['authentication']['user'])
+        assert_equal(len(credentials_cache), 1)
+
+        r = self.client.get(self.uri_authentication, headers=[auth_header(login='user', password='test')])
+        assert_equal(user, json.loads(r.data)['authentication']['user']['uri'])
+        assert_equal(len(credentials_cache), 1)
+
+        r = self.client.patch(user, data={'password': 'changed'}, headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        assert_equal(len(credentials_cache), 1)
+
+        r = self.client.get(self.uri_authentication, headers=[auth_header(login='user', password='test')])
+        assert_equal(None, json.loads(r.data)['authentication']['user'])
+
+        r = self.client.get(self.uri_authentication, headers=[auth_header(login='user', password='changed')])
+        assert_equal(user, json.loads(r.data)['authentication']['user']['uri'])
+
     def test_token_authentication(self):
         """
         Test authentication by token.
@@ -208,6 +264,163 @@ class TestApi():
         assert_equal(r.status_code, 401)
 
 
+    def test_token_cache(self):
+        """
+        Test caching of authentication tokens.
+        """
+        r = self.client.get(self.uri_authentication, headers=[auth_header(login='user', password='test')])
+        assert_equal(r.status_code, 200)
+        user = json.loads(r.data)['authentication']['user']['uri']
+
+        data = {'name': 'test token',
+                'user': user}
+        r = self.client.post(self.uri_tokens, data=data, headers=[auth_header(login='user', password='test')])
+        assert_equal(r.status_code, 201)
+        token = json.loads(r.data)['token']
+
+        token_header = ('AUTHORIZATION', 'Token ' + token['key'])
+
+        r = self.client.get(self.uri_users, headers=[token_header, ('Range', 'items=0-20')])
+        assert_equal(r.status_code, 403)
+
+        r = self.client.patch(user, data=json.dumps({'roles': ['admin']}),
+                              content_type='application/json',
+                              headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+
+        r = self.client.get(self.uri_users, headers=[token_header, ('Range', 'items=0-20')])
+        assert_equal(r.status_code, 206)
+
+        r = self.client.get(self.uri_authentication, headers=[token_header])
+        assert_equal(r.status_code, 200)
+        assert_equal(user, json.loads(r.data)['authentication']['user']['uri'])
+
+        r = self.client.delete(token['uri'], headers=[auth_header()])
+        assert_equal(r.status_code, 204)
+
+        r = self.client.get(self.uri_users, headers=[token_header, ('Range', 'items=0-20')])
+        assert_equal(r.status_code, 401)
+
+    def test_conditional_get(self):
+        """
+        Test conditional requests using ETag validators.
+        """
+        data = {'name': 'Test sample'}
+        r = self.client.post(self.uri_samples, data=data, headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        sample = json.loads(r.data)['sample']['uri']
+
+        r = self.client.get(sample, headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        etag = r.headers['ETag']
+        assert 'private' in r.headers['Cache-Control']
+
+        r = self.client.get(sample, headers=[auth_header(), ('If-None-Match', etag)])
+        assert_equal(r.status_code, 304)
+        assert_equal(r.data, '')
+
+        r = self.client.get(self.uri_samples, headers=[auth_header(), ('Range', 'items=0-20'), ('If-None-Match', etag)])
+        assert_equal(r.status_code, 206)
+        collection_etag = r.headers['ETag']
+
+        r = self.client.get(self.uri_samples, headers=[auth_header(), ('Range', 'items=0-20'), ('If-None-Match', collection_etag)])
+        assert_equal(r.status_code, 304)
+
+        r = self.client.get(self.uri_samples, headers=[auth_header(), ('Range', 'items=0-10'), ('If-None-Match', collection_etag)])
+        assert_equal(r.status_code, 206)
+
+        r = self.client.patch(sample, data={'public': True}, headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+
+        r = self.client.get(sample, headers=[auth_header(), ('If-None-Match', etag)])
+        assert_equal(r.status_code, 200)
+        assert etag != r.headers['ETag']
+        assert 'public' in r.headers['Cache-Control']
+
+        r = self.client.get(self.uri_samples, headers=[auth_header(), ('Range', 'items=0-20'), ('If-None-Match', collection_etag)])
+        assert_equal(r.status_code, 206)
+
+    def test_data_source_download(self):
+        """
+        Download data source data with byte-range and region requests.
+        """
+        data = {'name': 'Test data source',
+                'filetype': 'bed',
+                'data': open('tests/data/exome.bed')}
+        r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        data_source = r.headers['Location'].replace('http://localhost', '')
+        r = self.client.get(data_source, headers=[auth_header()])
+        data_source_data = json.loads(r.data)['data_source']['data']['uri']
+
+        r = self.client.get(data_source_data, headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        assert_equal(r.headers['Accept-Ranges'], 'bytes')
+        etag = r.headers['ETag']
+        complete = r.data
+        assert_equal(len(complete), int(r.headers['Content-Length']))
+        with open('tests/data/exome.bed') as f:
+            assert_equal(gzip.GzipFile(fileobj=StringIO(complete)).read(), f.read())
+
+        r = self.client.get(data_source_data, headers=[auth_header(), ('If-None-Match', etag)])
+        assert_equal(r.status_code, 304)
+
+        r = self.client.get(data_source_data, headers=[auth_header(), ('Range', 'bytes=10-109')])
+        assert_equal(r.status_code, 206)
+        assert_equal(r.data, complete[10:110])
+        assert_equal(r.headers['Content-Range'], 'bytes 10-109/%d' % len(complete))
+
+        r = self.client.get(data_source_data, headers=[auth_header(), ('Range', 'bytes=-10'), ('If-Range', etag)])
+        assert_equal(r.status_code, 206)
+        assert_equal(r.data, complete[-10:])
+
+        r = self.client.get(data_source_data, headers=[auth_header(), ('Range', 'bytes=-10'), ('If-Range', '"outdated"')])
+        assert_equal(r.status_code, 200)
+        assert_equal(r.data, complete)
+
+        r = self.client.get(data_source_data, headers=[auth_header(), ('Range', 'bytes=%d-' % len(complete))])
+        assert_equal(r.status_code, 416)
+
+        region = {'chromosome': 'chr20', 'begin': 76582, 'end': 90026}
+        r = self.client.get(data_source_data + '?__json__=' + json.dumps({'region': region}), headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        assert_equal(r.content_type, 'application/x-gzip')
+        assert r.headers['ETag'] != etag
+        assert_equal([line.split('\t')[1] for line in
+                      gzip.GzipFile(fileobj=StringIO(r.data)).read().splitlines()],
+                     ['76581', '90025'])
+
+        # Store the same data compressed differently.
+        with self.app.test_request_context():
+            path = DataSource.query.one().local_path()
+        with open('tests/data/exome.bed') as f, gzip.open(path, 'wb') as stored:
+            stored.write(f.read())
+        os.utime(path, (0, 0))
+
+        r = self.client.get(data_source_data, headers=[auth_header(), ('Range', 'bytes=-10'), ('If-Range', etag)])
+        assert_equal(r.status_code, 200)
+        assert r.headers['ETag'] != etag
+        assert r.data != complete
+
+    def test_data_source_download_accel_redirect(self):
+        """
+        Offload data source downloads to nginx.
+        """
+        self.app.config['DATA_X_ACCEL_REDIRECT'] = '/internal/data/'
+        data = {'name': 'Test data source',
+                'filetype': 'bed',
+                'data': open('tests/data/exome.bed')}
+        r = self.client.post(self.uri_data_sources, data=data, headers=[auth_header()])
+        data_source = r.headers['Location'].replace('http://localhost', '')
+        r = self.client.get(data_source, headers=[auth_header()])
+        data_source_data = json.loads(r.data)['data_source']['data']['uri']
+
+        r = self.client.get(data_source_data, headers=[auth_header()])
+        assert_equal(r.status_code, 200)
+        assert_equal(r.data, '')
+        assert r.headers['X-Accel-Redirect'].startswith('/internal/data/')
+        assert 'ETag' in r.headers
+
     def test_user_formdata(self):
         """
         Test user creation with HTTP formdata payload.
@@ -394,6 +607,67 @@ class TestApi():
         else:
             assert False
 
+    def test_delete_sample(self):
+        """
+        Delete a sample and purge its observations and regions.
+        """
+        sample, vcf_data_source, _ = self._import('Test sample', 'tests/data/exome-subset.vcf', 'tests/data/exome-subset.bed')
+        with self.app.test_request_context():
+            admin = User.query.filter_by(login='admin').one()
+            db.session.add(Sample(admin, 'Other sample'))
+            db.session.commit()
+
+        r = self.client.delete(sample, headers=[auth_header()])
+        assert_equal(r.status_code, 204)
+
+        r = self.client.get(sample, headers=[auth_header()])
+        assert_equal(r.status_code, 404)
+
+        r = self.client.get(vcf_data_source, headers=[auth_header()])
+        assert_equal(r.status_code, 404)
+
+        r = self.client.get(self.uri_samples, headers=[auth_header(), ('Range', 'items=0-20')])
+        assert_equal([s['name'] for s in json.loads(r.data)['sample_collection']['items']],
+                     ['Other sample'])
+
+        with self.app.test_request_context():
+            assert_equal(Sample.query.count(), 1)
+            assert_equal(Observation.query.count(), 0)
+            assert_equal(Region.query.count(), 0)
+
+    def test_deleted_sample_hidden(self):
+        """
+        Variations, coverages, and data sources of a deleted sample are
+        hidden while it is not yet purged.
+        """
+        sample, vcf_data_source, bed_data_source = self._import('Test sample', 'tests/data/exome-subset.vcf', 'tests/data/exome-subset.bed')
+
+        uris = {}
+        for name, collection in [('variation', self.uri_variations),
+                                 ('coverage', self.uri_coverages),
+                                 ('data_source', self.uri_data_sources)]:
+            r = self.client.get(collection, headers=[auth_header(), ('Range', 'items=0-20')])
+            uris[name] = [item['uri'] for item in
+                          json.loads(r.data)[name + '_collection']['items']]
+        assert_equal(len(uris['variation']), 1)
+        assert_equal(len(uris['coverage']), 1)
+        assert_equal(sorted(uris['data_source']),
+                     sorted([vcf_data_source, bed_data_source]))
+
+        with self.app.test_request_context():
+            Sample.query.one().deleted = True
+            db.session.commit()
+
+        for name, collection in [('variation', self.uri_variations),
+                                 ('coverage', self.uri_coverages),
+                                 ('data_source', self.uri_data_sources)]:
+            # An empty collection cannot satisfy any range.
+            r = self.client.get(collection, headers=[auth_header(), ('Range', 'items=0-20')])
+            assert_equal(r.status_code, 416)
+            for uri in uris[name]:
+                r = self.client.get(uri, headers=[auth_header()])
+                assert_equal(r.status_code, 404)
+
     def test_embed(self):
         """
         Serialized variation can have data source embedded.
@@ -832,6 +1106,49 @@ class TestApi():
         for sample in samples:
             assert sample['name'].startswith('Sample AB')
 
+    def test_sample_collection_embed_statements(self):
+        """
+        Number of SQL statements for listing samples with embedded resources
+        should not depend on the number of samples.
+        """
+        def add_samples(n):
+            with self.app.test_request_context():
+                admin = User.query.filter_by(login='admin').one()
+                group_a = Group('Group A')
+                group_b = Group('Group B')
+                db.session.add_all(Sample(admin, 'Sample %d' % i,
+                                          groups=[group_a, group_b])
+                                   for i in range(n))
+                db.session.commit()
+
+        def count_statements():
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            with self.app.app_context():
+                engine = db.engine
+            sqlalchemy.event.listen(engine, 'before_cursor_execute', listener)
+            try:
+                r = self.client.get(self.uri_samples, data={'embed': 'user,groups'},
+                                    headers=[auth_header(), ('Range', 'items=0-50')])
+            finally:
+                sqlalchemy.event.remove(engine, 'before_cursor_execute', listener)
+            assert_equal(r.status_code, 206)
+            samples = json.loads(r.data)['sample_collection']['items']
+            for sample in samples:
+                assert_equal(sample['user']['login'], 'admin')
+                assert_equal(len(sample['groups']), 2)
+            return len(samples), len(statements)
+
+        add_samples(2)
+        count_small, statements_small = count_statements()
+        assert_equal(count_small, 2)
+
+        add_samples(20)
+        count_large, statements_large = count_statements()
+        assert_equal(count_large, 22)
+
+        assert_equal(statements_small, statements_large)
+
     def test_annotate_resubmit(self):
         """
         Resubmit an annotation task.
@@ -0,0 +1,92 @@
+"""
+Tests for the `bgzf` module.
+"""
+
+
+import gzip
+import random
+import StringIO
+
+from nose.tools import assert_equal, assert_raises
+
+from varda.bgzf import BgzfError, BgzfReader, BgzfWriter, EOF_BLOCK
+
+
+class ClosingStringIO(StringIO.StringIO):
+    """
+    String buffer keeping its value after closing.
+    """
+    def close(self):
+        self.value = self.getvalue()
+        StringIO.StringIO.close(self)
+
+
+def write_bgzf(lines):
+    """
+    Write lines as BGZF data and return the data and the virtual offset of
+    every line.
+    """
+    fileobj = ClosingStringIO()
+    offsets = []
+    with BgzfWriter(fileobj) as writer:
+        for line in lines:
+            offsets.append(writer.tell())
+            writer.write(line)
+    return fileobj.value, offsets
+
+
+class TestBgzf:
+    def setup(self):
+        random.seed(1)
+        self.lines = ['%d\t%s\n' % (i, 'ACGT' * random.randint(0, 50))
+                      for i in range(20000)]
+
+    def test_gzip_compatible(self):
+        """
+        Read BGZF data with the gzip module.
+        """
+        data, _ = write_bgzf(self.lines)
+        assert data.endswith(EOF_BLOCK)
+        assert_equal(gzip.GzipFile(fileobj=StringIO.StringIO(data)).read(),
+                     ''.join(self.lines))
+
+    def test_read(self):
+        """
+        Read BGZF data.
+        """
+        data, _ = write_bgzf(self.lines)
+        reader = BgzfReader(StringIO.StringIO(data))
+        assert_equal(reader.read(10), ''.join(self.lines)[:10])
+        assert_equal(reader.read(), ''.join(self.lines)[10:])
+        assert_equal(reader.read(), '')
+
+    def test_seek(self):
+        """
+        Seek to virtual offsets in BGZF data.
+        """
+        data, offsets = write_bgzf(self.lines)
+        reader = BgzfReader(StringIO.StringIO(data))
+        assert_equal(list(reader), self.lines)
+        for i in random.sample(range(len(self.lines)), 100):
+            reader.seek(offsets[i])
+            assert_equal(reader.readline(), self.lines[i])
+            if i + 1 < len(self.lines):
+                assert_equal(reader.tell(), offsets[i + 1])
+
+    def test_empty(self):
+        """
+        Read empty BGZF data.
+        """
+        data, _ = write_bgzf([])
+        assert_equal(data, EOF_BLOCK)
+        assert_equal(BgzfReader(StringIO.StringIO(data)).read(), '')
+
+    def test_invalid(self):
+        """
+        Read invalid BGZF data.
+        """
+        data, _ = write_bgzf(self.lines)
+        with assert_raises(BgzfError):
+            BgzfReader(StringIO.StringIO(data[1:]))
+        with assert_raises(BgzfError):
+            BgzfReader(StringIO.StringIO(data[:100]))
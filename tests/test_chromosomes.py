@@ -0,0 +1,83 @@
+"""
+Tests for the `chromosomes` module.
+"""
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from varda.chromosomes import ChromosomeNames, read_aliases
+
+
+ALIASES = [['M', 'MT', 'NC_012920.1'],
+           ['chr1_gl000191_random', 'GL000191.1']]
+
+
+class Reference(object):
+    """
+    Minimal stand-in for a reference genome.
+    """
+    def __init__(self, names):
+        self.names = names
+
+    def keys(self):
+        return self.names
+
+
+class TestChromosomes:
+    def test_normalize(self):
+        """
+        Normalize chromosome names with a reference genome.
+        """
+        names = ChromosomeNames()
+        names.init(Reference(['chr1', 'M', 'chr1_gl000191_random']),
+                   ALIASES)
+        assert_equal(names.normalize('1'), 'chr1')
+        assert_equal(names.normalize('chr1'), 'chr1')
+        assert_equal(names.normalize('chrMT'), 'M')
+        assert_equal(names.normalize('NC_012920.1'), 'M')
+        assert_equal(names.normalize('GL000191.1'), 'chr1_gl000191_random')
+        assert_equal(names.normalize('2'), None)
+        assert_equal(names.normalize('chr2'), None)
+
+    def test_normalize_without_reference(self):
+        """
+        Normalize chromosome names without a reference genome.
+        """
+        names = ChromosomeNames()
+        names.init(None, ALIASES)
+        assert_equal(names.normalize('chr1'), '1')
+        assert_equal(names.normalize('MT'), 'M')
+        assert_equal(names.normalize('chrM'), 'M')
+        assert_equal(names.normalize('GL000191.1'), 'chr1_gl000191_random')
+
+    def test_init(self):
+        """
+        Forget normalized names on reconfiguration.
+        """
+        names = ChromosomeNames()
+        names.init(Reference(['1']))
+        assert_equal(names.normalize('chr1'), '1')
+        names.init(Reference(['chr1']))
+        assert_equal(names.normalize('chr1'), 'chr1')
+
+    def test_read_aliases(self):
+        """
+        Read chromosome aliases from a file.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'aliases.txt')
+            with open(filename, 'w') as f:
+                f.write('# UCSC\tGRCh37\tRefSeq\n'
+                        'chrM\tMT\tNC_012920.1\n'
+                        '\n'
+                        'chr1_gl000191_random GL000191.1\n')
+            assert_equal(read_aliases(filename),
+                         [['chrM', 'MT', 'NC_012920.1'],
+                          ['chr1_gl000191_random', 'GL000191.1']])
+        finally:
+            shutil.rmtree(directory)
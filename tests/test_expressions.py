@@ -292,6 +292,32 @@ class TestExpressions:
         for string, clause in self._expressions_clauses:
             yield test_expression, string, clause
 
+    def test_evaluate_bitset(self):
+        """
+        Evaluate a query expression to a bitset.
+        """
+        groups = {'1': 0b0110, '2': 0b1100}
+
+        def evaluate_clause(field, value):
+            if field == 's':
+                return 1 << int(value)
+            return groups[value]
+
+        def test_expression(string, expected):
+            expression = expressions.parse(string)
+            assert_equal(expressions.evaluate_bitset(expression, evaluate_clause, 0b1111),
+                         expected)
+
+        for string, bitset in [('*', 0b1111),
+                               ('s:0', 0b0001),
+                               ('not s:0', 0b1110),
+                               ('g:1 or g:2', 0b1110),
+                               ('g:1 and g:2', 0b0100),
+                               ('g:1 and not g:2', 0b0010),
+                               ('not (g:1 or s:0)', 0b1000),
+                               ('s:0 or g:1 and not s:2', 0b0011)]:
+            yield test_expression, string, bitset
+
     def test_update_clause_values(self):
         """
         Update values in all clauses in a query expression AST.
@@ -0,0 +1,120 @@
+"""
+Tests for the `genome` module.
+"""
+
+
+import os
+import random
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_raises
+
+from varda.genome import Genome, read_fai
+
+
+class TestGenome:
+    """
+    Test the memory-mapped genome against ``pyfaidx``.
+    """
+    _chromosomes = [('chr1', 73, 60, '\n'),
+                    ('chr2', 120, 60, '\n'),
+                    ('chrM', 250, 70, '\r\n'),
+                    ('chrY', 5, 60, '\n')]
+
+    def setup(self):
+        random.seed(1)
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'genome.fa')
+        self.sequences = {}
+        with open(self.filename, 'wb') as fasta:
+            for name, length, width, newline in self._chromosomes:
+                sequence = ''.join(random.choice('ACGTN') for _ in
+                                   range(length))
+                self.sequences[name] = sequence
+                fasta.write('>%s%s' % (name, newline))
+                for i in range(0, length, width):
+                    fasta.write(sequence[i:i + width] + newline)
+        self.genome = Genome()
+        self.genome.init(self.filename, as_raw=True)
+        self.mapped_genome = Genome()
+        self.mapped_genome.init(self.filename, as_raw=True, mmap=True)
+
+    def teardown(self):
+        self.mapped_genome.close_mapping()
+        shutil.rmtree(self.directory)
+
+    def test_init(self):
+        """
+        Initialize genome.
+        """
+        assert not Genome()
+        assert self.mapped_genome
+        assert self.mapped_genome.mapped
+        assert not self.genome.mapped
+        assert_equal(sorted(self.mapped_genome.keys()),
+                     sorted(self.sequences))
+        assert 'chr1' in self.mapped_genome
+        assert 'chr3' not in self.mapped_genome
+
+    def test_length(self):
+        """
+        Chromosome lengths.
+        """
+        for name, sequence in self.sequences.items():
+            assert_equal(len(self.mapped_genome[name]), len(sequence))
+
+    def test_slices(self):
+        """
+        Slices of chromosome sequences, including slices spanning lines and
+        slices out of bounds.
+        """
+        for name, _, _, newline in self._chromosomes:
+            sequence = self.sequences[name]
+            length = len(sequence)
+            for start in range(-2, length + 2):
+                for stop in range(start, length + 3):
+                    assert_equal(self.mapped_genome[name][start:stop],
+                                 sequence[start:stop])
+                    # Sequences with CRLF newlines are not read correctly by
+                    # pyfaidx.
+                    if newline == '\n' and 0 <= start < stop <= length:
+                        assert_equal(self.mapped_genome[name][start:stop],
+                                     self.genome[name][start:stop])
+
+    def test_positions(self):
+        """
+        Single positions of chromosome sequences.
+        """
+        for name, sequence in self.sequences.items():
+            for position in range(-len(sequence), len(sequence)):
+                assert_equal(self.mapped_genome[name][position],
+                             sequence[position])
+            with assert_raises(IndexError):
+                self.mapped_genome[name][len(sequence)]
+
+    def test_reference_genome(self):
+        """
+        Memory-map the reference genome used in the tests, with its existing
+        index file.
+        """
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'hg19.fa')
+        index = read_fai(filename + '.fai')
+        genome = Genome()
+        genome.init(filename, as_raw=True)
+        mapped_genome = Genome()
+        mapped_genome.init(filename, as_raw=True, mmap=True)
+        try:
+            assert_equal(sorted(mapped_genome.keys()), sorted(index))
+            for name, record in index.items():
+                length = len(genome[name])
+                assert_equal(record.length, length)
+                assert_equal(len(mapped_genome[name]), length)
+                for _ in range(100):
+                    start = random.randint(0, length - 1)
+                    stop = start + random.randint(1, 500)
+                    assert_equal(mapped_genome[name][start:stop],
+                                 genome[name][start:stop])
+        finally:
+            mapped_genome.close_mapping()
+            genome.close()
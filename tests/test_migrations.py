@@ -0,0 +1,184 @@
+"""
+Test Alembic migrations.
+"""
+
+
+import argparse
+import os
+
+import fixtures; fixtures.monkey_patch_fixture()
+from alembic.config import Config
+from alembic.operations import Operations
+from alembic.runtime.environment import EnvironmentContext
+from alembic.script import ScriptDirectory
+from fixture import SQLAlchemyFixture
+from fixture.style import NamedDataStyle
+from flask.ext.testing import TestCase
+from nose.plugins.skip import SkipTest
+from nose.tools import *
+
+from varda import create_app, db, models, partitioning
+from varda.commands import database_partition
+from varda.models import Coverage, Observation, Region, Variation
+from varda import tasks
+
+from fixtures import CoverageData, VariationData
+from test_tasks import POSTGRESQL_URI, TEST_SETTINGS
+
+
+ALEMBIC_CONFIG = os.path.join(os.path.dirname(__file__), os.pardir,
+                              'alembic.ini')
+
+
+def run_migration(revision, direction, *x_arguments):
+    """
+    Run the upgrade or downgrade of a single migration on the test database,
+    with Alembic ``-x`` arguments.
+    """
+    config = Config(ALEMBIC_CONFIG)
+    config.cmd_opts = argparse.Namespace(x=list(x_arguments))
+    script = ScriptDirectory.from_config(config)
+    with EnvironmentContext(config, script) as environment:
+        environment.configure(connection=db.session.connection())
+        with Operations.context(environment.get_context()):
+            getattr(script.get_revision(revision).module, direction)()
+    db.session.commit()
+
+
+def partitioned_tables():
+    """
+    Names of the partitioned tables in the test database.
+    """
+    return sorted(name for name, in db.session.execute(
+        'SELECT c.relname FROM pg_partitioned_table p '
+        'JOIN pg_class c ON c.oid = p.partrelid'))
+
+
+class TestMigrationsPostgresql(TestCase):
+    """
+    Test migrations that only do something on PostgreSQL.
+    """
+    def create_app(self):
+        return create_app(dict(TEST_SETTINGS, SQLALCHEMY_DATABASE_URI=
+                               POSTGRESQL_URI or 'sqlite://'))
+
+    def setUp(self):
+        """
+        Run once before every test. Setup the test database.
+        """
+        if not POSTGRESQL_URI:
+            raise SkipTest('VARDA_TEST_POSTGRESQL_URI is not set')
+        db.create_all()
+        self.fixture = SQLAlchemyFixture(env=models, style=NamedDataStyle(), engine=db.engine)
+
+    def tearDown(self):
+        """
+        Run once after every test. Drop the test database.
+        """
+        db.session.remove()
+        if POSTGRESQL_URI:
+            db.drop_all()
+
+    def import_data(self, data):
+        variation = Variation.query.get(
+            data.VariationData.exome_subset_variation.id)
+        coverage = Coverage.query.get(
+            data.CoverageData.exome_subset_coverage.id)
+        tasks.import_variation.delay(variation.id)
+        tasks.import_coverage.delay(coverage.id)
+
+    def import_more_data(self, data):
+        variation = Variation.query.get(
+            data.VariationData.exome_variation.id)
+        coverage = Coverage.query.get(data.CoverageData.exome_coverage.id)
+        tasks.import_variation.delay(variation.id)
+        tasks.import_coverage.delay(coverage.id)
+
+    def table_contents(self):
+        return ([(o.id, o.chromosome, o.position, o.observed)
+                 for o in Observation.query.order_by(Observation.id)],
+                [(r.id, r.chromosome, r.begin, r.end)
+                 for r in Region.query.order_by(Region.id)])
+
+    def test_partition_by_chromosome(self):
+        """
+        Partition observation and region tables by chromosome and back.
+        """
+        with self.fixture.data(CoverageData, VariationData) as data:
+            self.import_data(data)
+            contents = self.table_contents()
+            assert len(contents[0]) > 0
+            assert len(contents[1]) > 0
+
+            run_migration('4a6d1e3c9b20', 'upgrade')
+            assert_equal(partitioned_tables(), [])
+
+            run_migration('4a6d1e3c9b20', 'upgrade', 'partition=chromosome')
+            assert_equal(partitioned_tables(), ['observation', 'region'])
+            db.session.expire_all()
+            assert_equal(self.table_contents(), contents)
+
+            # The id sequences moved with the data.
+            self.import_more_data(data)
+            contents = self.table_contents()
+            assert_equal(len(set(o[0] for o in contents[0])),
+                         len(contents[0]))
+
+            run_migration('4a6d1e3c9b20', 'downgrade')
+            assert_equal(partitioned_tables(), [])
+            db.session.expire_all()
+            assert_equal(self.table_contents(), contents)
+
+    def test_partition_by_chromosome_missing(self):
+        """
+        Do not partition if an observation has no chromosome.
+        """
+        with self.fixture.data(CoverageData, VariationData) as data:
+            self.import_data(data)
+            contents = self.table_contents()
+            Observation.query.filter_by(id=contents[0][0][0]).update(
+                {'chromosome': None})
+            db.session.commit()
+
+            assert_raises(ValueError, run_migration, '4a6d1e3c9b20',
+                          'upgrade', 'partition=chromosome')
+            db.session.rollback()
+            assert_equal(partitioned_tables(), [])
+            assert_equal(Observation.query.count(), len(contents[0]))
+
+    def test_partition_command(self):
+        """
+        Partition by chromosome with the partition command, and add
+        partitions for new chromosomes.
+        """
+        with self.fixture.data(CoverageData, VariationData) as data:
+            self.import_data(data)
+            contents = self.table_contents()
+            db.session.commit()
+            db.session.remove()
+
+            database_partition(self.app)
+            assert_equal(partitioned_tables(), ['observation', 'region'])
+            assert_equal(self.table_contents(), contents)
+
+            coverage = Coverage.query.get(
+                data.CoverageData.exome_subset_coverage.id)
+            db.session.add(Region(coverage, 'chrNew', 1000, 2000))
+            db.session.commit()
+            assert_equal(db.session.execute(
+                "SELECT count(*) FROM region_default").scalar(), 1)
+            db.session.remove()
+
+            database_partition(self.app)
+            assert_equal(db.session.execute(
+                "SELECT count(*) FROM region_default").scalar(), 0)
+            assert_equal(Region.query.filter_by(chromosome='chrNew').count(),
+                         1)
+            db.session.remove()
+
+            # Running it again does nothing.
+            database_partition(self.app)
+
+            with db.engine.begin() as connection:
+                partitioning.unpartition(connection)
+            assert_equal(partitioned_tables(), [])
@@ -0,0 +1,117 @@
+"""
+Tests for the `observation_store` module.
+"""
+
+
+import random
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from varda.observation_store import ObservationStore, ZYGOSITIES
+
+
+def random_observations(n):
+    """
+    Random observations as tuples of position, reference, observed, sample
+    id, zygosity, and support, ordered by position.
+    """
+    return sorted((random.randint(1, 1000),
+                   random.choice(['A', 'C', '']),
+                   random.choice(['T', 'GG', '']),
+                   random.randint(1, 10),
+                   random.choice(ZYGOSITIES),
+                   random.randint(1, 5))
+                  for _ in range(n))
+
+
+class TestObservationStore:
+    def setup(self):
+        random.seed(1)
+        self.directory = tempfile.mkdtemp()
+        self.store = ObservationStore()
+        self.store.init(self.directory)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disabled(self):
+        """
+        Disabled store has no snapshot.
+        """
+        store = ObservationStore()
+        assert not store.enabled
+        assert store.snapshot() is None
+
+    def test_write(self):
+        """
+        Write and incrementally update the store.
+        """
+        assert self.store.snapshot() is None
+        observations = {'chr1': random_observations(500),
+                        'chr2': random_observations(100)}
+        with self.store.lock():
+            self.store.write(1, 600, observations)
+        snapshot = self.store.snapshot()
+        assert_equal(snapshot.generation, 1)
+        assert_equal(snapshot.rows, 600)
+
+        new_observations = {'chr1': random_observations(200),
+                            'chr3': random_observations(10)}
+        with self.store.lock():
+            self.store.write(2, 810, new_observations)
+        snapshot = self.store.snapshot()
+        assert_equal(snapshot.generation, 2)
+        assert_equal(snapshot.watermark, 810)
+        assert_equal(snapshot.rows, 810)
+
+        all_observations = {
+            'chr1': observations['chr1'] + new_observations['chr1'],
+            'chr2': observations['chr2'],
+            'chr3': new_observations['chr3']}
+        for chromosome, expected in all_observations.items():
+            rows = list(snapshot.chromosome(chromosome).rows())
+            assert_equal(sorted(rows), sorted(expected))
+            positions = [row[0] for row in rows]
+            assert_equal(positions, sorted(positions))
+
+        sample_ids = {1, 2, 3}
+        for position, reference, observed, _, _, _ in all_observations['chr1']:
+            expected = {}
+            for row in all_observations['chr1']:
+                if (row[:3] == (position, reference, observed) and
+                    row[3] in sample_ids):
+                    expected[row[4]] = expected.get(row[4], 0) + row[5]
+            assert_equal(snapshot.support('chr1', position, reference,
+                                          observed, sample_ids),
+                         expected)
+        assert_equal(snapshot.support('chr4', 1, 'A', 'T', sample_ids), {})
+
+        expected = sorted({row[:3] for row in all_observations['chr1']
+                           if 100 <= row[0] <= 200 and row[3] in sample_ids})
+        assert_equal(sorted(snapshot.variants('chr1', 100, 200, sample_ids)),
+                     expected)
+
+    def test_replace(self):
+        """
+        Replace all observations in the store.
+        """
+        with self.store.lock():
+            self.store.write(1, 100, {'chr1': random_observations(100)})
+            self.store.write(2, 110, {'chr2': random_observations(10)},
+                             replace=True)
+        snapshot = self.store.snapshot()
+        assert snapshot.chromosome('chr1') is None
+        assert_equal(snapshot.rows, 10)
+
+    def test_empty(self):
+        """
+        Write a chromosome without observations.
+        """
+        with self.store.lock():
+            self.store.write(1, 0, {'chr1': []})
+        snapshot = self.store.snapshot()
+        assert_equal(snapshot.rows, 0)
+        assert_equal(snapshot.support('chr1', 1, 'A', 'T', {1}), {})
+        assert_equal(snapshot.variants('chr1', 1, 100, {1}), [])
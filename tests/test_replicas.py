@@ -0,0 +1,182 @@
+"""
+Unit tests for :mod:`varda.replicas`.
+"""
+
+
+from datetime import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from varda import create_app, db
+from varda.api.resources import UsersResource
+from varda.models import User
+
+
+TEST_SETTINGS = {
+    'TESTING': True,
+    'BROKER_URL': 'memory://',
+    'CELERY_RESULT_BACKEND': 'cache',
+    'CELERY_CACHE_BACKEND': 'memory',
+    'CELERY_ALWAYS_EAGER': True,
+    'CELERY_EAGER_PROPAGATES_EXCEPTIONS': True
+}
+
+
+def auth_header(login='admin', password='test'):
+    """
+    HTTP Basic Authentication header for a test user.
+    """
+    user = '%s:%s' % (login, password)
+    return ('AUTHORIZATION', 'BASIC ' + user.encode('base64'))
+
+
+class TestReplicas():
+    """
+    Test routing of queries to a replica, using two SQLite databases that
+    (deliberately) do not have the same content.
+    """
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        settings = dict(TEST_SETTINGS, DATA_DIR=self.directory)
+        settings['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
+            self.directory, 'primary.db')
+        settings['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///' + os.path.join(
+            self.directory, 'replica.db')]
+        self.app = create_app(settings)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            replica = db.get_engine(self.app, bind='replica0')
+            db.create_all()
+            db.Model.metadata.create_all(replica)
+            for name, engine in [('Primary', db.engine), ('Replica', replica)]:
+                engine.execute(User.__table__.insert(), [
+                    {'name': 'Test Admin', 'login': 'admin',
+                     'password_hash': User.hash_password('test'),
+                     'roles_bitstring': User._encode_roles(['admin']),
+                     'added': datetime.now()},
+                    {'name': name + ' User', 'login': 'user',
+                     'password_hash': User.hash_password('test'),
+                     'roles_bitstring': 0, 'added': datetime.now()}])
+
+    def teardown(self):
+        with self.app.app_context():
+            db.session.remove()
+        shutil.rmtree(self.directory)
+
+    def user_names(self):
+        return [user.name for user in User.query.order_by(User.id)]
+
+    def test_primary(self):
+        """
+        Without using a replica, everything goes to the primary.
+        """
+        with self.app.app_context():
+            assert_equal(self.user_names(), ['Test Admin', 'Primary User'])
+
+    def test_using_replica(self):
+        """
+        Read from the replica inside a using_replica block.
+        """
+        with self.app.app_context():
+            with db.using_replica():
+                assert_equal(self.user_names(), ['Test Admin', 'Replica User'])
+            db.session.expire_all()
+            assert_equal(self.user_names(), ['Test Admin', 'Primary User'])
+
+    def test_read_your_writes(self):
+        """
+        After a write, further reads go to the primary.
+        """
+        with self.app.app_context():
+            with db.using_replica():
+                assert_equal(self.user_names(), ['Test Admin', 'Replica User'])
+                db.session.add(User('Another User', 'another', 'test'))
+                db.session.commit()
+                assert_equal(self.user_names(),
+                             ['Test Admin', 'Primary User', 'Another User'])
+
+    def test_read_your_bulk_writes(self):
+        """
+        After a bulk update, further reads go to the primary.
+        """
+        with self.app.app_context():
+            with db.using_replica():
+                User.query.filter_by(login='user').update(
+                    {'name': 'Updated User'}, synchronize_session=False)
+                assert_equal(self.user_names(), ['Test Admin', 'Updated User'])
+
+    def test_caught_up(self):
+        """
+        Only use the replica if it has caught up with the primary on the
+        tables read.
+        """
+        with self.app.app_context():
+            with db.using_replica(['user', 'sample']):
+                assert_equal(self.user_names(), ['Test Admin', 'Replica User'])
+            db.session.expire_all()
+            db.session.add(User('Another User', 'another', 'test'))
+            db.session.commit()
+            with db.using_replica(['sample']):
+                assert_equal(self.user_names(), ['Test Admin', 'Replica User'])
+            db.session.expire_all()
+            with db.using_replica(['user', 'sample']):
+                assert_equal(self.user_names(),
+                             ['Test Admin', 'Primary User', 'Another User'])
+
+    def user_collection(self):
+        r = self.client.get('/')
+        uri_users = json.loads(r.data)['root']['user_collection']['uri']
+        r = self.client.get(uri_users, headers=[auth_header(),
+                                                ('Range', 'items=0-20')])
+        assert_equal(r.status_code, 206)
+        return [user['name'] for user in
+                json.loads(r.data)['user_collection']['items']]
+
+    def test_get_request(self):
+        """
+        GET requests are routed to the primary, unless the resource opted in.
+        """
+        assert_equal(self.user_collection(), ['Test Admin', 'Primary User'])
+        UsersResource.replica_views = ['list']
+        try:
+            assert_equal(self.user_collection(), ['Test Admin', 'Replica User'])
+        finally:
+            del UsersResource.replica_views
+
+    def test_get_request_after_write(self):
+        """
+        GET requests are routed to the primary if the replica is lagging.
+        """
+        r = self.client.get('/')
+        uri_users = json.loads(r.data)['root']['user_collection']['uri']
+        r = self.client.post(uri_users, data={'name': 'Another User',
+                                              'login': 'another',
+                                              'password': 'test'},
+                             headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        UsersResource.replica_views = ['list']
+        try:
+            assert_equal(self.user_collection(),
+                         ['Test Admin', 'Primary User', 'Another User'])
+        finally:
+            del UsersResource.replica_views
+
+    def test_post_request(self):
+        """
+        Other requests are routed to the primary.
+        """
+        r = self.client.get('/')
+        uri_users = json.loads(r.data)['root']['user_collection']['uri']
+        r = self.client.post(uri_users, data={'name': 'Another User',
+                                              'login': 'another',
+                                              'password': 'test'},
+                             headers=[auth_header()])
+        assert_equal(r.status_code, 201)
+        with self.app.app_context():
+            assert_equal(self.user_names(),
+                         ['Test Admin', 'Primary User', 'Another User'])
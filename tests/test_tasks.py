@@ -3,21 +3,27 @@ Test Celery tasks.
 """
 
 
+import gzip
+import hashlib
 import os
 import StringIO
 import tempfile
+import uuid
 
 import fixtures; fixtures.monkey_patch_fixture()
 from fixture import SQLAlchemyFixture
 from fixture.style import NamedDataStyle
 from flask.ext.testing import TestCase
+from nose.plugins.skip import SkipTest
 from nose.tools import *
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, func
 import vcf
+from werkzeug.datastructures import FileStorage
 
-from varda import create_app, db, models
+from varda import create_app, db, models, observation_store, region_index
 from varda.models import Annotation, Coverage, DataSource, Observation, Query, Region, User, Variation
-from varda import expressions, tasks, utils
+from varda import alleles, expressions, tasks, utils
+from varda.region_index import read_index
 
 from fixtures import AnnotationData, CoverageData, DataSourceData, SampleData, VariationData
 
@@ -38,6 +44,21 @@ TEST_SETTINGS = {
 }
 
 
+# PostgreSQL database for tests depending on its query planner (these tests
+# are skipped if it is not set).
+POSTGRESQL_URI = os.environ.get('VARDA_TEST_POSTGRESQL_URI')
+
+
+def query_plan(query, explain='EXPLAIN', **params):
+    """
+    Get the steps of the query plan for a query (or Core statement), with
+    values for any unset bind parameters.
+    """
+    statement = getattr(query, 'statement', query).compile()
+    return [tuple(row)[-1] for row in db.session.execute(
+        '%s %s' % (explain, statement), dict(statement.params, **params))]
+
+
 class TestTasks(TestCase):
     """
     Test Celery tasks, by calling them in various ways.
@@ -79,6 +100,189 @@ class TestTasks(TestCase):
         """
         assert_equal(tasks.ping.delay().result, 'pong')
 
+    def test_session_removed(self):
+        """
+        The database session is removed after a task run on a worker, but not
+        after an eager task.
+        """
+        session = db.session()
+        tasks.ping.apply()
+        assert db.session() is session
+
+        tasks.ping.after_return('SUCCESS', 'pong', 'id', (), {}, None)
+        assert db.session() is not session
+
+    def test_generations(self):
+        """
+        Increment generation counters once per committed transaction.
+        """
+        def generation():
+            return models.Generation.current(['user', 'token'])[0]
+
+        assert_equal(generation(), (0, 0))
+
+        user = User('Test User', 'test_user_generations', 'test')
+        db.session.add(user)
+        db.session.flush()
+        user.name = 'Changed'
+        db.session.flush()
+        db.session.commit()
+        assert_equal(generation(), (0, 1))
+
+        db.session.add(models.Token(user, 'Test token'))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert_equal(generation(), (0, 1))
+
+        db.session.add(models.Token(user, 'Test token'))
+        db.session.commit()
+        assert_equal(generation(), (1, 2))
+
+    def test_data_source_digest(self):
+        """
+        Calculate data source digests on creation.
+        """
+        with self.fixture.data(DataSourceData) as data:
+            data_source = DataSource.query.get(
+                data.DataSourceData.exome_variation.id)
+            assert_equal(data_source.checksum, None)
+            tasks.digest_data_source.delay(data_source.id)
+            with open(os.path.join(TEST_SETTINGS['SECONDARY_DATA_DIR'],
+                                   'exome.vcf')) as f:
+                expected = f.read()
+            assert_equal(data_source.checksum,
+                         hashlib.sha1(expected).hexdigest())
+            assert_equal(data_source.records, expected.count('\n'))
+
+        user = User('Test User', 'test_user_digest', 'test')
+        for gzipped in (False, True):
+            upload = StringIO.StringIO()
+            if gzipped:
+                with gzip.GzipFile(fileobj=upload, mode='wb') as f:
+                    f.write(expected)
+            else:
+                upload.write(expected)
+            upload.seek(0)
+            data_source = DataSource(user, 'Test', 'vcf',
+                                     upload=FileStorage(upload),
+                                     gzipped=gzipped)
+            assert_equal(data_source.checksum,
+                         hashlib.sha1(expected).hexdigest())
+            assert_equal(data_source.records, expected.count('\n'))
+            with data_source.data() as f:
+                assert_equal(f.read(), expected)
+
+    def test_data_source_invalid_gzip(self):
+        """
+        Reject invalid gzip-compressed uploads.
+        """
+        upload = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=upload, mode='wb') as f:
+            f.write('chr20\t76962\t.\tT\tC\t.\tPASS\t.\n' * 1000)
+        user = User('Test User', 'test_user_invalid_gzip', 'test')
+        for data in ('plain text\n', upload.getvalue()[:-10]):
+            with assert_raises(models.InvalidDataSource) as cm:
+                DataSource(user, 'Test', 'vcf',
+                           upload=FileStorage(StringIO.StringIO(data)),
+                           gzipped=True)
+            assert_equal(cm.exception.code, 'invalid_data')
+
+    def test_data_source_region(self):
+        """
+        Iterate over records in a region of a data source.
+        """
+        lines = ['##fileformat=VCFv4.1\n',
+                 '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n']
+        for chromosome in ('chr1', 'chr2'):
+            for i in range(1, 10000):
+                lines.append('%s\t%d\t.\t%s\tT\t.\tPASS\t.\n'
+                             % (chromosome, i * 10, 'A' * (i % 30 + 1)))
+        expected = ''.join(lines)
+
+        def overlapping(chromosome, begin, end):
+            return [line for line in lines if not line.startswith('#') and
+                    line.split('\t')[0] == chromosome and
+                    int(line.split('\t')[1]) <= end and
+                    int(line.split('\t')[1]) + len(line.split('\t')[3]) > begin]
+
+        user = User('Test User', 'test_user_region', 'test')
+        for gzipped in (False, True):
+            upload = StringIO.StringIO()
+            if gzipped:
+                with gzip.GzipFile(fileobj=upload, mode='wb') as f:
+                    f.write(expected)
+            else:
+                upload.write(expected)
+            upload.seek(0)
+            data_source = DataSource(user, 'Test', 'vcf',
+                                     upload=FileStorage(upload),
+                                     gzipped=gzipped)
+            index = read_index(data_source.index_path())
+            assert index is not None
+            data_source.index_data()
+            assert_equal(read_index(data_source.index_path()), index)
+            for chromosome, begin, end in [('chr1', 1, 100),
+                                           ('chr1', 50000, 50100),
+                                           ('chr2', 99950, 200000),
+                                           ('chr2', 1, 1),
+                                           ('chr3', 1, 100000)]:
+                assert_equal(list(data_source.region(chromosome, begin, end)),
+                             overlapping(chromosome, begin, end))
+            assert_equal(len(list(data_source.region('chr1'))), 9999)
+
+        data_source = DataSource(user, 'Test', 'bed', local_file='exome.bed')
+        db.session.add(data_source)
+        db.session.commit()
+        for indexed in (False, True):
+            if indexed:
+                tasks.digest_data_source.delay(data_source.id)
+            assert_equal(os.path.isfile(data_source.index_path()), indexed)
+            assert_equal([line.split('\t')[1]
+                          for line in data_source.region('chr20', 76582,
+                                                         90026)],
+                         ['76581', '90025'])
+
+    def test_data_source_long_line(self):
+        """
+        Do not index data with too long lines, without buffering them.
+        """
+        header = '##fileformat=VCFv4.1\n##comment=%s\n' % ('x' * 5000)
+        records = ''.join('chr1\t%d\t.\tA\tT\t.\tPASS\t.\n' % (i * 10)
+                          for i in range(1, 10000))
+        user = User('Test User', 'test_user_long_line', 'test')
+
+        max_line_length = region_index.MAX_LINE_LENGTH
+        try:
+            for cap, indexed in ((10000, True), (1000, False)):
+                region_index.MAX_LINE_LENGTH = cap
+                upload = StringIO.StringIO()
+                with gzip.GzipFile(fileobj=upload, mode='wb') as f:
+                    f.write(header + records)
+                upload.seek(0)
+                data_source = DataSource(user, 'Test', 'vcf',
+                                         upload=FileStorage(upload),
+                                         gzipped=True)
+                assert_equal(os.path.isfile(data_source.index_path()),
+                             indexed)
+
+                # Lines split over many writes.
+                data_source = DataSource(user, 'Test', 'vcf', empty=True)
+                with data_source.data_writer() as data:
+                    for i in range(0, len(header + records), 100):
+                        data.write((header + records)[i:i + 100])
+                index = read_index(data_source.index_path())
+                assert_equal(index is not None, indexed)
+                if indexed:
+                    data_source.index_data()
+                    assert_equal(read_index(data_source.index_path()), index)
+                with data_source.data() as f:
+                    assert_equal(f.read(), header + records)
+                assert_equal(len(list(data_source.region('chr1', 1, 100))),
+                             10)
+        finally:
+            region_index.MAX_LINE_LENGTH = max_line_length
+
     def test_import_coverage(self):
         """
         Import a coverage file.
@@ -131,6 +335,392 @@ class TestTasks(TestCase):
             assert_equal(cm.exception.code, 'duplicate_data_source')
             assert not coverage.task_done
 
+    def test_purge_sample(self):
+        """
+        Delete a sample and its observations and regions in batches.
+        """
+        with self.fixture.data(DataSourceData) as data:
+            # The sample and its data sources must not be loaded by the
+            # fixture, since they will be deleted.
+            user = User.query.get(data.UserData.test_user.id)
+            coverage_data_source = DataSource(user, 'Test coverage', 'bed',
+                                              local_file='exome-subset.bed')
+            variation_data_source = DataSource(user, 'Test variants', 'vcf',
+                                               local_file='exome-subset.vcf')
+            sample = models.Sample(user, 'Test sample')
+            coverage = Coverage(sample, coverage_data_source)
+            variation = Variation(sample, variation_data_source)
+            db.session.add_all([coverage, variation])
+            db.session.commit()
+            sample_id = sample.id
+            tasks.import_coverage.delay(coverage.id)
+            tasks.import_variation.delay(variation.id)
+            observations = variation.observations.count()
+            assert observations > 10
+
+            batches = list(tasks.delete_in_batches(
+                Observation, Observation.variation_id == variation.id,
+                batch_size=10))
+            assert_equal(sum(batches), observations)
+            assert all(0 < batch <= 10 for batch in batches)
+            assert_equal(variation.observations.count(), 0)
+
+            query = Query('SAMPLE', expressions.parse('sample:%d' % sample_id),
+                          require_active=False)
+            assert_equal(query.samples, [sample])
+            sample.deleted = True
+            db.session.commit()
+            query = Query('SAMPLE', expressions.parse('sample:%d' % sample_id),
+                          require_active=False)
+            assert_equal(query.samples, [])
+
+            assert variation_data_source.deleted
+            other_data_source_id = data.DataSourceData.exome_variation.id
+            assert not DataSource.query.get(other_data_source_id).deleted
+
+            # Purges still queued or running are not queued again.
+            task_id = str(uuid.uuid4())
+            sample.purge_task_uuid = task_id
+            db.session.commit()
+            tasks.purge_deleted_samples.delay()
+            assert models.Sample.query.get(sample_id) is not None
+            tasks.purge_sample.backend.store_result(task_id, None, 'PROGRESS')
+            tasks.purge_deleted_samples.delay()
+            assert models.Sample.query.get(sample_id) is not None
+
+            tasks.purge_sample.backend.store_result(
+                task_id, tasks.TaskError('error', 'Error'), 'FAILURE')
+            tasks.purge_deleted_samples.delay()
+            assert_equal(models.Sample.query.get(sample_id), None)
+            assert_equal(Region.query.count(), 0)
+            assert_equal(DataSource.query.filter(DataSource.id.in_(
+                [coverage_data_source.id, variation_data_source.id])).count(),
+                0)
+            assert DataSource.query.get(other_data_source_id) is not None
+
+    def test_sample_criterion(self):
+        """
+        Restrict sample ids to a set of samples.
+        """
+        with self.fixture.data(SampleData) as data:
+            ids = sorted(sample.id for sample in models.Sample.query)
+            assert len(ids) > 3
+
+            def selected(sample_ids):
+                criterion = utils.sample_criterion(models.Sample.id,
+                                                   sample_ids)
+                return sorted(sample.id for sample in
+                              models.Sample.query.filter(criterion))
+
+            for sample_ids in ([], ids[:1], ids[:-1], ids, ids + [1000]):
+                assert_equal(selected(sample_ids), sorted(set(sample_ids) & set(ids)))
+
+            assert 'NOT IN' in str(utils.sample_criterion(models.Sample.id,
+                                                          ids[:-1]))
+            assert 'NOT IN' not in str(utils.sample_criterion(models.Sample.id,
+                                                              ids[:1]))
+
+            user = models.User.query.first()
+            sample = models.Sample(user, 'New sample')
+            db.session.add(sample)
+            db.session.commit()
+            assert_equal(selected(ids), ids)
+            assert_equal(utils.known_sample_ids(), set(ids + [sample.id]))
+            db.session.delete(sample)
+            db.session.commit()
+
+    def test_coverage_statement_plan(self):
+        """
+        Count covering regions of selected samples from the region_span
+        index only.
+        """
+        with self.fixture.data(CoverageData) as data:
+            coverage = Coverage.query.get(data.CoverageData.exome_coverage.id)
+            tasks.import_coverage.delay(coverage.id)
+
+            statement = utils.frequency_statement('coverage',
+                                                  [coverage.sample_id])
+            params = {'chromosome': 'chr20', 'begin': 68406,
+                      'end': 68406, 'min_begin': 68406 - 10000}
+            assert_equal(utils.execute_frequency_statement(
+                statement, **params).scalar(), 1)
+            assert_equal(utils.execute_frequency_statement(
+                utils.frequency_statement('coverage', []), **params).scalar(),
+                0)
+
+            plan = query_plan(statement, 'EXPLAIN QUERY PLAN', **params)
+            assert any('COVERING INDEX region_span' in step
+                       for step in plan), plan
+            assert not any('coverage' in step for step in plan), plan
+
+    def test_matching_sample_ids(self):
+        """
+        Evaluate query expressions on group and sample bitsets.
+        """
+        with self.fixture.data(SampleData) as data:
+            ids = sorted(sample.id for sample in models.Sample.query)
+            group = models.Group.query.one()
+            other_group = models.Group('other_group')
+            db.session.add(other_group)
+            db.session.commit()
+
+            def matching(string):
+                return utils.matching_sample_ids(expressions.parse(string))
+
+            assert_equal(matching('*'), ids)
+            assert_equal(matching('group:%d' % group.id), ids)
+            assert_equal(matching('group:%d' % other_group.id), [])
+            assert_equal(matching('not sample:%d' % ids[0]), ids[1:])
+            assert_equal(matching('sample:%d or sample:1000000000000' % ids[0]),
+                         ids[:1])
+
+            sample = models.Sample.query.get(ids[1])
+            sample.groups.append(other_group)
+            db.session.commit()
+            assert_equal(matching('group:%d and group:%d'
+                                  % (group.id, other_group.id)), ids[1:2])
+            assert_equal(matching('group:%d and not group:%d'
+                                  % (group.id, other_group.id)),
+                         ids[:1] + ids[2:])
+
+            sample.groups.remove(other_group)
+            db.session.delete(other_group)
+            db.session.commit()
+
+            other_sample = models.Sample(sample.user, 'Other sample',
+                                         groups=[group])
+            db.session.add(other_sample)
+            db.session.commit()
+            other_id = other_sample.id
+            assert_equal(matching('group:%d' % group.id), ids + [other_id])
+            db.session.delete(other_sample)
+            db.session.commit()
+            assert_equal(matching('group:%d' % group.id), ids)
+
+            # With the caches up to date, only the generations are queried.
+            statements = []
+
+            def count(*args):
+                statements.append(args)
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                assert_equal(matching('group:%d' % group.id), ids)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            assert_equal(len(statements), 1)
+
+    def test_frequency_statement(self):
+        """
+        Reuse frequency statements until the set of samples changes.
+        """
+        with self.fixture.data(SampleData) as data:
+            ids = [sample.id for sample in models.Sample.query]
+            statement = utils.frequency_statement('packed_support', ids)
+            assert utils.frequency_statement('packed_support', ids) is statement
+            assert utils.frequency_statement('packed_support', ids[:1]) is not statement
+            assert utils.frequency_statement('unpacked_support', ids) is not statement
+
+            user = models.User.query.first()
+            sample = models.Sample(user, 'New sample')
+            db.session.add(sample)
+            db.session.commit()
+            assert utils.frequency_statement('packed_support', ids) is not statement
+            assert_equal(utils.execute_frequency_statement(
+                utils.frequency_statement('packed_support', ids),
+                chromosome='chr20', position=76962,
+                allele_key=alleles.allele_key('T', 'C')).fetchall(), [])
+            db.session.delete(sample)
+            db.session.commit()
+
+    def test_frequency_calculator(self):
+        """
+        Calculate frequencies with at most two queries per variant.
+        """
+        with self.fixture.data(CoverageData, VariationData) as data:
+            coverage = Coverage.query.get(
+                data.CoverageData.exome_subset_coverage.id)
+            tasks.import_coverage.delay(coverage.id)
+            variation = Variation.query.get(
+                data.VariationData.exome_subset_variation.id)
+            tasks.import_variation.delay(variation.id)
+            variation.sample.active = True
+            db.session.commit()
+
+            samples = [variation.sample]
+            variants = [(o.chromosome, o.position, o.reference, o.observed)
+                        for o in Observation.query]
+            variants.append(('chr20', 1, 'A', 'T'))
+            expected = [utils.calculate_frequency(*variant, samples=samples)
+                        for variant in variants]
+            assert any(coverage for coverage, _ in expected)
+
+            calculator = utils.FrequencyCalculator(samples)
+            statements = []
+
+            def count(*args):
+                statements.append(args)
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                for variant, frequency in zip(variants, expected):
+                    del statements[:]
+                    assert_equal(calculator(*variant), frequency)
+                    assert len(statements) <= 2
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+    def test_generation_caches_recreated_database(self):
+        """
+        Values cached for a database are not used for a recreated database
+        with the same generation numbers.
+        """
+        def populate(group_size, region):
+            user = User('Test User', 'test_user', 'test')
+            group = models.Group('Test group')
+            samples = [models.Sample(user, 'Sample %d' % i,
+                                     groups=[group] if i < group_size else [])
+                       for i in range(3)]
+            data_source = DataSource(user, 'Coverage', 'bed', empty=True)
+            coverage = Coverage(samples[0], data_source)
+            db.session.add_all(samples + [coverage])
+            db.session.commit()
+            db.session.add(Region(coverage, 'chr1', *region))
+            db.session.commit()
+            return group.id, samples[0]
+
+        def recreate():
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+
+        group_id, sample = populate(3, (1000, 1100))
+        query = Query('GROUP', expressions.parse('group:%d' % group_id),
+                      require_active=False)
+        assert_equal(len(query.samples), 3)
+        assert_equal(utils.calculate_frequency(
+            'chr1', 1050, 'A', 'T', samples=[sample])[0], 1)
+        assert_equal(utils.calculate_frequency(
+            'chr1', 1500, 'A', 'T', samples=[sample])[0], 0)
+
+        recreate()
+        group_id, sample = populate(1, (100, 2000))
+        query = Query('GROUP', expressions.parse('group:%d' % group_id),
+                      require_active=False)
+        assert_equal(len(query.samples), 1)
+        assert_equal(utils.calculate_frequency(
+            'chr1', 1500, 'A', 'T', samples=[sample])[0], 1)
+
+        # Also without the caches being cleared on schema creation, the
+        # generations of the tables differ in their modification times.
+        event.remove(models.Generation.__table__, 'after_create',
+                     utils._clear_generation_caches)
+        try:
+            recreate()
+            group_id, sample = populate(2, (1000, 1100))
+        finally:
+            event.listen(models.Generation.__table__, 'after_create',
+                         utils._clear_generation_caches)
+        query = Query('GROUP', expressions.parse('group:%d' % group_id),
+                      require_active=False)
+        assert_equal(len(query.samples), 2)
+        assert_equal(utils.calculate_frequency(
+            'chr1', 1500, 'A', 'T', samples=[sample])[0], 0)
+
+    def test_merge_regions(self):
+        """
+        Merge overlapping and adjacent regions.
+        """
+        regions = [('chr2', 10, 20), ('chr1', 5, 8), ('chr2', 21, 30),
+                   ('chr1', 1, 3), ('chr2', 15, 18), ('chr1', 10, 12),
+                   ('chr2', 40, 40), ('chr1', 7, 9)]
+        expected = [('chr1', 1, 3), ('chr1', 5, 12), ('chr2', 10, 30),
+                    ('chr2', 40, 40)]
+        for buffer_size in (1, 3, 100):
+            assert_equal(list(tasks.merge_regions(regions,
+                                                  buffer_size=buffer_size)),
+                         expected)
+        assert_equal(list(tasks.merge_regions([])), [])
+
+    def test_split_regions(self):
+        """
+        Split long regions into overlapping pieces.
+        """
+        regions = [('chr1', 1, 10), ('chr1', 20, 29), ('chr2', 5, 30)]
+        expected = [('chr1', 1, 10), ('chr1', 20, 29), ('chr2', 5, 14),
+                    ('chr2', 12, 21), ('chr2', 19, 28), ('chr2', 26, 30)]
+        assert_equal(list(tasks.split_regions(regions, max_length=10,
+                                              overlap=3)),
+                     expected)
+        assert_equal(list(tasks.split_regions([])), [])
+
+    def test_import_coverage_long_region(self):
+        """
+        Import a coverage file with a long region, split into pieces that are
+        counted once in calculating frequencies.
+        """
+        user = User('Test User', 'test_user_long_region', 'test')
+        sample = models.Sample(user, 'Test', coverage_profile=True)
+        data_source = DataSource(user, 'Test', 'bed', empty=True)
+        with data_source.data_writer() as data:
+            data.write('chr20\t1000\t120000\nchr20\t119000\t190000\n'
+                       'chr20\t195000\t195100\n')
+        coverage = Coverage(sample, data_source)
+        db.session.add(coverage)
+        db.session.commit()
+
+        tasks.import_coverage.delay(coverage.id)
+        regions = sorted((region.begin, region.end)
+                         for region in coverage.regions)
+        assert_equal(regions[0][0], 1001)
+        assert_equal(regions[-2][1], 190000)
+        assert_equal(regions[-1], (195001, 195100))
+        assert all(end - begin < tasks.MAX_REGION_LENGTH
+                   for begin, end in regions)
+        assert_equal(utils.max_region_span('chr20'),
+                     tasks.MAX_REGION_LENGTH - 1)
+
+        positions = {position for begin, end in regions[:-1]
+                     for position in (begin - 1, begin, end - 1, end,
+                                      end + 1)}
+        for position in sorted(positions):
+            for length in (1, 20, tasks.REGION_OVERLAP):
+                covered = (position > 1000 and
+                           position + length - 1 <= 190000)
+                assert_equal(utils.calculate_frequency(
+                    'chr20', position, 'A' * length, 'T',
+                    samples=[sample])[0], int(covered))
+
+    def test_covering_regions(self):
+        """
+        Find regions covering a range of positions.
+        """
+        with self.fixture.data(CoverageData) as data:
+            assert_equal(utils.max_region_span('chr20'), None)
+
+            for coverage_id in (data.CoverageData.exome_subset_coverage.id,
+                                data.CoverageData.exome_coverage.id):
+                tasks.import_coverage.delay(coverage_id)
+                assert_equal(utils.max_region_span('chr20'),
+                             max(region.end - region.begin
+                                 for region in Region.query))
+
+            regions = Region.query.all()
+            positions = {position for region in regions
+                         for position in (region.begin - 1, region.begin,
+                                          region.end, region.end + 1)}
+            for position in sorted(positions):
+                for length in (1, 20, 400):
+                    expected = sorted(
+                        region.id for region in regions
+                        if region.begin <= position and
+                        region.end >= position + length - 1)
+                    assert_equal(sorted(
+                        region.id for region in utils.covering_regions(
+                            'chr20', position, position + length - 1)),
+                        expected)
+            assert_equal(utils.covering_regions('chr1', 1, 100000).count(), 0)
+
     def test_import_variation(self):
         """
         Import a variation file.
@@ -142,6 +732,78 @@ class TestTasks(TestCase):
             assert_equal(result.state, 'SUCCESS')
             assert variation.task_done
             assert_equal(Observation.query.filter_by(variation=variation).count(), 16)
+            for observation in Observation.query.filter_by(variation=variation):
+                assert_equal(observation.allele_key,
+                             alleles.allele_key(observation.reference,
+                                                observation.observed))
+
+    def test_observation_support_plan(self):
+        """
+        Query observation support from the covering index only.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_subset_variation.id)
+            tasks.import_variation.delay(variation.id)
+            assert all(observation.sample_id == variation.sample_id
+                       for observation in variation.observations)
+
+            query = utils.observation_support('chr20', 76962, 'T', 'C',
+                                              [variation.sample_id])
+            assert_equal(query.all(), [('heterozygous', 1)])
+
+            plan = query_plan(query, 'EXPLAIN QUERY PLAN')
+            assert any('COVERING INDEX observation_frequency' in step
+                       for step in plan), plan
+
+    def test_update_observation_store(self):
+        """
+        Keep the observation store up to date with imported observations.
+        """
+        observation_store.init(tempfile.mkdtemp())
+        try:
+            with self.fixture.data(VariationData) as data:
+                samples = []
+                for variation_id in (
+                        data.VariationData.exome_subset_variation.id,
+                        data.VariationData.exome_subsubset_variation.id):
+                    variation = Variation.query.get(variation_id)
+                    tasks.import_variation.delay(variation.id)
+                    assert variation.task_done
+                    samples.append(variation.sample)
+
+                snapshot = utils.current_observations()
+                assert snapshot is not None
+                assert_equal(snapshot.rows, Observation.query.count())
+
+                for observation in Observation.query:
+                    for sample_ids in ({samples[0].id}, {samples[1].id},
+                                       {samples[0].id, samples[1].id}):
+                        expected = dict(db.session.query(
+                            Observation.zygosity,
+                            func.sum(Observation.support)
+                        ).join(Variation).filter(
+                            Observation.chromosome == observation.chromosome,
+                            Observation.position == observation.position,
+                            Observation.reference == observation.reference,
+                            Observation.observed == observation.observed,
+                            Variation.sample_id.in_(sample_ids)
+                        ).group_by(Observation.zygosity))
+                        assert_equal(snapshot.support(
+                            observation.chromosome, observation.position,
+                            observation.reference, observation.observed,
+                            sample_ids), expected)
+
+                variation.observations.delete()
+                db.session.commit()
+                assert utils.current_observations() is None
+
+                tasks.update_observation_store.delay()
+                snapshot = utils.current_observations()
+                assert snapshot is not None
+                assert_equal(snapshot.rows, Observation.query.count())
+        finally:
+            observation_store.init(None)
 
     def test_import_nonexisting_variation(self):
         """
@@ -865,3 +1527,52 @@ class TestTasks(TestCase):
                           ([1], [0.0]),
                           ([1], [0.0]),
                           ([1], [0.0])])
+
+
+class TestTasksPostgresql(TestCase):
+    """
+    Test Celery tasks that depend on the PostgreSQL query planner.
+    """
+    def create_app(self):
+        return create_app(dict(TEST_SETTINGS, SQLALCHEMY_DATABASE_URI=
+                               POSTGRESQL_URI or 'sqlite://'))
+
+    def setUp(self):
+        """
+        Run once before every test. Setup the test database.
+        """
+        if not POSTGRESQL_URI:
+            raise SkipTest('VARDA_TEST_POSTGRESQL_URI is not set')
+        db.create_all()
+        self.fixture = SQLAlchemyFixture(env=models, style=NamedDataStyle(), engine=db.engine)
+
+    def tearDown(self):
+        """
+        Run once after every test. Drop the test database.
+        """
+        db.session.remove()
+        if POSTGRESQL_URI:
+            db.drop_all()
+
+    def test_observation_support_plan(self):
+        """
+        Query observation support with an index-only scan.
+        """
+        with self.fixture.data(VariationData) as data:
+            variation = Variation.query.get(
+                data.VariationData.exome_subset_variation.id)
+            tasks.import_variation.delay(variation.id)
+
+            # Our test data is too small for the planner to prefer any index
+            # over a sequential scan.
+            db.session.execute('SET enable_seqscan = off')
+            db.session.execute('SET enable_bitmapscan = off')
+            db.session.execute('ANALYZE observation')
+
+            query = utils.observation_support('chr20', 76962, 'T', 'C',
+                                              [variation.sample_id])
+            assert_equal(query.all(), [('heterozygous', 1)])
+
+            plan = query_plan(query)
+            assert any('Index Only Scan using observation_frequency' in step
+                       for step in plan), plan
@@ -0,0 +1,127 @@
+"""
+Tests for the `utils` module.
+"""
+
+
+import random
+
+from nose.tools import assert_equal
+
+from varda import create_app, genome
+from varda.utils import (move_left, normalize_variant, normalize_variants,
+                         ReferenceMismatch)
+
+
+TEST_SETTINGS = {
+    'TESTING': True,
+    'GENOME': 'tests/data/hg19.fa',
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+}
+
+
+def move_left_per_base(context, position, sequence):
+    """
+    Reference implementation of :func:`varda.utils.move_left`, comparing one
+    base at a time.
+    """
+    def lookup(p):
+        if position <= p < position + len(sequence):
+            return sequence[p - position].upper()
+        return context[p - 1].upper()
+
+    move = 0
+    while (position - move > 1 and
+           lookup(position - move - 1) ==
+           lookup(position + len(sequence) - move - 1)):
+        move += 1
+
+    if not move:
+        return position, sequence
+
+    return (position - move,
+            context[position - move - 1
+                    :min(position, position - move + len(sequence)) - 1]
+            + sequence[:-move])
+
+
+class TestUtils:
+    def test_move_left(self):
+        """
+        Move sequences to the left.
+        """
+        assert_equal(move_left('abbaabbaabba', 5, 'abba'), (1, 'abba'))
+        assert_equal(move_left('abbaabbaabba', 6, 'bbaa'), (1, 'abba'))
+        assert_equal(move_left('abbaabbaabba', 6, 'bba'), (5, 'abb'))
+        assert_equal(move_left('ACGT', 3, 'T'), (3, 'T'))
+        assert_equal(move_left('TTTTT', 6, 'T'), (1, 'T'))
+        assert_equal(move_left('ggcacacaca', 11, 'CA'), (3, 'ca'))
+
+    def test_move_left_repeats(self):
+        """
+        Move sequences to the left in long repeats.
+        """
+        for unit in ('A', 'CA', 'AAG', 'GATA'):
+            for repeats in (1, 10, 100, 1000):
+                context = 'GGGTC' + unit * repeats + 'CTGGG'
+                for length in range(1, 2 * len(unit) + 1):
+                    sequence = (unit * 3)[:length]
+                    position = len(context) - 4
+                    assert_equal(move_left(context, position, sequence),
+                                 move_left_per_base(context, position,
+                                                    sequence))
+
+    def test_move_left_random(self):
+        """
+        Move random sequences to the left in random contexts.
+        """
+        random.seed(1)
+        for _ in range(1000):
+            context = ''.join(random.choice('ACgt') for _ in
+                              range(random.randint(1, 100)))
+            position = random.randint(1, len(context) + 1)
+            sequence = ''.join(random.choice('ACGt') for _ in
+                               range(random.randint(1, 5)))
+            assert_equal(move_left(context, position, sequence),
+                         move_left_per_base(context, position, sequence))
+
+
+class TestNormalize:
+    def setup(self):
+        self.app = create_app(TEST_SETTINGS)
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def teardown(self):
+        self.context.pop()
+
+    def test_normalize_variants(self):
+        """
+        Normalize a batch of variants.
+        """
+        random.seed(1)
+        sequence = genome['chr20'][:]
+        variants = [('20', 200001, 'A', 'T'),
+                    ('chr21', 1000, 'A', 'T'),
+                    ('chr20', 100, 'N', 'NN')]
+        for _ in range(500):
+            position = random.choice([random.randint(1, len(sequence)),
+                                      random.randint(60000, 61000)])
+            length = random.randint(0, 5)
+            reference = sequence[position - 1:position + length - 1]
+            if random.random() < 0.1:
+                reference = reference[::-1]
+            observed = random.choice(['', 'A', 'CA', 'T', reference * 2])
+            variants.append((random.choice(['20', 'chr20']), position,
+                             reference, observed))
+
+        results = normalize_variants(variants)
+
+        assert_equal(len(results), len(variants))
+        for variant, result in zip(variants, results):
+            try:
+                expected = normalize_variant(*variant)
+            except ReferenceMismatch as e:
+                assert isinstance(result, ReferenceMismatch)
+                assert_equal(str(result), str(e))
+            else:
+                assert_equal(result, expected)
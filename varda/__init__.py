@@ -9,10 +9,14 @@ Varda, a database for genomic variation frequencies.
 
 from celery import Celery
 from flask import Flask
-from flask.ext.sqlalchemy import SQLAlchemy
+from flask.ctx import _AppCtxGlobals
 
 
+from .cache import Cache
+from .chromosomes import ChromosomeNames, read_aliases
 from .genome import Genome
+from .observation_store import ObservationStore
+from .replicas import RoutingSQLAlchemy
 
 
 # We follow a versioning scheme compatible with setuptools [1] where the
@@ -37,10 +41,27 @@ __contact__ = 'martijn@vermaat.name'
 __homepage__ = 'http://martijn.vermaat.name'
 
 
-db = SQLAlchemy()
+#: Database, optionally with read-only replicas, see :mod:`varda.replicas`.
+db = RoutingSQLAlchemy()
 celery = Celery('varda')
 genome = Genome()
 
+#: Normalization of chromosome names, see
+#: :func:`varda.utils.normalize_chromosome`.
+chromosome_names = ChromosomeNames()
+
+#: Cache of recently verified user credentials, see
+#: :func:`varda.api.utils.user_by_login`.
+credentials_cache = Cache()
+
+#: Cache of user ids and roles by token key, see
+#: :func:`varda.api.utils.user_by_token`.
+token_cache = Cache()
+
+#: Read-optimized copy of the observations, see
+#: :func:`varda.utils.current_observations`.
+observation_store = ObservationStore()
+
 
 class ReverseProxied(object):
     """
@@ -77,6 +98,31 @@ class ReverseProxied(object):
         return self.app(environ, start_response)
 
 
+class LazyGlobals(_AppCtxGlobals):
+    """
+    Application globals object where attributes can be set lazily.
+
+    Example::
+
+        >>> g.set_lazy('user', lambda: User.query.get(user_id))
+
+    The first time `g.user` is accessed, it is set to the value returned by
+    the function.
+    """
+    def set_lazy(self, name, loader):
+        self.__dict__.pop(name, None)
+        self.__dict__.setdefault('_loaders', {})[name] = loader
+
+    def __getattr__(self, name):
+        try:
+            loader = self.__dict__.get('_loaders', {}).pop(name)
+        except KeyError:
+            raise AttributeError(name)
+        value = loader()
+        setattr(self, name, value)
+        return value
+
+
 def create_app(settings=None):
     """
     Create a Flask instance for Varda. Configuration settings are read from a
@@ -91,6 +137,8 @@ def create_app(settings=None):
     :return: Flask application instance.
     """
     app = Flask('varda')
+    # Postpone querying the authenticated user until it is actually needed.
+    app.app_ctx_globals_class = LazyGlobals
     app.config.from_object('varda.default_settings')
     if settings:
         app.config.update(settings)
@@ -101,7 +149,20 @@ def create_app(settings=None):
     db.init_app(app)
     celery.conf.add_defaults(app.config)
     if app.config['GENOME'] is not None:
-        genome.init(app.config['GENOME'], as_raw=True)
+        genome.init(app.config['GENOME'], as_raw=True,
+                    mmap=app.config['GENOME_MMAP'])
+    aliases = list(app.config['CHROMOSOME_ALIASES'])
+    if app.config['CHROMOSOME_ALIASES_FILE'] is not None:
+        aliases.extend(read_aliases(app.config['CHROMOSOME_ALIASES_FILE']))
+    chromosome_names.init(genome if app.config['GENOME'] is not None
+                          else None, aliases)
+    credentials_cache.init(size=app.config['CREDENTIALS_CACHE_SIZE'],
+                           timeout=app.config['CREDENTIALS_CACHE_TIMEOUT'])
+    token_cache.init(size=app.config['TOKEN_CACHE_SIZE'],
+                     timeout=app.config['TOKEN_CACHE_TIMEOUT'])
+    observation_store.init(app.config['OBSERVATION_STORE_DIR'])
+    from .utils import clear_generation_caches
+    clear_generation_caches()
     from .api import api
     app.register_blueprint(api, url_prefix=app.config['API_URL_PREFIX'])
     return app
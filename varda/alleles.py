@@ -0,0 +1,92 @@
+"""
+Compact integer encoding of alleles.
+
+An allele (a pair of reference and observed sequences) is encoded as a
+single 64-bit signed integer, its *allele key*. Short alleles consisting of
+``A``, ``C``, ``G``, and ``T`` only are packed into the key with 2 bits per
+base::
+
+    bit 63     sign (always 0)
+    bits 59-62 length of the reference sequence (at most 15)
+    bits 55-58 length of the observed sequence (at most 15)
+    bits 0-53  bases of the reference followed by the observed sequence
+
+Other alleles get a negative key derived from a SHA-1 hash of the sequences.
+These keys are not unique in theory, so they should always be used in
+combination with the sequences themselves.
+
+.. warning:: Allele keys are stored in the database, so this encoding cannot
+    be changed without migrating existing data.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import hashlib
+import struct
+
+
+# Maximum length of a sequence and of both sequences together in a packed
+# allele key.
+MAX_PACKED_LENGTH = 15
+MAX_PACKED_BASES = 27
+
+BASES = 'ACGT'
+BASE_CODES = {base: code for code, base in enumerate(BASES)}
+
+
+def allele_key(reference, observed):
+    """
+    Encode an allele as allele key.
+
+    :arg reference: Reference sequence.
+    :type reference: str
+    :arg observed: Observed sequence.
+    :type observed: str
+
+    :return: Allele key, negative for alleles that cannot be packed.
+    :rtype: int
+    """
+    if (len(reference) <= MAX_PACKED_LENGTH and
+        len(observed) <= MAX_PACKED_LENGTH and
+        len(reference) + len(observed) <= MAX_PACKED_BASES):
+        key = len(reference) << 59 | len(observed) << 55
+        try:
+            for i, base in enumerate(reference + observed):
+                key |= BASE_CODES[base] << (2 * i)
+        except KeyError:
+            pass
+        else:
+            return key
+
+    digest = hashlib.sha1('%s\t%s' % (reference, observed)).digest()
+    return -(struct.unpack('>Q', digest[:8])[0] >> 1) - 1
+
+
+def is_packed(key):
+    """
+    Check if an allele key is packed, i.e., can be decoded without the allele
+    dictionary.
+    """
+    return key >= 0
+
+
+def unpack_allele_key(key):
+    """
+    Decode a packed allele key.
+
+    :arg key: Packed allele key.
+    :type key: int
+
+    :return: Tuple of reference and observed sequences.
+    :rtype: (str, str)
+    """
+    if not is_packed(key):
+        raise ValueError('Allele key %d is not packed' % key)
+    reference_length = key >> 59 & 0xf
+    observed_length = key >> 55 & 0xf
+    bases = ''.join(BASES[key >> (2 * i) & 0x3]
+                    for i in range(reference_length + observed_length))
+    return bases[:reference_length], bases[reference_length:]
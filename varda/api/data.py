@@ -198,7 +198,10 @@ def _cast_annotation(value, definition):
 
 def _cast_coverage(value, definition):
     if isinstance(value, int):
-        return Coverage.query.get(value)
+        coverage = Coverage.query.get(value)
+        if coverage is None or coverage.sample.deleted:
+            return None
+        return coverage
     elif isinstance(value, basestring):
         return coverage_by_uri(current_app, value)
     return value
@@ -206,7 +209,10 @@ def _cast_coverage(value, definition):
 
 def _cast_data_source(value, definition):
     if isinstance(value, int):
-        return DataSource.query.get(value)
+        data_source = DataSource.query.get(value)
+        if data_source is None or data_source.deleted:
+            return None
+        return data_source
     elif isinstance(value, basestring):
         return data_source_by_uri(current_app, value)
     return value
@@ -214,7 +220,10 @@ def _cast_data_source(value, definition):
 
 def _cast_sample(value, definition):
     if isinstance(value, int):
-        return Sample.query.get(value)
+        sample = Sample.query.get(value)
+        if sample is None or sample.deleted:
+            return None
+        return sample
     elif isinstance(value, basestring):
         return sample_by_uri(current_app, value)
     return value
@@ -261,7 +270,10 @@ def _cast_variant(value, definition):
 
 def _cast_variation(value, definition):
     if isinstance(value, int):
-        return Variation.query.get(value)
+        variation = Variation.query.get(value)
+        if variation is None or variation.sample.deleted:
+            return None
+        return variation
     elif isinstance(value, basestring):
         return variation_by_uri(current_app, value)
     return value
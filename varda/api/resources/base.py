@@ -22,18 +22,21 @@ information about the state of the task.
 
 
 from functools import wraps
+from hashlib import sha1
 
 import celery.exceptions
-from flask import abort, current_app, g, jsonify, Response, url_for
+from flask import abort, current_app, g, jsonify, request, Response
 import sqlalchemy
 import sqlalchemy.exc
+import sqlalchemy.orm
 
 from ... import db
 from ... import tasks
+from ...models import Generation
 from ..data import data
 from ..errors import IntegrityError
 from ..security import ensure, has_role
-from ..utils import collection
+from ..utils import collection, conditional, register_uri_template, uri_for
 
 
 # Todo: We implement the different resources here with inheritance. If we at
@@ -87,6 +90,11 @@ class Resource(object):
     delete_ensure_options = {}
     delete_schema = {}
 
+    #: Views for which GET requests may read from a database replica, if it
+    #: has caught up with the tables in :meth:`generation_tables` (see
+    #: :mod:`varda.replicas`).
+    replica_views = []
+
     #: Can be one of `string`, `int`, `float`, `path`. See `URL Route
     #: Registrations in Flask
     #: <http://flask.pocoo.org/docs/api/#url-route-registrations>`_.
@@ -145,15 +153,70 @@ class Resource(object):
         @data(**getattr(self, '%s_schema' % endpoint))
         @ensure(*getattr(self, '%s_ensure_conditions' % endpoint),
                 **getattr(self, '%s_ensure_options' % endpoint))
+        @conditional(getattr(self, '%s_validators' % endpoint, None))
         @wrapper
         def view(*args, **kwargs):
+            if (endpoint in self.replica_views and
+                    request.method in ('GET', 'HEAD')):
+                db.use_replica(self.generation_tables())
             return view_func(*args, **kwargs)
 
+        endpoint_name = '%s_%s' % (self.instance_name, endpoint)
         self.blueprint.add_url_rule('%s%s' % (self.url_prefix or '/', getattr(self, '%s_rule' % endpoint)),
-                                    '%s_%s' % (self.instance_name, endpoint),
+                                    endpoint_name,
                                     view,
                                     **kwargs)
 
+        # Compile the URI template once the rule is added to the application
+        # URL map, which is when the blueprint is registered (only then the
+        # blueprint URL prefix is known).
+        self.blueprint.record(lambda state: register_uri_template(
+            state.app, '%s.%s' % (self.blueprint.name, endpoint_name)))
+
+    @classmethod
+    def generation_tables(cls):
+        """
+        Names of the database tables the representation of this resource
+        depends on. Used to derive validators for HTTP conditional requests,
+        see :meth:`validators`.
+
+        To be implemented by a subclass. By default, no validators are
+        derived.
+        """
+        return set()
+
+    @classmethod
+    def validators(cls, *extra):
+        """
+        Validators for an HTTP conditional request on this resource, as used
+        by the :func:`conditional` decorator.
+
+        The ETag is a digest of the generations of the tables in
+        :meth:`generation_tables` and all request parameters that may affect
+        the response. Any extra arguments are included in the digest, which
+        can be used for state that is not in the database (the last
+        modification date is not returned in that case).
+
+        Validators are not derived if there are no generation counters for
+        these tables.
+        """
+        generation = Generation.current(cls.generation_tables())
+        if generation is None:
+            return None, None, False
+        values, modified = generation
+        etag = sha1(repr((values, request.script_root, request.full_path,
+                          request.get_data(), request.headers.get('Range'),
+                          extra))).hexdigest()
+        return etag, None if extra else modified, False
+
+    @classmethod
+    def list_validators(cls, **kwargs):
+        return cls.validators()
+
+    @classmethod
+    def get_validators(cls, **kwargs):
+        return cls.validators()
+
     @classmethod
     def get_order(cls, requested_order=None):
         # Todo: Implement this via a view wrapper.
@@ -202,7 +265,7 @@ class Resource(object):
 
     @classmethod
     def collection_uri(cls):
-        return url_for('.%s_list' % cls.instance_name)
+        return uri_for('.%s_list' % cls.instance_name)
 
     @classmethod
     def instance_uri(cls, instance):
@@ -210,7 +273,7 @@ class Resource(object):
 
     @classmethod
     def instance_uri_by_key(cls, key):
-        return url_for('.%s_get' % cls.instance_name,
+        return uri_for('.%s_get' % cls.instance_name,
                        **{cls.instance_name: key})
 
 
@@ -233,6 +296,18 @@ class ModelResource(Resource):
 
     default_order = [('id', 'asc')]
 
+    @classmethod
+    def generation_tables(cls):
+        # This includes embedded resources, regardless of them being embedded
+        # in the request.
+        table_names = {table.name for table in cls.model.__mapper__.tables}
+        for field, resource in cls.embeddable.items():
+            secondary = getattr(cls.model, field).property.secondary
+            if secondary is not None:
+                table_names.add(secondary.name)
+            table_names |= resource.generation_tables()
+        return table_names
+
     @classmethod
     def serialize_in_parent(cls, parent_instance, field, embedded=False):
         # This is a bit of a hack to detect *lists* of embeddable fields. A
@@ -259,6 +334,34 @@ class ModelResource(Resource):
         key = field + '_id'
         return {'uri': cls.instance_uri_by_key(getattr(parent_instance, key))}
 
+    @classmethod
+    def load_options(cls, embed=None, parent=None):
+        """
+        Query options for eager loading the relationships needed to serialize
+        instances with the given embedded fields.
+
+        Lists of resources are always loaded (their URIs are included in the
+        serialization), using a second query for all instances
+        (`subqueryload`). Scalar resources are only loaded if embedded,
+        using a join (`joinedload`). For embedded resources, this is applied
+        recursively.
+
+        If `parent` is given, the options are chained to this loader option.
+        """
+        embed = embed or []
+        options = []
+        for field, resource in cls.embeddable.items():
+            relationship = getattr(cls.model, field)
+            uselist = relationship.property.uselist
+            if not (uselist or field in embed):
+                continue
+            loader = 'subqueryload' if uselist else 'joinedload'
+            option = getattr(parent or sqlalchemy.orm, loader)(relationship)
+            options.append(option)
+            if field in embed:
+                options.extend(resource.load_options(parent=option))
+        return options
+
     @classmethod
     def list_view(cls, begin, count, embed=None, order=None, **filter):
         # Todo: On large collections, LIMIT/OFFSET may get slow on many rows
@@ -268,7 +371,7 @@ class ModelResource(Resource):
         # [1] http://www.postgresql.org/docs/8.0/static/queries-limit.html
         # [2] http://www.sqlalchemy.org/trac/wiki/UsageRecipes/WindowedRangeQuery
         # [3] http://stackoverflow.com/questions/6618366/improving-offset-performance-in-postgresql
-        instances = cls.model.query
+        instances = cls.model.query.options(*cls.load_options(embed))
         for field, value in filter.items():
             try:
                 # We can filter on a field of a linked resource by using the
@@ -351,13 +454,18 @@ class TaskedResource(ModelResource):
 
     @classmethod
     def serialize(cls, instance, embed=None):
+        serialization = super(TaskedResource, cls).serialize(instance, embed=embed)
+        serialization.update(task=cls.serialize_task(instance))
+        return serialization
+
+    @classmethod
+    def serialize_task(cls, instance):
         # For simplicity we try not to expose the details of the Celery task
         # and provide just three fields:
         #
         # 1. state: One of `waiting`, `running`, `success`, `failure`.
         # 2. progress: If state is `running`, this is an integer.
         # 3. error: If state is failure, this is the error object.
-        serialization = super(TaskedResource, cls).serialize(instance, embed=embed)
         if instance.task_done:
             # No need to check the Celery task state.
             task = {'state': 'success'}
@@ -387,8 +495,20 @@ class TaskedResource(ModelResource):
                              'message': 'Unexpected error'}
                 task = {'state': 'failure',
                         'error': error}
-        serialization.update(task=task)
-        return serialization
+        return task
+
+    # Note: The state of unfinished tasks is not in the database, so the
+    #     validators of the collection do not change with task progress.
+    #     Looking up the state of every unfinished task would make polling
+    #     the collection as expensive as not using validators at all, so
+    #     clients should poll the task progress of individual resources.
+
+    @classmethod
+    def get_validators(cls, **kwargs):
+        instance = kwargs.get(cls.instance_name)
+        if instance.task_done:
+            return cls.validators()
+        return cls.validators(cls.serialize_task(instance))
 
     @classmethod
     def edit_view(cls, *args, **kwargs):
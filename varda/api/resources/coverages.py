@@ -87,6 +87,7 @@ class CoveragesResource(TaskedResource):
 
         - **sample** (`uri`)
         """
+        kwargs['sample.deleted'] = False
         return super(CoveragesResource, cls).list_view(*args, **kwargs)
 
     @classmethod
@@ -7,12 +7,17 @@ REST API data sources model resource.
 """
 
 
+from hashlib import sha1
+import itertools
 import os
+import zlib
 
-from flask import current_app, g, request, send_from_directory, url_for
+from flask import current_app, g, jsonify, request, stream_with_context
 
+from ... import db, tasks
 from ...models import DataSource, DATA_SOURCE_FILETYPES
 from ..security import has_role, is_user, owns_data_source, require_user
+from ..utils import send_data_file, uri_for
 from .base import ModelResource
 from .users import UsersResource
 
@@ -55,7 +60,11 @@ class DataSourcesResource(ModelResource):
     data_rule = '/<int:data_source>/data'
     data_ensure_conditions = [has_role('admin'), owns_data_source]
     data_ensure_options = {'satisfy': any}
-    data_schema = {'data_source': {'type': 'data_source', 'id': True}}
+    data_schema = {'data_source': {'type': 'data_source', 'id': True},
+                   'region': {'type': 'dict',
+                              'schema': {'chromosome': {'type': 'string', 'required': True, 'maxlength': 30},
+                                         'begin': {'type': 'integer'},
+                                         'end': {'type': 'integer'}}}}
 
     def register_views(self):
         super(DataSourcesResource, self).register_views()
@@ -92,7 +101,7 @@ class DataSourcesResource(ModelResource):
           <api-resources-users-instances>` resource (embeddable).
         """
         serialization = super(DataSourcesResource, cls).serialize(instance, embed=embed)
-        serialization.update(data={'uri': url_for('.data_source_data',
+        serialization.update(data={'uri': uri_for('.data_source_data',
                                                   data_source=instance.id)},
                              name=instance.name,
                              filetype=instance.filetype,
@@ -115,6 +124,7 @@ class DataSourcesResource(ModelResource):
 
         **Orderable by:** `name`, `filetype`, `added`
         """
+        kwargs['deleted'] = False
         return super(DataSourcesResource, cls).list_view(*args, **kwargs)
 
     @classmethod
@@ -145,6 +155,9 @@ class DataSourcesResource(ModelResource):
         - **gzipped** (`boolean`)
         - **local_file** (`string`)
         - **data** (`file`)
+
+        Data referenced by **local_file** is digested by a server task, until
+        it has finished the data source has no checksum.
         """
         # Todo: If files['data'] is missing (or non-existent file?), we crash with
         #     a data_source_not_cached error.
@@ -152,8 +165,20 @@ class DataSourcesResource(ModelResource):
         # Todo: Option to upload the actual data later at the /data_source/XX/data
         #     endpoint, symmetrical to the GET request.
         # Todo: Is it possible to call this without authentication?
-        kwargs.update(user=g.user, upload=request.files.get('data'))
-        return super(DataSourcesResource, cls).add_view(*args, **kwargs)
+        data_source = DataSource(g.user, upload=request.files.get('data'),
+                                 **kwargs)
+        db.session.add(data_source)
+        db.session.commit()
+        current_app.logger.info('Added data_source: %r', data_source)
+
+        if kwargs.get('local_file') is not None:
+            result = tasks.digest_data_source.delay(data_source.id)
+            current_app.logger.info('Called task: digest_data_source(%d) %s',
+                                    data_source.id, result.task_id)
+
+        response = jsonify(data_source=cls.serialize(data_source))
+        response.location = cls.instance_uri(data_source)
+        return response, 201
 
     @classmethod
     def edit_view(cls, *args, **kwargs):
@@ -170,7 +195,7 @@ class DataSourcesResource(ModelResource):
         return super(DataSourcesResource, cls).edit_view(*args, **kwargs)
 
     @classmethod
-    def data_view(cls, data_source):
+    def data_view(cls, data_source, region=None):
         """
         Returns the gzipped data source data.
 
@@ -178,11 +203,78 @@ class DataSourcesResource(ModelResource):
 
         .. note:: Requires having the `admin` role or being the owner of the
            data source.
+
+        Byte-range requests for a single range are supported. If the data
+        source checksum is known, an ETag is derived from it and the stored
+        (compressed) file.
+
+        **Accepted request data:**
+
+        - **region** (`object`) -- Only return data for this region (header
+          lines are always included). Chromosome names must be as used in the
+          data. If `begin` or `end` are not specified, the region is from the
+          start or to the end of the chromosome.
+
+          - **chromosome** (`string`)
+          - **begin** (`integer`)
+          - **end** (`integer`)
         """
-        path = current_app.config['DATA_DIR']
-        if not os.path.isabs(path):
-            path = os.path.join(os.getcwd(), path)
+        if region is None:
+            return send_data_file(data_source.filename, 'application/x-gzip',
+                                  etag=_data_etag(data_source))
+
+        lines = itertools.chain(
+            data_source.header(),
+            data_source.region(region['chromosome'], region.get('begin'),
+                               region.get('end')))
+        return current_app.response_class(
+            stream_with_context(_compress(lines)),
+            mimetype='application/x-gzip')
+
+    @classmethod
+    def data_validators(cls, data_source, region=None):
+        if not data_source.checksum:
+            return None, None, False
+        if region is None:
+            return _data_etag(data_source), None, False
+        return (sha1(repr((data_source.checksum,
+                           sorted(region.items())))).hexdigest(),
+                None, False)
+
 
-        return send_from_directory(path,
-                                   data_source.filename,
-                                   mimetype='application/x-gzip')
+def _data_etag(data_source):
+    """
+    ETag for the stored data of a data source, or `None` if the checksum is
+    not known or the data is missing.
+
+    The data is served as stored, including for byte-range requests, so the
+    ETag must change with the stored bytes and not only with the checksum of
+    the uncompressed data (the compression could differ).
+    """
+    if not data_source.checksum:
+        return None
+    try:
+        stat = os.stat(data_source.local_path())
+    except EnvironmentError:
+        return None
+    return sha1(repr((data_source.checksum, stat.st_size,
+                      stat.st_mtime))).hexdigest()
+
+
+def _compress(lines, chunk_size=0x10000):
+    """
+    Gzip-compress lines, yielding compressed chunks.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buffered = []
+    size = 0
+    for line in lines:
+        buffered.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            chunk = compressor.compress(''.join(buffered))
+            if chunk:
+                yield chunk
+            buffered = []
+            size = 0
+    yield compressor.compress(''.join(buffered)) + compressor.flush()
@@ -7,8 +7,9 @@ REST API samples model resource.
 """
 
 
-from flask import g
+from flask import current_app, g, Response
 
+from ... import db, tasks
 from ...models import Sample
 from ..security import is_user, has_role, owns_sample, public_sample, true
 from .base import ModelResource
@@ -66,6 +67,16 @@ class SamplesResource(ModelResource):
     delete_ensure_conditions = [has_role('admin'), owns_sample]
     delete_ensure_options = {'satisfy': any}
 
+    @classmethod
+    def list_validators(cls, public=None, **kwargs):
+        etag, last_modified, _ = cls.validators()
+        return etag, last_modified, public is True
+
+    @classmethod
+    def get_validators(cls, sample, **kwargs):
+        etag, last_modified, _ = cls.validators()
+        return etag, last_modified, sample.public
+
     @classmethod
     def serialize(cls, instance, embed=None):
         """
@@ -132,6 +143,7 @@ class SamplesResource(ModelResource):
 
         **Orderable by:** `name`, `pool_size`, `public`, `active`, `added`
         """
+        kwargs['deleted'] = False
         return super(SamplesResource, cls).list_view(*args, **kwargs)
 
     @classmethod
@@ -202,6 +214,29 @@ class SamplesResource(ModelResource):
     @classmethod
     def delete_view(cls, *args, **kwargs):
         """
-        Todo: documentation, including how/if we cascade.
+        Deletes a sample resource, including its variations and coverages
+        and their data sources (unless used otherwise).
+
+        The sample, its variations and coverages, and their data sources are
+        no longer visible after this request, but they are deleted by a
+        server task in the background.
+
+        .. note:: Requires one or more of the following:
+
+           - Having the `admin` role.
+           - Being the owner of the sample.
         """
-        return super(SamplesResource, cls).delete_view(*args, **kwargs)
+        sample = kwargs.get('sample')
+        sample.deleted = True
+        sample.active = False
+        db.session.commit()
+        current_app.logger.info('Deleted sample: %r', sample)
+
+        sample_id = sample.id
+        task_id = tasks.queue_purge(sample)
+        current_app.logger.info('Called task: purge_sample(%d) %s',
+                                sample_id, task_id)
+
+        response = Response(status=204)
+        response.headers.pop('Content-Type', None)
+        return response
@@ -9,6 +9,7 @@ REST API tokens model resource.
 
 from flask import g
 
+from ... import token_cache
 from ...models import Token
 from ..security import has_role, is_user, owns_token, require_basic_auth
 from .base import ModelResource
@@ -153,4 +154,5 @@ class TokensResource(ModelResource):
         """
         Todo: documentation, including how/if we cascade.
         """
+        token_cache.delete(kwargs[cls.instance_name].key)
         return super(TokensResource, cls).delete_view(*args, **kwargs)
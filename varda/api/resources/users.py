@@ -9,6 +9,7 @@ REST API users model resource.
 
 from flask import abort, g
 
+from ... import token_cache
 from ...models import User, USER_ROLES
 from ..errors import ValidationError
 from ..security import is_user, has_role, require_basic_auth
@@ -155,7 +156,12 @@ class UsersResource(ModelResource):
             # Of course we don't allow any user to change their own roles,
             # only admins can do that.
             abort(403)
-        return super(UsersResource, cls).edit_view(*args, **kwargs)
+        user = kwargs[cls.instance_name]
+        response = super(UsersResource, cls).edit_view(*args, **kwargs)
+        if 'roles' in kwargs:
+            # Cached tokens for this user have the old roles.
+            token_cache.prune(lambda entry: entry[0] == user.id)
+        return response
 
     @classmethod
     @require_basic_auth
@@ -170,4 +176,6 @@ class UsersResource(ModelResource):
         .. todo:: Document that we cascade the delete to tokens, but not to
             samples and data sources.
         """
+        user = kwargs[cls.instance_name]
+        token_cache.prune(lambda entry: entry[0] == user.id)
         return super(UsersResource, cls).delete_view(*args, **kwargs)
@@ -7,12 +7,16 @@ REST API variants resource.
 """
 
 
+from operator import itemgetter
+
 import binning
 from flask import abort, g, jsonify
 
-from ...models import Observation, Sample, Variation
-from ...utils import (calculate_frequency, normalize_region, normalize_variant,
-                      ReferenceMismatch)
+from ...models import Observation
+from ...utils import (current_generations, current_observations,
+                      frequency_calculators, known_sample_ids,
+                      normalize_region, normalize_variant, ReferenceMismatch,
+                      sample_criterion)
 from ..errors import ValidationError
 from ..security import has_role, owns_sample, public_sample, true
 from .base import Resource
@@ -57,6 +61,8 @@ class VariantsResource(Resource):
 
     views = ['list', 'get', 'add']
 
+    replica_views = ['list', 'get']
+
     orderable = ['chromosome', 'position']
 
     default_order = [('chromosome', 'asc'),
@@ -88,12 +94,37 @@ class VariantsResource(Resource):
 
     key_type = 'string'
 
+    @classmethod
+    def generation_tables(cls):
+        return {'observation', 'variation', 'coverage', 'region', 'sample',
+                'group_membership'}
+
+    @classmethod
+    def authorize_queries(cls, queries):
+        for query in queries:
+            if query.singleton:
+                query.require_active = False
+                query.require_coverage_profile = False
+            _authorize_query(query)
+
+    @classmethod
+    def list_validators(cls, queries=None, **kwargs):
+        # Authorization of the queries is done in the view, so we must do it
+        # here before we get the chance of responding 304.
+        cls.authorize_queries(queries or [])
+        return cls.validators()
+
+    @classmethod
+    def get_validators(cls, queries=None, **kwargs):
+        cls.authorize_queries(queries or [])
+        return cls.validators()
+
     @classmethod
     def instance_key(cls, variant):
         return '%s:%d%s>%s' % variant
 
     @classmethod
-    def serialize(cls, variant, queries=None):
+    def serialize(cls, variant, queries=None, calculators=None):
         """
         A variant is represented as an object with the following fields:
 
@@ -102,6 +133,9 @@ class VariantsResource(Resource):
         """
         chromosome, position, reference, observed = variant
         queries = queries or []
+        if calculators is None:
+            calculators = frequency_calculators(query.samples
+                                                for query in queries)
 
         serialization = {'uri': cls.instance_uri(variant),
                          'chromosome': chromosome,
@@ -110,10 +144,9 @@ class VariantsResource(Resource):
                          'observed': observed}
 
         annotations = {}
-        for query in queries:
-            coverage, frequency = calculate_frequency(
-                chromosome, position, reference, observed,
-                samples=query.samples)
+        for query, calculator in zip(queries, calculators):
+            coverage, frequency = calculator(chromosome, position, reference,
+                                             observed)
             annotations[query.name] = {'coverage': coverage,
                                        'frequency': sum(frequency.values()),
                                        'frequency_het': frequency['heterozygous'],
@@ -139,17 +172,35 @@ class VariantsResource(Resource):
         except ReferenceMismatch as e:
             raise ValidationError(str(e))
 
-        for query in queries:
-            if query.singleton:
-                query.require_active = False
-                query.require_coverage_profile = False
-            _authorize_query(query)
+        cls.authorize_queries(queries)
 
         # Set of samples IDs considered by all queries together.
         all_sample_ids = {sample.id
                           for query in queries
                           for sample in query.samples}
 
+        generations = current_generations()
+        calculators = frequency_calculators(
+            (query.samples for query in queries), generations)
+
+        snapshot = current_observations(generations)
+        if snapshot is not None:
+            variants = snapshot.variants(chromosome, begin_position,
+                                         end_position, all_sample_ids)
+            # Sorting is stable, so we sort by the least significant field
+            # first.
+            fields = {'position': 0, 'reference': 1, 'observed': 2}
+            for field, direction in reversed(cls.get_order(order)):
+                if field in fields:
+                    variants.sort(key=itemgetter(fields[field]),
+                                  reverse=direction == 'desc')
+            items = [cls.serialize((chromosome,) + variant, queries=queries,
+                                   calculators=calculators)
+                     for variant in variants[begin:begin + count]]
+            return (len(variants),
+                    jsonify(variant_collection={'uri': cls.collection_uri(),
+                                                'items': items}))
+
         # Set of observations considered by all queries together.
         bins = binning.contained_bins(begin_position - 1, end_position)
         observations = Observation.query.filter(
@@ -157,8 +208,9 @@ class VariantsResource(Resource):
             Observation.position >= begin_position,
             Observation.position <= end_position,
             Observation.bin.in_(bins)
-        ).join(Variation).join(Sample).filter(
-            Sample.id.in_(all_sample_ids)
+        ).filter(
+            sample_criterion(Observation.sample_id, all_sample_ids,
+                             all_ids=known_sample_ids(generations))
         ).distinct(
             Observation.chromosome,
             Observation.position,
@@ -169,7 +221,7 @@ class VariantsResource(Resource):
                                                for f, d in cls.get_order(order)])
 
         items = [cls.serialize((o.chromosome, o.position, o.reference, o.observed),
-                               queries=queries)
+                               queries=queries, calculators=calculators)
                  for o in observations.limit(count).offset(begin)]
         return (observations.count(),
                 jsonify(variant_collection={'uri': cls.collection_uri(),
@@ -182,11 +234,7 @@ class VariantsResource(Resource):
         """
         queries = queries or []
 
-        for query in queries:
-            if query.singleton:
-                query.require_active = False
-                query.require_coverage_profile = False
-            _authorize_query(query)
+        cls.authorize_queries(queries)
 
         return jsonify(variant=cls.serialize(variant, queries=queries))
 
@@ -90,6 +90,7 @@ class VariationsResource(TaskedResource):
 
         - **sample** (`uri`)
         """
+        kwargs['sample.deleted'] = False
         return super(VariationsResource, cls).list_view(*args, **kwargs)
 
     @classmethod
@@ -193,9 +193,12 @@ def has_role(role):
 
     The resulting condition returns ``True`` if there is an authenticated user
     and it has the requested role, ``False`` otherwise.
+
+    This uses `g.user_roles` instead of `g.user.roles`, so the authenticated
+    user does not have to be queried.
     """
     def condition(**_):
-        return g.user is not None and role in g.user.roles
+        return role in g.user_roles
     return condition
 
 
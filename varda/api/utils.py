@@ -8,18 +8,32 @@ Various REST API utilities.
 
 
 from functools import wraps
+from hashlib import sha256
+import hmac
+import os
+import re
 import urlparse
 
-from flask import abort, request
+from flask import (abort, current_app, has_request_context, make_response,
+                   request, Response, url_for)
 from werkzeug.datastructures import ContentRange
 from werkzeug.exceptions import HTTPException
-from werkzeug.http import parse_range_header
+from werkzeug.http import is_resource_modified, parse_range_header
+from werkzeug.routing import (parse_converter_args, parse_rule,
+                              ValidationError as RoutingValidationError)
+from werkzeug.wsgi import wrap_file
 
+from .. import credentials_cache, db, token_cache
 from ..models import (Annotation, Coverage, DataSource, Group, Sample, Token,
                       User, Variation)
 from .errors import ValidationError
 
 
+# Secret for keying entries in the credentials cache. It is only used within
+# this process, so we can just generate a new one on every start.
+CREDENTIALS_CACHE_SECRET = os.urandom(32)
+
+
 def collection(rule):
     """
     Decorator for rules returning collections.
@@ -72,6 +86,8 @@ def collection(rule):
         end = min(end, begin + 500)
         kwargs.update(begin=begin, count=end - begin)
         total, response = rule(*args, **kwargs)
+        if response.status_code == 304:
+            return response
         if begin > total - 1:
             response.headers.add('Content-Range',
                                  ContentRange('items', None, None, total))
@@ -83,6 +99,241 @@ def collection(rule):
     return collection_rule
 
 
+def conditional(validators=None):
+    """
+    Decorator for rules supporting HTTP conditional requests.
+
+    The `validators` function is called with the view function arguments and
+    should return a tuple `(etag, last_modified, public)` for the requested
+    resource, where `etag` and `last_modified` can be `None`. It should be
+    much cheaper than the view function itself.
+
+    If the request is conditional and the validators match, a ``304 Not
+    Modified`` response is returned without calling the view function.
+    Otherwise the validators are added to the view function response.
+
+    Responses with validators also get a `Cache-Control` header instructing
+    caches to always revalidate. If `public` is `True`, shared caches may also
+    store the response, even for authenticated requests.
+
+    If `validators` is `None`, the rule is returned unchanged.
+    """
+    def conditional_decorator(rule):
+        if validators is None:
+            return rule
+
+        @wraps(rule)
+        def conditional_rule(*args, **kwargs):
+            etag, last_modified, public = validators(*args, **kwargs)
+            if etag is None and last_modified is None:
+                return rule(*args, **kwargs)
+            if is_resource_modified(request.environ, etag=etag,
+                                    last_modified=last_modified):
+                response = make_response(rule(*args, **kwargs))
+                if response.status_code not in (200, 206):
+                    return response
+            else:
+                response = Response(status=304)
+                response.headers.pop('Content-Type', None)
+            if etag is not None:
+                response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            if public:
+                response.cache_control.public = True
+            else:
+                response.cache_control.private = True
+            return response
+        return conditional_rule
+    return conditional_decorator
+
+
+def send_data_file(filename, mimetype, etag=None):
+    """
+    Send a file from the directory defined by the `DATA_DIR` configuration
+    setting, supporting HTTP byte-range requests.
+
+    If the `DATA_X_ACCEL_REDIRECT` or `DATA_X_SENDFILE` configuration setting
+    is set, sending the file (including handling byte-range requests) is
+    offloaded to the fronting web server.
+
+    Only requests for a single byte range are answered with ``206 Partial
+    Content``, for other Range headers the entire file is sent. This is also
+    the case if the request has an If-Range header not matching `etag`.
+
+    :arg filename: Name of the file.
+    :type filename: str
+    :arg mimetype: Mimetype of the file.
+    :type mimetype: str
+    :arg etag: ETag for the file.
+    :type etag: str
+    """
+    directory = current_app.config['DATA_DIR']
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.getcwd(), directory)
+    path = os.path.join(directory, filename)
+
+    if current_app.config['DATA_X_ACCEL_REDIRECT']:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = '%s/%s' % (
+            current_app.config['DATA_X_ACCEL_REDIRECT'].rstrip('/'), filename)
+        return response
+
+    if current_app.config['DATA_X_SENDFILE']:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+        return response
+
+    try:
+        data = open(path, 'rb')
+        size = os.fstat(data.fileno()).st_size
+    except EnvironmentError:
+        abort(404)
+
+    byte_range = request.range
+    if_range = request.if_range
+    if (byte_range is not None and
+        (if_range.etag is not None or if_range.date is not None) and
+        (etag is None or if_range.etag != etag)):
+        byte_range = None
+
+    if (byte_range is None or byte_range.units != 'bytes' or
+        len(byte_range.ranges) != 1):
+        # The WSGI server may send the file without copying it through
+        # userspace (wsgi.file_wrapper).
+        response = current_app.response_class(
+            wrap_file(request.environ, data), mimetype=mimetype,
+            direct_passthrough=True)
+        response.content_length = size
+        response.accept_ranges = 'bytes'
+        return response
+
+    begin_end = byte_range.range_for_length(size)
+    if begin_end is None:
+        data.close()
+        response = current_app.response_class(status=416)
+        response.content_range = ContentRange('bytes', None, None, size)
+        return response
+
+    begin, end = begin_end
+    response = current_app.response_class(
+        _read_range(data, begin, end), status=206, mimetype=mimetype,
+        direct_passthrough=True)
+    response.content_length = end - begin
+    response.content_range = ContentRange('bytes', begin, end, size)
+    response.accept_ranges = 'bytes'
+    return response
+
+
+def _read_range(data, begin, end, chunk_size=0x10000):
+    """
+    Read from `begin` up to `end` in a file-like object in chunks and close
+    it afterwards.
+    """
+    try:
+        data.seek(begin)
+        remaining = end - begin
+        while remaining > 0:
+            chunk = data.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        data.close()
+
+
+class UriTemplate(object):
+    """
+    Precompiled template for building and parsing URIs of a URL rule.
+
+    Building a URI with :func:`flask.url_for` goes through the URL adapter,
+    the rule converters and URL quoting and joining on every call. This adds
+    up when serializing large collections, so for the rules registered by our
+    resources we compile a format string and a regular expression once and
+    use those instead.
+
+    The template does not include the script root of the application, which
+    depends on the request (e.g., when running behind a reverse proxy, see
+    :class:`varda.ReverseProxied`).
+    """
+    def __init__(self, rule):
+        self.converters = {}
+        template = []
+        pattern = []
+        for converter, arguments, variable in parse_rule(rule.rule):
+            if converter is None:
+                template.append(variable.replace('%', '%%'))
+                pattern.append(re.escape(variable))
+                continue
+            if arguments:
+                c_args, c_kwargs = parse_converter_args(arguments)
+            else:
+                c_args, c_kwargs = (), {}
+            self.converters[variable] = rule.get_converter(
+                variable, converter, c_args, c_kwargs)
+            template.append('%%(%s)s' % variable)
+            pattern.append('(?P<%s>%s)' % (variable,
+                                           self.converters[variable].regex))
+        self.template = ''.join(template)
+        self.regex = re.compile('^%s$' % ''.join(pattern))
+
+    def build(self, values):
+        """
+        Build URI from given view arguments.
+        """
+        return request.script_root + self.template % {
+            variable: converter.to_url(values[variable])
+            for variable, converter in self.converters.items()}
+
+    def match(self, path):
+        """
+        Parse view arguments from given path, or return `None` if the path
+        does not match the template.
+        """
+        m = self.regex.match(path)
+        if m is None:
+            return None
+        try:
+            return {variable: converter.to_python(m.group(variable))
+                    for variable, converter in self.converters.items()}
+        except RoutingValidationError:
+            return None
+
+
+def register_uri_template(app, endpoint):
+    """
+    Compile a URI template for the rule registered with `endpoint` and store
+    it with `app`.
+
+    Endpoints with more than one rule are skipped, for these we have to
+    resort to the URL map.
+    """
+    rules = list(app.url_map.iter_rules(endpoint))
+    if len(rules) != 1:
+        return
+    templates = app.extensions.setdefault('uri_templates', {})
+    templates[endpoint] = UriTemplate(rules[0])
+
+
+def uri_for(endpoint, **values):
+    """
+    Build the URI for given endpoint, using a precompiled template if
+    possible.
+
+    This can be used as a faster alternative to :func:`flask.url_for` (only
+    for building relative URIs without query string).
+    """
+    if endpoint.startswith('.'):
+        endpoint = request.blueprint + endpoint
+    try:
+        template = current_app.extensions['uri_templates'][endpoint]
+    except KeyError:
+        return url_for(endpoint, **values)
+    return template.build(values)
+
+
 def parse_args(app, endpoint, uri):
     """
     Parse view arguments from given URI.
@@ -90,6 +341,19 @@ def parse_args(app, endpoint, uri):
     if not uri:
         raise ValueError('no uri to resolve')
     path = urlparse.urlsplit(uri).path
+
+    # Fast path using the precompiled template for this endpoint. The slow
+    # path below matches against the entire URL map.
+    template = app.extensions.get('uri_templates', {}).get(endpoint)
+    if template is not None:
+        relative_path = path
+        if has_request_context() and request.script_root:
+            if path.startswith(request.script_root + '/'):
+                relative_path = path[len(request.script_root):]
+        args = template.match(relative_path)
+        if args is not None:
+            return args
+
     try:
         matched_endpoint, args = app.url_map.bind('').match(path)
         assert matched_endpoint == endpoint
@@ -118,7 +382,10 @@ def sample_by_uri(app, uri):
         args = parse_args(app, 'api.sample_get', uri)
     except ValueError:
         return None
-    return Sample.query.get(args['sample'])
+    sample = Sample.query.get(args['sample'])
+    if sample is None or sample.deleted:
+        return None
+    return sample
 
 
 def group_by_uri(app, uri):
@@ -151,7 +418,10 @@ def variation_by_uri(app, uri):
         args = parse_args(app, 'api.variation_get', uri)
     except ValueError:
         return None
-    return Variation.query.get(args['variation'])
+    variation = Variation.query.get(args['variation'])
+    if variation is None or variation.sample.deleted:
+        return None
+    return variation
 
 
 def coverage_by_uri(app, uri):
@@ -162,7 +432,10 @@ def coverage_by_uri(app, uri):
         args = parse_args(app, 'api.coverage_get', uri)
     except ValueError:
         return None
-    return Coverage.query.get(args['coverage'])
+    coverage = Coverage.query.get(args['coverage'])
+    if coverage is None or coverage.sample.deleted:
+        return None
+    return coverage
 
 
 def data_source_by_uri(app, uri):
@@ -173,7 +446,10 @@ def data_source_by_uri(app, uri):
         args = parse_args(app, 'api.data_source_get', uri)
     except ValueError:
         return None
-    return DataSource.query.get(args['data_source'])
+    data_source = DataSource.query.get(args['data_source'])
+    if data_source is None or data_source.deleted:
+        return None
+    return data_source
 
 
 def annotation_by_uri(app, uri):
@@ -193,13 +469,40 @@ def user_by_login(login, password):
     return ``None``.
     """
     user = User.query.filter_by(login=login).first()
-    if user is not None and user.check_password(password):
+    if user is None:
+        return None
+
+    # Checking the password is deliberately slow, so we cache credentials
+    # that were verified successfully. Failed attempts are never cached, so
+    # this does not make guessing passwords any easier. The cache key
+    # includes the password hash, so entries cannot match anymore after a
+    # password change, and it is an HMAC, so we don't keep any passwords in
+    # memory.
+    key = hmac.new(CREDENTIALS_CACHE_SECRET,
+                   repr((login, password, user.password_hash)),
+                   sha256).digest()
+    if credentials_cache.get(key) == user.id:
+        return user
+    if user.check_password(password):
+        credentials_cache.set(key, user.id)
         return user
 
 
 def user_by_token(token):
     """
-    Check if token belongs to a user and return the user if so, else return
-    ``None``.
+    Check if token belongs to a user and return a tuple of the user id and
+    roles bitstring if so, else return ``None``.
+
+    We don't query for the user itself, since many requests don't need it
+    (e.g., if only the user roles are checked). The result is cached, so
+    this is a database query only once in a while. The cache must be updated
+    when a token is deleted or the roles of a user change.
     """
-    return User.query.join(Token).filter_by(key=token).first()
+    user = token_cache.get(token)
+    if user is None:
+        user = db.session.query(User.id, User.roles_bitstring).join(
+            Token).filter(Token.key == token).first()
+        if user is not None:
+            user = tuple(user)
+            token_cache.set(token, user)
+    return user
@@ -13,7 +13,7 @@ import semantic_version
 
 from .. import genome
 from .. import tasks
-from ..models import InvalidDataSource
+from ..models import InvalidDataSource, User
 from ..utils import chromosome_compare_key
 from .errors import (AcceptError, ActivationFailure, BasicAuthRequiredError,
                      IntegrityError, ValidationError)
@@ -98,13 +98,16 @@ def add_cors_headers(response):
 def register_user():
     """
     Make sure we add a :class:`.User` instance to the global objects if we
-    have authentication.
+    have authentication. The roles of this user are added separately as
+    `user_roles`.
 
     Authentication can be achieved either by HTTP Basic Authentication using
-    login and password, or by token authentication.
+    login and password, or by token authentication. In the latter case, the
+    user instance is only queried when it is first accessed.
     """
-    user = None
-    auth_method = None
+    g.user = None
+    g.user_roles = set()
+    g.auth_method = None
 
     auth = request.authorization
     if auth:
@@ -113,19 +116,21 @@ def register_user():
             current_app.logger.warning('Unsuccessful authentication with '
                                        'username "%s"', auth.username)
         else:
-            auth_method = 'basic-auth'
+            g.user = user
+            g.user_roles = user.roles
+            g.auth_method = 'basic-auth'
     else:
         auth = request.headers.get('Authorization', '').split()
         if len(auth) == 2 and auth[0] == 'Token':
-            user = user_by_token(auth[1])
-            if user is None:
+            token_user = user_by_token(auth[1])
+            if token_user is None:
                 current_app.logger.warning('Unsuccessful authentication with '
                                            'token "%s"', auth[1])
             else:
-                auth_method = 'token'
-
-    g.user = user
-    g.auth_method = auth_method
+                user_id, roles_bitstring = token_user
+                g.set_lazy('user', lambda: User.query.get(user_id))
+                g.user_roles = User.decode_roles(roles_bitstring)
+                g.auth_method = 'token'
 
 
 @api.errorhandler(400)
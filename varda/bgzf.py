@@ -0,0 +1,254 @@
+"""
+Reading and writing files in the BGZF format.
+
+BGZF (Blocked GNU Zip Format) is gzip-compatible, consisting of a series of
+gzip members (blocks) of at most 64 kilobytes uncompressed data each. A
+position in the uncompressed data can be addressed by a *virtual offset*,
+being the offset of the block in the compressed file shifted 16 bits to the
+left, plus the offset within the uncompressed block. This makes random access
+possible.
+
+The format is described in the `SAM specification
+<http://samtools.github.io/hts-specs/SAMv1.pdf>`_. Files can be read by any
+gzip implementation.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import struct
+import zlib
+
+
+# Maximum number of uncompressed bytes in a block (the same value as used by
+# samtools). This guarantees that the compressed block fits in 64 kilobytes.
+BLOCK_SIZE = 0xff00
+
+# Gzip header with the BGZF extra field, up to the BSIZE value.
+BLOCK_HEADER = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00'
+                'BC\x02\x00')
+
+# Empty block marking the end of the file.
+EOF_BLOCK = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+             '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+class BgzfError(Exception):
+    """
+    Exception thrown on invalid BGZF data.
+    """
+    pass
+
+
+def is_bgzf(path):
+    """
+    Check if a file is in the BGZF format by looking at the header of its
+    first block.
+    """
+    with open(path, 'rb') as f:
+        return _is_block_header(f.read(18))
+
+
+def _is_block_header(header):
+    # We ignore the MTIME, XFL, and OS fields, which may differ between
+    # implementations.
+    return (len(header) == 18 and
+            header[:4] == BLOCK_HEADER[:4] and
+            header[10:16] == BLOCK_HEADER[10:16])
+
+
+class BgzfWriter(object):
+    """
+    File-like object for writing BGZF data.
+
+    :arg fileobj: File-like object opened for writing in binary mode.
+    :arg compresslevel: Compression level (1 to 9).
+    :type compresslevel: int
+    """
+    #: Number of uncompressed bytes in a block.
+    block_size = BLOCK_SIZE
+
+    def __init__(self, fileobj, compresslevel=6):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self._buffer = []
+        self._buffered = 0
+        self._block_offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        """
+        Write `data`.
+        """
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BLOCK_SIZE:
+            data = ''.join(self._buffer)
+            while len(data) >= BLOCK_SIZE:
+                self._write_block(data[:BLOCK_SIZE])
+                data = data[BLOCK_SIZE:]
+            self._buffer = [data]
+            self._buffered = len(data)
+
+    def tell(self):
+        """
+        Virtual offset of the current position.
+        """
+        return (self._block_offset << 16) | self._buffered
+
+    def flush(self):
+        """
+        Write buffered data as a (possibly small) block.
+        """
+        if self._buffered:
+            self._write_block(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self.fileobj.flush()
+
+    def close(self):
+        """
+        Write buffered data and the end-of-file marker and close the
+        underlying file.
+        """
+        if self.fileobj is None:
+            return
+        self.flush()
+        self.fileobj.write(EOF_BLOCK)
+        self.fileobj.close()
+        self.fileobj = None
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        # The BSIZE value is the total block size minus 1, the header and
+        # footer add 26 bytes.
+        block = ''.join([BLOCK_HEADER,
+                         struct.pack('<H', len(compressed) + 25),
+                         compressed,
+                         struct.pack('<I', zlib.crc32(data) & 0xffffffff),
+                         struct.pack('<I', len(data))])
+        self.fileobj.write(block)
+        self._block_offset += len(block)
+
+
+class BgzfReader(object):
+    """
+    File-like object for reading BGZF data, supporting :meth:`seek` and
+    :meth:`tell` with virtual offsets.
+
+    :arg fileobj: File-like object opened for reading in binary mode.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._load_block(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def seek(self, virtual_offset):
+        """
+        Move to the given virtual offset.
+        """
+        block_offset, within = virtual_offset >> 16, virtual_offset & 0xffff
+        if block_offset != self._block_offset:
+            self._load_block(block_offset)
+        if within > len(self._data):
+            raise BgzfError('Invalid virtual offset %d' % virtual_offset)
+        self._within = within
+
+    def tell(self):
+        """
+        Virtual offset of the current position.
+        """
+        if self._within == len(self._data) and self._data:
+            # Normalize to the start of the next block.
+            return self._next_block_offset << 16
+        return (self._block_offset << 16) | self._within
+
+    def read(self, size=-1):
+        """
+        Read at most `size` bytes (or everything if `size` is negative).
+        """
+        chunks = []
+        while size:
+            if self._within == len(self._data):
+                if not self._next_block():
+                    break
+            if size < 0:
+                end = len(self._data)
+            else:
+                end = min(len(self._data), self._within + size)
+                size -= end - self._within
+            chunks.append(self._data[self._within:end])
+            self._within = end
+        return ''.join(chunks)
+
+    def readline(self):
+        """
+        Read one line (including the newline character).
+        """
+        chunks = []
+        while True:
+            if self._within == len(self._data):
+                if not self._next_block():
+                    break
+            end = self._data.find('\n', self._within)
+            if end >= 0:
+                chunks.append(self._data[self._within:end + 1])
+                self._within = end + 1
+                break
+            chunks.append(self._data[self._within:])
+            self._within = len(self._data)
+        return ''.join(chunks)
+
+    def close(self):
+        self.fileobj.close()
+
+    def _next_block(self):
+        # Skip empty blocks (such as the end-of-file marker).
+        while self._next_block_offset is not None:
+            self._load_block(self._next_block_offset)
+            if self._data:
+                return True
+        return False
+
+    def _load_block(self, block_offset):
+        self.fileobj.seek(block_offset)
+        header = self.fileobj.read(18)
+        self._block_offset = block_offset
+        self._within = 0
+        if not header:
+            self._data = ''
+            self._next_block_offset = None
+            return
+        if not _is_block_header(header):
+            raise BgzfError('Invalid BGZF block at offset %d' % block_offset)
+        block_size = struct.unpack('<H', header[16:])[0] + 1
+        rest = self.fileobj.read(block_size - 18)
+        if len(rest) != block_size - 18:
+            raise BgzfError('Truncated BGZF block at offset %d' % block_offset)
+        try:
+            self._data = zlib.decompress(rest[:-8], -zlib.MAX_WBITS)
+        except zlib.error as e:
+            raise BgzfError('Invalid BGZF block at offset %d: %s'
+                            % (block_offset, e))
+        self._next_block_offset = block_offset + block_size
@@ -0,0 +1,102 @@
+"""
+Simple in-memory caches.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class Cache(object):
+    """
+    Thread-safe in-memory cache with a maximum number of entries and a
+    maximum entry age.
+
+    Entries expire `timeout` seconds after they were set. If the cache is
+    full, the least recently used entry is evicted. Setting `size` or
+    `timeout` to 0 disables the cache.
+
+    Like :class:`varda.genome.Genome`, the cache is instantiated on import
+    and configured later (by :func:`varda.create_app`) using :meth:`init`.
+
+    Note that the cache lives in the memory of a single process, so
+    invalidation by one process (e.g., a web server worker) is not seen by
+    other processes. The `timeout` bounds how long they can see stale
+    entries.
+    """
+    def __init__(self, size=0, timeout=0):
+        self.init(size=size, timeout=timeout)
+
+    def init(self, size=0, timeout=0):
+        """
+        Configure the cache and remove all entries.
+
+        :arg size: Maximum number of entries.
+        :type size: int
+        :arg timeout: Maximum age of entries in seconds.
+        :type timeout: int
+        """
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get the value for `key`, or `default` if it is not in the cache or
+        has expired.
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires < time.time():
+                return default
+            # Re-insert to mark as most recently used.
+            self._entries[key] = expires, value
+            return value
+
+    def set(self, key, value):
+        """
+        Set the value for `key`.
+        """
+        if not (self.size and self.timeout):
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.size:
+                self._entries.popitem(last=False)
+            self._entries[key] = time.time() + self.timeout, value
+
+    def delete(self, key):
+        """
+        Remove `key` from the cache.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def prune(self, predicate):
+        """
+        Remove all entries for which `predicate` returns `True` when called
+        with the entry value.
+        """
+        with self._lock:
+            for key, (_, value) in self._entries.items():
+                if predicate(value):
+                    del self._entries[key]
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,191 @@
+"""
+Checksums and record counts for data sources.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from distutils.spawn import find_executable
+import gzip
+import hashlib
+import Queue
+import subprocess
+import threading
+import zlib
+
+
+# Default chunk size is 16 megabytes.
+CHUNK_SIZE = 0xf00000
+
+# Location of the pigz executable, if available, used for decompressing
+# local data files.
+PIGZ = find_executable('pigz')
+
+
+class Digest(object):
+    """
+    Incremental calculation of a checksum and number of records.
+
+    Calculating the number of records is done in a naive way by counting the
+    number of lines in the data, and as such includes empty and header lines.
+
+    :arg hash_function: Constructor for a :mod:`hashlib` compatible hash
+        object.
+    :type hash_function: function
+    """
+    def __init__(self, hash_function=hashlib.sha1):
+        self._hash = hash_function()
+        self.records = 0
+
+    def update(self, chunk):
+        """
+        Add a chunk of data.
+        """
+        self._hash.update(chunk)
+        self.records += chunk.count('\n')
+
+    @property
+    def checksum(self):
+        """
+        Checksum of the data as hexadecimal string.
+        """
+        return self._hash.hexdigest()
+
+
+def read_chunks(data, chunk_size=CHUNK_SIZE):
+    """
+    Read chunks from a file-like object opened for reading.
+    """
+    while True:
+        chunk = data.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def decompress_chunks(chunks, chunk_size=CHUNK_SIZE):
+    """
+    Decompress gzip-compressed data given as an iterator of chunks.
+
+    The data is validated while it is decompressed and may consist of
+    multiple gzip members (e.g., BGZF data). At most `chunk_size` bytes of
+    decompressed data are produced at a time, regardless of the compression
+    ratio.
+
+    :arg chunks: Iterator yielding chunks of gzip-compressed data.
+    :arg chunk_size: Maximum size of decompressed chunks.
+    :type chunk_size: int
+
+    :return: Iterator yielding chunks of decompressed data.
+
+    :raise zlib.error: If the data is not valid gzip-compressed data.
+    :raise EOFError: If the data is truncated.
+    """
+    decompressor = None
+    for chunk in chunks:
+        while chunk:
+            if decompressor is None:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(chunk, chunk_size)
+            if data:
+                yield data
+            if decompressor.unused_data:
+                # End of a gzip member, the rest is the start of the next.
+                chunk = decompressor.unused_data
+                decompressor = None
+            else:
+                chunk = decompressor.unconsumed_tail
+
+    if decompressor is not None:
+        # Only after the end of a gzip member is data left unused. This also
+        # gives us any remaining decompressed data.
+        data = decompressor.decompress('\0')
+        if not decompressor.unused_data:
+            raise EOFError('Compressed data ended before the end-of-stream '
+                           'marker was reached')
+        if data:
+            yield data
+
+
+def digest(data, hash_function=hashlib.sha1):
+    """
+    Given a file-like object opened for reading, calculate a digest as
+    checksum and number of records.
+
+    :return: Tuple of checksum and number of records, see :class:`Digest`.
+    :rtype: (str, int)
+    """
+    data_digest = Digest(hash_function)
+    for chunk in read_chunks(data):
+        data_digest.update(chunk)
+    return data_digest.checksum, data_digest.records
+
+
+def digest_file(path, gzipped=False, hash_function=hashlib.sha1):
+    """
+    Calculate a digest for the (uncompressed) data in a file.
+
+    Decompression is done by an external pigz process if it is available,
+    or in a separate thread otherwise. Either way, decompression and
+    calculating the checksum are done in parallel.
+
+    :arg path: Location of the file.
+    :type path: str
+    :arg gzipped: Whether or not the file is gzip-compressed.
+    :type gzipped: bool
+
+    :return: Tuple of checksum and number of records, see :class:`Digest`.
+    :rtype: (str, int)
+    """
+    if not gzipped:
+        with open(path, 'rb') as data:
+            return digest(data, hash_function)
+
+    if PIGZ:
+        chunks = _pigz_chunks(path)
+    else:
+        chunks = _threaded_gzip_chunks(path)
+
+    data_digest = Digest(hash_function)
+    for chunk in chunks:
+        data_digest.update(chunk)
+    return data_digest.checksum, data_digest.records
+
+
+def _pigz_chunks(path):
+    process = subprocess.Popen([PIGZ, '--decompress', '--stdout', path],
+                               stdout=subprocess.PIPE)
+    for chunk in read_chunks(process.stdout):
+        yield chunk
+    if process.wait() != 0:
+        raise IOError('Could not decompress "%s"' % path)
+
+
+def _threaded_gzip_chunks(path):
+    # The zlib and hashlib modules release the GIL on large buffers, so this
+    # gives some real parallelism.
+    chunks = Queue.Queue(maxsize=4)
+
+    def decompress():
+        try:
+            with gzip.open(path) as data:
+                for chunk in read_chunks(data):
+                    chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        else:
+            chunks.put(None)
+
+    thread = threading.Thread(target=decompress)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
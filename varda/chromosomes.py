@@ -0,0 +1,126 @@
+"""
+Chromosome name normalization.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+# Maximum number of chromosome names we remember the normalization of. This
+# is way more than there are contigs in any reference genome, but user input
+# may contain arbitrary names and we don't want to grow without bounds.
+MAX_RESOLVED = 100000
+
+
+def read_aliases(filename):
+    """
+    Read chromosome aliases from a file.
+
+    Every line in the file lists the names of one chromosome, separated by
+    whitespace. The first name is the preferred name if there is no
+    reference genome. Empty lines and lines starting with ``#`` are ignored.
+
+    Example file with UCSC and GRCh37 names::
+
+        # UCSC  GRCh37  RefSeq
+        chrM    MT      NC_012920.1
+        chr1    1       NC_000001.10
+        chr1_gl000191_random    GL000191.1
+
+    :arg filename: Location of the file.
+    :type filename: str
+
+    :return: List of chromosome aliases.
+    :rtype: list(list(str))
+    """
+    aliases = []
+    with open(filename) as lines:
+        for line in lines:
+            if line.startswith('#'):
+                continue
+            names = line.split()
+            if names:
+                aliases.append(names)
+    return aliases
+
+
+class ChromosomeNames(object):
+    """
+    Normalization of chromosome names, using a reference genome and a list of
+    chromosome aliases.
+
+    Normalizing a chromosome name is done for every variant we read, so the
+    result is remembered for every name seen. Like :class:`varda.genome.Genome`,
+    this is instantiated on import and configured later (by
+    :func:`varda.create_app`) using :meth:`init`.
+    """
+    def __init__(self):
+        self.init()
+
+    def init(self, reference=None, aliases=None):
+        """
+        Configure normalization and forget all previously normalized names.
+
+        :arg reference: Reference genome, or `None` to normalize without a
+            reference genome.
+        :type reference: varda.genome.Genome
+        :arg aliases: List of chromosome aliases, where each item is a list
+            of names for the same chromosome. The first name in the list is
+            the preferred name if there is no reference genome.
+        :type aliases: list(list(str))
+        """
+        self.reference = set(reference.keys()) if reference else None
+        self._aliases = aliases or []
+        # Indices in the list of aliases for each name.
+        self._alias_index = {}
+        for i, names in enumerate(self._aliases):
+            for name in names:
+                self._alias_index.setdefault(name, []).append(i)
+        self._resolved = {}
+
+    def normalize(self, chromosome):
+        """
+        Get normalized chromosome name.
+
+        :arg chromosome: Chromosome name.
+        :type chromosome: str
+
+        :return: Normalized chromosome name, or `None` if the chromosome is
+            not in the reference genome.
+        :rtype: str
+        """
+        try:
+            return self._resolved[chromosome]
+        except KeyError:
+            pass
+        normalized = self._resolve(chromosome)
+        if len(self._resolved) < MAX_RESOLVED:
+            self._resolved[chromosome] = normalized
+        return normalized
+
+    def _resolve(self, chromosome):
+        if chromosome.startswith('chr'):
+            chromosome = chromosome[3:]
+
+        # Lists of aliases containing this chromosome, in order.
+        aliases = [self._aliases[i] for i in sorted(set(
+            self._alias_index.get(chromosome, []) +
+            self._alias_index.get('chr' + chromosome, [])))]
+
+        if self.reference is None:
+            if aliases:
+                return aliases[0][0]
+            return chromosome
+
+        if chromosome in self.reference:
+            return chromosome
+        elif 'chr' + chromosome in self.reference:
+            return 'chr' + chromosome
+
+        for names in aliases:
+            for alias in names:
+                if alias in self.reference:
+                    return alias
+
+        return None
@@ -75,6 +75,36 @@ def database_setup(app, alembic_config='alembic.ini', destructive=False,
             alembic.command.stamp(alembic_config, 'head')
 
 
+def partition(args):
+    """
+    Partition observations and regions by chromosome.
+    """
+    database_partition(create_app())
+
+
+def database_partition(app):
+    """
+    Partition the observation and region tables by chromosome. If they are
+    already partitioned, give chromosomes in the default partitions their own
+    partitions.
+    """
+    from . import partitioning
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            try:
+                if partitioning.is_partitioned(connection):
+                    chromosomes = partitioning.add_partitions(connection)
+                else:
+                    chromosomes = partitioning.partition(connection)
+            except ValueError as e:
+                sys.stderr.write('%s\n' % e)
+                sys.exit(1)
+
+    sys.stdout.write('Added partitions for %d chromosomes\n'
+                     % len(chromosomes))
+
+
 def admin_setup(password_hash=None):
     """
     Update the password for the admin user. If the admin user does not exist,
@@ -140,6 +170,10 @@ def main():
                               parents=[config_parser])
     p.set_defaults(func=setup)
 
+    p = subparsers.add_parser('partition', help=partition.__doc__,
+                              parents=[config_parser])
+    p.set_defaults(func=partition)
+
     args = parser.parse_args()
     args.func(args)
 
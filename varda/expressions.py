@@ -351,6 +351,47 @@ class QueryCriterionBuilder(object):
         return sqlalchemy.or_(left, right)
 
 
+class BitsetEvaluator(object):
+    """
+    Evaluate a query expression AST to a bitset (an integer with a bit set
+    for every matched element).
+    """
+    visitor = Visitor()
+
+    def __init__(self, evaluate_clause, universe):
+        """
+        The `evaluate_clause` argument should be a function that, given a
+        clause field name and value, returns the bitset matched by the
+        clause. The `universe` argument is the bitset of all elements.
+        """
+        self.evaluate_clause = evaluate_clause
+        self.universe = universe
+
+    @visitor(Tautology)
+    def visit(self, node):
+        return self.universe
+
+    @visitor(Clause)
+    def visit(self, node):
+        return self.evaluate_clause(node.field, node.value)
+
+    @visitor(ExpressionNode)
+    def visit(self, node, expression):
+        return expression
+
+    @visitor(Negation)
+    def visit(self, node, expression):
+        return self.universe & ~expression
+
+    @visitor(Conjunction)
+    def visit(self, node, left, right):
+        return left & right
+
+    @visitor(Disjunction)
+    def visit(self, node, left, right):
+        return left | right
+
+
 class ClauseValueUpdater(object):
     """
     Update values in all clauses in a query expression AST.
@@ -489,6 +530,28 @@ def build_query_criterion(expression, build_clause):
     return expression.accept(QueryCriterionBuilder(build_clause))
 
 
+def evaluate_bitset(expression, evaluate_clause, universe):
+    """
+    Evaluate a query expression AST to a bitset, an integer with bit `i` set
+    iff element `i` is matched.
+
+    :arg evaluate_clause: Given a field name and value of a clause
+      `field:value`, this function should return the bitset of elements
+      matched by the clause.
+    :type evaluate_clause: function
+    :arg universe: Bitset of all elements.
+    :type universe: int
+
+        >>> def match_by_id(field, value):
+        ...     return 1 << int(value)
+        >>> expression = parse('not (user:1 or user:3)')
+        >>> bin(evaluate_bitset(expression, match_by_id, 0b11111))
+        '0b10101'
+
+    """
+    return expression.accept(BitsetEvaluator(evaluate_clause, universe))
+
+
 def update_clause_values(expression, update_value):
     """
     Update values in all clauses in a query expression AST.
@@ -7,9 +7,103 @@ Wrapper for ``pyfaidx`` to load a genome after instantiation.
 """
 
 
+from collections import namedtuple
+import mmap
+
 from pyfaidx import Fasta
 
 
+#: Record in a Samtools "faidx" index file, see :func:`read_fai`.
+FaiRecord = namedtuple('FaiRecord', ['length', 'offset', 'line_bases',
+                                     'line_bytes'])
+
+
+def read_fai(filename):
+    """
+    Read a Samtools "faidx" index file.
+
+    We don't use the index as read by ``pyfaidx``, since its attributes are
+    not part of the ``pyfaidx`` API.
+
+    :arg filename: Name of the index file.
+    :type filename: str
+
+    :return: Dictionary with for every chromosome name its index record.
+    :rtype: dict(str, FaiRecord)
+    """
+    index = {}
+    with open(filename) as fai:
+        for line in fai:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) < 5:
+                continue
+            index[fields[0]] = FaiRecord(*[int(field)
+                                           for field in fields[1:5]])
+    return index
+
+
+class MappedRecord(object):
+    """
+    Chromosome sequence in a memory-mapped FASTA file.
+
+    Implements the subset of the ``pyfaidx.FastaRecord`` interface we use
+    (``len`` and subscripting, returning strings), but without seeking and
+    reading the file for every lookup.
+
+    :arg name: Chromosome name.
+    :type name: str
+    :arg index: FASTA index record for the chromosome.
+    :type index: FaiRecord
+    :arg data: Memory-mapped FASTA file.
+    :type data: mmap.mmap
+    """
+    def __init__(self, name, index, data):
+        self.name = name
+        self._data = data
+        self._offset = index.offset
+        self._length = index.length
+        self._line_length = index.line_bases
+        self._line_bytes = index.line_bytes
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return 'MappedRecord("%s")' % self.name
+
+    def __getitem__(self, n):
+        """
+        Return sequence from region [start, end). Coordinates are 0-based,
+        end-exclusive, and are truncated at the chromosome boundaries.
+        """
+        if isinstance(n, slice):
+            start, stop, step = n.indices(self._length)
+            return self._fetch(start, stop)[::step]
+        if n < 0:
+            n += self._length
+        if not 0 <= n < self._length:
+            raise IndexError('position %d out of range for chromosome "%s"'
+                             % (n, self.name))
+        return self._data[self._byte_offset(n)]
+
+    def _byte_offset(self, position):
+        line, column = divmod(position, self._line_length)
+        return self._offset + line * self._line_bytes + column
+
+    def _fetch(self, start, stop):
+        if start >= stop:
+            return ''
+        begin = self._byte_offset(start)
+        # Offset of the last base, not the one after it, which may be on the
+        # next line.
+        end = self._byte_offset(stop - 1) + 1
+        sequence = self._data[begin:end]
+        if end - begin == stop - start:
+            return sequence
+        # The region spans multiple lines.
+        return sequence.replace('\n', '').replace('\r', '')
+
+
 class Genome(Fasta):
     """
     Version of ``pyfaidx.Fasta`` that is initialized after instantiation.
@@ -20,15 +114,45 @@ class Genome(Fasta):
     Checking if an instance has been initialized can be done by looking at its
     boolean value.
 
+    If initialized with ``mmap=True``, the FASTA file is memory-mapped and
+    sequence lookups are done by slicing the mapping directly (chromosome
+    records are instances of :class:`MappedRecord`). The mapping is
+    read-only and survives forking, so unlike the open file object used by
+    ``pyfaidx``, it can be shared by worker processes. Pages are shared
+    through the operating system page cache.
+
     .. todo:: Check if ``pyfaidx.Fasta`` is thread-safe. It depends on the
-        application server model (and Celery model) if we need it.
+        application server model (and Celery model) if we need it. (Not an
+        issue with ``mmap=True``.)
     """
     def __init__(self):
         self.filename = ''
         self.keys = lambda: []
+        self.mapped = False
 
     def init(self, *args, **kwargs):
+        use_mmap = kwargs.pop('mmap', False)
+        self.close_mapping()
         super(Genome, self).__init__(*args, **kwargs)
+        if use_mmap:
+            # The index file is created by ``pyfaidx`` if it does not exist.
+            index = read_fai(self.filename + '.fai')
+            with open(self.filename, 'rb') as fasta:
+                self._mapping = mmap.mmap(fasta.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            self.records = {name: MappedRecord(name, record, self._mapping)
+                            for name, record in index.items()}
+            # We don't need the file object opened by ``pyfaidx`` anymore.
+            self.close()
+            self.mapped = True
+
+    def close_mapping(self):
+        """
+        Close the memory-mapped FASTA file, if any.
+        """
+        if self.mapped:
+            self._mapping.close()
+            self.mapped = False
 
     def __len__(self):
         return len(self.keys())
@@ -15,21 +15,31 @@ from functools import wraps
 import gzip
 from hashlib import sha1
 import hmac
+import itertools
 import os
 import re
 import sqlite3
 import uuid
+import zlib
 
 import bcrypt
 import binning
 from flask import current_app
-from sqlalchemy import event, Index, TypeDecorator
+from sqlalchemy import (and_, bindparam, event, exists, Index, or_,
+                        TypeDecorator)
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import object_mapper, Session
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
 from sqlalchemy.orm.exc import DetachedInstanceError
 import werkzeug
 
-from . import db
+from . import credentials_cache, db
+from .alleles import allele_key
+from .bgzf import BgzfError, BgzfReader, BgzfWriter, is_bgzf
+from .checksums import decompress_chunks, Digest, digest_file, read_chunks
 from . import expressions
+from .region_index import (IndexingWriter, iter_region, read_index,
+                           record_location, RegionIndexer, write_index)
 
 
 # Todo: Use the types for which we have validators.
@@ -194,6 +204,15 @@ class User(db.Model):
         return sum(pow(2, i) for i, role
                    in enumerate(USER_ROLES) if role in roles)
 
+    @staticmethod
+    def decode_roles(roles_bitstring):
+        """
+        The subset of the roles defined in :data:`USER_ROLES` encoded by
+        `roles_bitstring` (see :attr:`roles_bitstring`).
+        """
+        return {role for i, role in enumerate(USER_ROLES)
+                if roles_bitstring & pow(2, i)}
+
     @property
     def password(self):
         """
@@ -208,14 +227,14 @@ class User(db.Model):
         Change the password for the user.
         """
         self.password_hash = self.hash_password(password)
+        credentials_cache.prune(lambda user_id: user_id == self.id)
 
     @property
     def roles(self):
         """
         A subset of the roles defined in :data:`USER_ROLES`.
         """
-        return {role for i, role in enumerate(USER_ROLES)
-                if self.roles_bitstring & pow(2, i)}
+        return self.decode_roles(self.roles_bitstring)
 
     @roles.setter
     def roles(self, roles):
@@ -334,6 +353,15 @@ class Sample(db.Model):
     #: frequencies by anyone.
     public = db.Column(db.Boolean)
 
+    #: Set to `True` iff the sample is deleted. It is hidden while its
+    #: observations and regions are purged in the background (see
+    #: :func:`varda.tasks.purge_sample`).
+    deleted = db.Column(db.Boolean, default=False, nullable=False)
+
+    #: Celery task identifier of the purge of a deleted sample (see
+    #: :func:`varda.tasks.purge_sample`).
+    purge_task_uuid = db.Column(db.String(36))
+
     #: Textual notes.
     #:
     #: .. hint:: If you use `Markdown <http://daringfireball.net/projects/markdown/>`_
@@ -422,7 +450,9 @@ class DataSource(db.Model):
           in the directory specified by the `SECONDARY_DATA_DIR` configuration
           setting. If the `SECONDARY_DATA_BY_USER` configuration setting is
           `True`, an additional subdirectory within `SECONDARY_DATA_DIR` is
-          used with name equal to `user.login`.
+          used with name equal to `user.login`. The data is not read here,
+          use the :func:`varda.tasks.digest_data_source` task to calculate
+          its digest and region index.
 
         * `empty`: No data is provided for the data source at this point. Data
           can be written to it later using the :meth:`data_writer` method.
@@ -442,13 +472,28 @@ class DataSource(db.Model):
         path = os.path.join(current_app.config['DATA_DIR'],
                                 self.filename)
 
+        # We calculate the digest of uploads right away, so tasks using the
+        # data don't have to read it an extra time. Uploads are streamed in
+        # chunks and stored BGZF-compressed, being decompressed (and thereby
+        # validated), digested, and indexed in the same pass.
         if upload is not None:
+            chunks = read_chunks(upload)
             if gzipped:
-                upload.save(path)
-            else:
-                data = gzip.open(path, 'wb')
-                data.write(upload.read())
-                data.close()
+                chunks = decompress_chunks(chunks)
+            data_digest = Digest()
+            try:
+                with self._bgzf_writer() as data:
+                    for chunk in chunks:
+                        data_digest.update(chunk)
+                        data.write(chunk)
+            except (EOFError, zlib.error):
+                for p in (path, self.index_path()):
+                    if os.path.exists(p):
+                        os.unlink(p)
+                raise InvalidDataSource(
+                    'invalid_data', 'Data is not valid gzip-compressed data')
+            self.checksum = data_digest.checksum
+            self.records = data_digest.records
             self.gzipped = True
         elif local_file is not None:
             if not current_app.config['SECONDARY_DATA_DIR']:
@@ -474,6 +519,111 @@ class DataSource(db.Model):
         return '<DataSource %r, filename=%r, filetype=%r, records=%r>' \
             % (self.name, self.filename, self.filetype, self.records)
 
+    def digest_data(self):
+        """
+        Calculate and store the checksum and number of records for the data
+        contained in this data source.
+
+        If the data cannot be read (e.g., it is not valid gzip-compressed
+        data), the checksum and number of records are set to `None`.
+        """
+        try:
+            self.checksum, self.records = digest_file(self.local_path(),
+                                                      gzipped=self.gzipped)
+        except (EnvironmentError, EOFError, zlib.error):
+            self.checksum, self.records = None, None
+
+    def index_data(self):
+        """
+        Build and store a region index for the data contained in this data
+        source, see :meth:`region`.
+
+        Only uncompressed and BGZF-compressed data can be indexed. For other
+        data, or if the data cannot be read, no index is stored.
+        """
+        indexer = RegionIndexer(self.filetype)
+        try:
+            if not self.gzipped:
+                data = open(self.local_path(), 'rb')
+            elif is_bgzf(self.local_path()):
+                data = BgzfReader(open(self.local_path(), 'rb'))
+            else:
+                data = None
+            if data is not None:
+                with data:
+                    while True:
+                        offset = data.tell()
+                        line = data.readline()
+                        if not line:
+                            break
+                        indexer.add(line, offset)
+        except (EnvironmentError, BgzfError):
+            data = None
+        write_index(indexer.index if data is not None else None,
+                    self.index_path())
+
+    def header(self):
+        """
+        Get the header lines (all lines before the first record) of the data
+        contained in this data source.
+
+        :return: List of header lines.
+        :rtype: list(str)
+        """
+        lines = []
+        with self.data() as data:
+            for line in data:
+                if record_location(self.filetype, line) is not None:
+                    break
+                lines.append(line)
+        return lines
+
+    def region(self, chromosome, begin=None, end=None):
+        """
+        Iterate over the records in the data contained in this data source
+        overlapping a region.
+
+        If a region index is available, only the part of the data containing
+        the region is read. Otherwise, all data is read.
+
+        :arg chromosome: Chromosome name, as used in the data.
+        :type chromosome: str
+        :arg begin: Begin of the region, or `None` for the start of the
+            chromosome.
+        :type begin: int
+        :arg end: End of the region, or `None` for the end of the
+            chromosome.
+        :type end: int
+
+        :return: Iterator yielding lines of data.
+        """
+        index = read_index(self.index_path())
+        if index is not None:
+            try:
+                if self.gzipped:
+                    data = BgzfReader(open(self.local_path(), 'rb'))
+                else:
+                    data = open(self.local_path(), 'rb')
+            except EnvironmentError:
+                raise DataUnavailable('data_source_not_cached',
+                                      'Data source is not in the cache')
+            with data:
+                for line in iter_region(data, index, chromosome, begin,
+                                        end):
+                    yield line
+            return
+
+        with self.data() as data:
+            for line in data:
+                location = record_location(self.filetype, line)
+                if location is None:
+                    continue
+                record_chromosome, record_begin, record_end = location
+                if (record_chromosome == chromosome and
+                    (begin is None or record_end >= begin) and
+                    (end is None or record_begin <= end)):
+                    yield line
+
     def data(self):
         """
         Get open file-like handle to data contained in this data source for
@@ -499,13 +649,12 @@ class DataSource(db.Model):
 
         .. note:: Be sure to close after calling this.
         """
-        filepath = os.path.join(current_app.config['DATA_DIR'],
-                                self.filename)
         try:
             if self.gzipped:
-                return gzip.open(filepath, 'wb')
+                return self._bgzf_writer()
             else:
-                return open(filepath, 'wb')
+                return IndexingWriter(open(self.local_path(), 'wb'),
+                                      self.filetype, self.index_path())
         except EnvironmentError:
             raise DataUnavailable('data_source_not_cached',
                                   'Data source is not in the cache')
@@ -523,6 +672,20 @@ class DataSource(db.Model):
         """
         return os.path.join(current_app.config['DATA_DIR'], self.filename)
 
+    def index_path(self):
+        """
+        Get a local filepath for the region index.
+        """
+        return self.local_path() + '.index'
+
+    def _bgzf_writer(self):
+        """
+        Get open file-like handle for writing BGZF-compressed data while
+        building a region index.
+        """
+        return IndexingWriter(BgzfWriter(open(self.local_path(), 'wb')),
+                              self.filetype, self.index_path())
+
 
 class Variation(db.Model):
     """
@@ -618,6 +781,19 @@ class Coverage(db.Model):
                                                           self.task_uuid)
 
 
+#: Set to `True` iff the data source is used by a variation or coverage of a
+#: deleted sample. It is hidden, and deleted with the sample unless it is
+#: also used otherwise (see :func:`varda.tasks.purge_sample`).
+DataSource.deleted = db.column_property(
+    or_(exists().where(and_(Variation.data_source_id == DataSource.id,
+                            Variation.sample_id == Sample.id,
+                            Sample.deleted)),
+        exists().where(and_(Coverage.data_source_id == DataSource.id,
+                            Coverage.sample_id == Sample.id,
+                            Sample.deleted))),
+    deferred=True)
+
+
 annotation_query = db.Table(
     'annotation_query', db.Model.metadata,
     db.Column('annotation_id', db.Integer,
@@ -697,16 +873,17 @@ class Query(db.Model):
         """
         List of :class:`Sample` primary keys matched by this query.
         """
-        def build_clause(field, value):
-            if field == 'sample':
-                return Sample.id == int(value)
-            if field == 'group':
-                return Sample.groups.any(Group.id == int(value))
-            raise ValueError('can only query on sample or group')
-
         if self._samples is None:
-            criteria = [expressions.build_query_criterion(self.expression,
-                                                          build_clause)]
+            # The utils module imports from this module.
+            from .utils import (current_generations, known_sample_ids,
+                                matching_sample_ids, sample_criterion)
+
+            generations = current_generations()
+            criteria = [sample_criterion(Sample.id,
+                                         matching_sample_ids(self.expression,
+                                                             generations),
+                                         all_ids=known_sample_ids(generations)),
+                        ~Sample.deleted]
 
             if self.require_active:
                 criteria.append(Sample.active)
@@ -780,6 +957,12 @@ class Observation(db.Model):
                              db.ForeignKey('variation.id', ondelete='CASCADE'),
                              index=True, nullable=False)
 
+    #: Denormalized from :attr:`variation`, so frequency calculations don't
+    #: need to join the variation table.
+    sample_id = db.Column(db.Integer,
+                          db.ForeignKey('sample.id', ondelete='CASCADE'),
+                          index=True, nullable=False)
+
     #: Reference genome chromosome name.
     chromosome = db.Column(db.String(30))
 
@@ -797,6 +980,11 @@ class Observation(db.Model):
     #: Observed sequence, can be empty for a deletion.
     observed = db.Column(db.String(200))
 
+    #: Compact encoding of :attr:`reference` and :attr:`observed`, see
+    #: :mod:`varda.alleles`. Exact matches on the variant can use this
+    #: instead of the sequences.
+    allele_key = db.Column(db.BigInteger)
+
     #: Bin index that can be used for faster range-limited querying. See the
     #: `interval binning <https://github.com/martijnvermaat/interval-binning>`_
     #: package for more information.
@@ -823,13 +1011,21 @@ class Observation(db.Model):
                                                    cascade='all, delete-orphan',
                                                    passive_deletes=True))
 
+    #: The :class:`Sample` this observation belongs to (the same as that of
+    #: :attr:`variation`).
+    sample = db.relationship(Sample)
+
     def __init__(self, variation, chromosome, position, reference, observed,
                  zygosity=None, support=1):
+        # Set the sample first, loading it could otherwise autoflush this
+        # observation (it is added to the session via its variation).
+        self.sample = variation.sample
         self.variation = variation
         self.chromosome = chromosome
         self.position = position
         self.reference = reference
         self.observed = observed
+        self.allele_key = allele_key(reference, observed)
         # We choose the 'region' of the reference covered by an insertion to
         # be the base next to it.
         self.bin = binning.assign_bin(
@@ -875,6 +1071,11 @@ class Observation(db.Model):
 
 Index('observation_location',
       Observation.bin, Observation.chromosome, Observation.position)
+# Covering index for frequency calculations, see
+# :func:`varda.utils.observation_support`.
+Index('observation_frequency',
+      Observation.chromosome, Observation.position, Observation.allele_key,
+      Observation.sample_id, Observation.zygosity, Observation.support)
 
 
 class Region(db.Model):
@@ -926,5 +1127,184 @@ class Region(db.Model):
             % (self.chromosome, self.begin, self.end)
 
 
-Index('region_location',
-      Region.bin, Region.chromosome, Region.begin)
+# Index for covering region lookups, see :func:`varda.utils.covering_regions`.
+Index('region_span',
+      Region.chromosome, Region.begin, Region.end, Region.coverage_id)
+
+
+class Generation(db.Model):
+    """
+    Generation counter for a database table.
+
+    The counter is incremented on commit of every transaction that changed
+    the table (see :func:`update_generations`). Generations are used to
+    cheaply derive validators for HTTP conditional requests.
+    """
+    __table_args__ = {'mysql_engine': 'InnoDB', 'mysql_charset': 'utf8'}
+
+    #: Name of the table.
+    table_name = db.Column(db.String(50), primary_key=True)
+
+    #: Generation number.
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    #: Date and time (UTC) of the last change.
+    modified = db.Column(db.DateTime)
+
+    @detached_session_fix
+    def __repr__(self):
+        return '<Generation %r, value=%r>' % (self.table_name, self.value)
+
+    @classmethod
+    def current(cls, table_names):
+        """
+        Get the current generation of a set of tables.
+
+        :arg table_names: Names of the tables.
+        :type table_names: iterable(str)
+
+        :return: Tuple of the generation numbers (ordered by table name) and
+            the date and time (UTC) of the most recent change to any of the
+            tables, or `None` if any of the tables has no generation counter.
+        :rtype: tuple(tuple(int), datetime.datetime)
+        """
+        table_names = sorted(set(table_names))
+        generations = db.session.query(cls.value, cls.modified).filter(
+            cls.table_name.in_(table_names)).order_by(cls.table_name).all()
+        if not table_names or len(generations) != len(table_names):
+            return None
+        return (tuple(value for value, _ in generations),
+                max(modified for _, modified in generations))
+
+
+@event.listens_for(Generation.__table__, 'after_create')
+def create_generations(target, connection, **kwargs):
+    """
+    Create a generation counter for every table when creating the database
+    schema.
+    """
+    now = datetime.utcnow()
+    connection.execute(target.insert(),
+                       [{'table_name': table.name, 'value': 0, 'modified': now}
+                        for table in db.metadata.sorted_tables
+                        if table is not target])
+
+
+def cascading_tables(table):
+    """
+    Get the tables from which rows can be deleted by deleting rows from
+    `table`, either directly or by the database (``ON DELETE CASCADE``).
+
+    :arg table: Table to delete rows from.
+    :type table: sqlalchemy.Table
+
+    :return: Names of the tables, including `table`.
+    :rtype: set(str)
+    """
+    table_names = {table.name}
+    for other in db.metadata.sorted_tables:
+        if other.name in table_names:
+            continue
+        if any(foreign_key.ondelete == 'CASCADE' and
+               foreign_key.column.table is table
+               for foreign_key in other.foreign_keys):
+            table_names |= cascading_tables(other)
+    return table_names
+
+
+def update_generations(session, table_names):
+    """
+    Register changes to the given tables. Their generation counters are
+    incremented when the session commits (see :func:`commit_generations`).
+
+    Changes made through the ORM, including bulk updates and deletes, are
+    registered automatically. Writes with Core statements (e.g.,
+    ``session.execute(table.insert(), rows)``) are not, so they must be
+    followed by an explicit call to this function.
+    """
+    session.info.setdefault('changed_tables', set()).update(table_names)
+
+
+@event.listens_for(Session, 'before_commit')
+def commit_generations(session):
+    """
+    Increment the generation counters for all tables changed in the
+    transaction.
+
+    This is done once per commit instead of on every flush, so the rows of
+    the generation table are locked as briefly as possible. They are updated
+    in order of table name, so concurrent transactions cannot deadlock on
+    them.
+    """
+    # Changes are registered on flush, which otherwise happens after this.
+    session.flush()
+    table_names = session.info.pop('changed_tables', None)
+    if not table_names:
+        return
+    session.execute(Generation.__table__.update().where(
+        Generation.table_name == bindparam('changed_table')
+    ).values(value=Generation.value + 1, modified=datetime.utcnow()),
+        [{'changed_table': table_name}
+         for table_name in sorted(table_names)])
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_generations(session):
+    """
+    Forget about changes to tables in a transaction that was rolled back.
+    """
+    session.info.pop('changed_tables', None)
+
+
+@event.listens_for(Session, 'after_flush')
+def update_generations_after_flush(session, flush_context):
+    """
+    Register changes to all tables changed by a flush.
+
+    In this event, the session still shows the pre-flush state.
+    """
+    table_names = set()
+
+    for instance in session.new:
+        table_names.update(table.name for table
+                           in object_mapper(instance).tables)
+    for instance in session.dirty:
+        if session.is_modified(instance):
+            table_names.update(table.name for table
+                               in object_mapper(instance).tables)
+    for instance in session.deleted:
+        for table in object_mapper(instance).tables:
+            table_names |= cascading_tables(table)
+
+    # Changes in many-to-many relationships are changes in the association
+    # table.
+    for mapper in {object_mapper(instance) for instance
+                   in itertools.chain(session.new, session.dirty)}:
+        for relationship in mapper.relationships:
+            if relationship.secondary is None:
+                continue
+            if any(get_history(instance, relationship.key,
+                               passive=PASSIVE_NO_INITIALIZE).has_changes()
+                   for instance in itertools.chain(session.new, session.dirty)
+                   if object_mapper(instance) is mapper):
+                table_names.add(relationship.secondary.name)
+
+    update_generations(session, table_names)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def update_generations_after_bulk_update(update_context):
+    """
+    Register changes to a table changed by a bulk update.
+    """
+    update_generations(update_context.session,
+                       {update_context.mapper.local_table.name})
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def update_generations_after_bulk_delete(delete_context):
+    """
+    Register changes to tables changed by a bulk delete.
+    """
+    update_generations(delete_context.session,
+                       cascading_tables(delete_context.mapper.local_table))
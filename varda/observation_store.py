@@ -0,0 +1,426 @@
+"""
+Read-optimized columnar store of observations.
+
+The store is an optional secondary copy of the observation table, organised
+per chromosome in a set of column files sorted by position:
+
+- ``position``: Position of the observation.
+- ``allele``: Index of the reference and observed sequences in the list of
+  alleles for the chromosome (dictionary encoding).
+- ``sample``: Sample id of the observation (via its variation).
+- ``zygosity``: Zygosity of the observation, encoded as an index in
+  :data:`ZYGOSITIES`.
+- ``support``: Support for the observation.
+
+Column files are arrays of fixed size integers that are memory-mapped for
+reading, so looking up observations at a position is a binary search on the
+position column followed by reading a small slice of the other columns.
+
+All files of a version of the store are written in a new directory, after
+which the metadata file pointing to that directory is atomically replaced.
+Readers therefore always see a consistent version of the store. The metadata
+also records the generation of the observation table and the highest
+observation id included, so it can be checked if the store is up to date and
+it can be updated incrementally.
+
+.. note:: The column files are written in native byte order and are not
+    portable between architectures.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import array
+import bisect
+from contextlib import contextmanager
+import fcntl
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import uuid
+
+
+#: Zygosity values, indexed by their encoding in the store.
+ZYGOSITIES = (None, 'heterozygous', 'homozygous')
+
+# Column names and array typecodes.
+COLUMNS = (('position', 'i'),
+           ('allele', 'i'),
+           ('sample', 'i'),
+           ('zygosity', 'b'),
+           ('support', 'i'))
+
+
+class Column(object):
+    """
+    Read-only memory-mapped column of fixed size integers.
+
+    :arg path: Location of the column file.
+    :type path: str
+    :arg typecode: Typecode of the integers, as used by the :mod:`array`
+        module.
+    :type typecode: str
+    """
+    def __init__(self, path, typecode):
+        self.typecode = typecode
+        self._struct = struct.Struct(typecode)
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files cannot be memory-mapped.
+                self._data = ''
+        self._length = size // self._struct.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._length:
+            raise IndexError('column index out of range')
+        return self._struct.unpack_from(self._data,
+                                        index * self._struct.size)[0]
+
+    def slice(self, begin, end):
+        """
+        Get the values from `begin` up to `end` as an array.
+        """
+        values = array.array(self.typecode)
+        values.fromstring(self._data[begin * self._struct.size:
+                                     end * self._struct.size])
+        return values
+
+
+class ChromosomeObservations(object):
+    """
+    Observations on one chromosome in a version of the store.
+
+    :arg directory: Directory containing the column files.
+    :type directory: str
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        for name, typecode in COLUMNS:
+            setattr(self, name, Column(os.path.join(directory, name),
+                                       typecode))
+        with open(os.path.join(directory, 'alleles')) as f:
+            self.alleles = [tuple(allele) for allele in json.load(f)]
+        self.allele_ids = {allele: i for i, allele in enumerate(self.alleles)}
+
+    def __len__(self):
+        return len(self.position)
+
+    def range(self, begin, end):
+        """
+        Get the row numbers of observations with position in the given range.
+
+        :return: Tuple of the first row and one past the last row.
+        :rtype: (int, int)
+        """
+        return (bisect.bisect_left(self.position, begin),
+                bisect.bisect_right(self.position, end))
+
+    def rows(self):
+        """
+        Iterate over all observations.
+
+        :return: Iterator yielding tuples of position, reference, observed,
+            sample id, zygosity, and support.
+        """
+        chunk_size = 0x10000
+        for begin in range(0, len(self), chunk_size):
+            end = min(begin + chunk_size, len(self))
+            columns = [getattr(self, name).slice(begin, end)
+                       for name, _ in COLUMNS]
+            for position, allele, sample_id, zygosity, support in zip(*columns):
+                reference, observed = self.alleles[allele]
+                yield (position, reference, observed, sample_id,
+                       ZYGOSITIES[zygosity], support)
+
+
+class Snapshot(object):
+    """
+    Version of the store.
+
+    :arg directory: Directory of the store.
+    :type directory: str
+    :arg metadata: Metadata of this version.
+    :type metadata: dict
+    """
+    def __init__(self, directory, metadata):
+        self.directory = directory
+        self.metadata = metadata
+        self._chromosomes = {}
+
+    @property
+    def generation(self):
+        """
+        Generation of the observation table this version corresponds to.
+        """
+        return self.metadata['generation']
+
+    @property
+    def watermark(self):
+        """
+        Highest observation id included in this version.
+        """
+        return self.metadata['watermark']
+
+    @property
+    def rows(self):
+        """
+        Number of observations in this version.
+        """
+        return sum(entry['rows']
+                   for entry in self.metadata['chromosomes'].values())
+
+    def chromosome(self, chromosome):
+        """
+        Get the observations on a chromosome, or `None` if there are none.
+
+        :rtype: :class:`ChromosomeObservations`
+        """
+        if chromosome not in self._chromosomes:
+            entry = self.metadata['chromosomes'].get(chromosome)
+            if entry is None:
+                return None
+            self._chromosomes[chromosome] = ChromosomeObservations(
+                os.path.join(self.directory, self.metadata['version'],
+                             entry['directory']))
+        return self._chromosomes[chromosome]
+
+    def support(self, chromosome, position, reference, observed, sample_ids):
+        """
+        Get the total support per zygosity for a variant within a set of
+        samples.
+
+        :arg sample_ids: Sample ids.
+        :type sample_ids: set(int)
+
+        :return: Dictionary with total support per zygosity, for zygosities
+            with observations only.
+        :rtype: dict
+        """
+        observations = self.chromosome(chromosome)
+        if observations is None:
+            return {}
+        allele = observations.allele_ids.get((reference, observed))
+        if allele is None:
+            return {}
+
+        begin, end = observations.range(position, position)
+        support = {}
+        for allele_, sample_id, zygosity, support_ in zip(
+                observations.allele.slice(begin, end),
+                observations.sample.slice(begin, end),
+                observations.zygosity.slice(begin, end),
+                observations.support.slice(begin, end)):
+            if allele_ == allele and sample_id in sample_ids:
+                zygosity = ZYGOSITIES[zygosity]
+                support[zygosity] = support.get(zygosity, 0) + support_
+        return support
+
+    def variants(self, chromosome, begin, end, sample_ids):
+        """
+        Get the variants observed in a region within a set of samples.
+
+        :arg sample_ids: Sample ids.
+        :type sample_ids: set(int)
+
+        :return: Variants as tuples of position, reference, and observed,
+            ordered by position.
+        :rtype: list(tuple)
+        """
+        observations = self.chromosome(chromosome)
+        if observations is None:
+            return []
+
+        first, last = observations.range(begin, end)
+        variants = []
+        seen = set()
+        for position, allele, sample_id in zip(
+                observations.position.slice(first, last),
+                observations.allele.slice(first, last),
+                observations.sample.slice(first, last)):
+            if sample_id in sample_ids and (position, allele) not in seen:
+                seen.add((position, allele))
+                variants.append((position,) + observations.alleles[allele])
+        return variants
+
+
+class ObservationStore(object):
+    """
+    Read-optimized columnar store of observations.
+
+    The store is disabled until it is configured with :meth:`init`.
+    """
+    def __init__(self):
+        self.directory = None
+        self._snapshot = None
+        self._snapshot_key = None
+
+    def init(self, directory):
+        """
+        Configure the store.
+
+        :arg directory: Directory for the store, or `None` to disable it.
+        :type directory: str
+        """
+        self.directory = directory
+        self._snapshot = None
+        self._snapshot_key = None
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def snapshot(self):
+        """
+        Get the current version of the store, or `None` if there is none.
+
+        :rtype: :class:`Snapshot`
+        """
+        if not self.enabled:
+            return None
+        path = os.path.join(self.directory, 'metadata')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # The metadata file is replaced on every update, so its inode
+        # identifies the version.
+        key = stat.st_ino, stat.st_mtime
+        if key != self._snapshot_key:
+            with open(path) as f:
+                self._snapshot = Snapshot(self.directory, json.load(f))
+            self._snapshot_key = key
+        return self._snapshot
+
+    @contextmanager
+    def lock(self):
+        """
+        Context manager holding an exclusive lock on the store for updating.
+        """
+        with open(os.path.join(self.directory, 'lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def write(self, generation, watermark, observations, replace=False):
+        """
+        Write a new version of the store.
+
+        Should be called while holding the lock (see :meth:`lock`).
+
+        :arg generation: Generation of the observation table the new version
+            corresponds to.
+        :type generation: int
+        :arg watermark: Highest observation id included in the new version.
+        :type watermark: int
+        :arg observations: Dictionary with per chromosome an iterable of
+            observations as tuples of position, reference, observed, sample
+            id, zygosity, and support, ordered by position.
+        :type observations: dict
+        :arg replace: If `True`, the new version contains only the given
+            observations. Otherwise they are added to the current version.
+        :type replace: bool
+        """
+        current = None if replace else self.snapshot()
+        version = str(uuid.uuid4())
+        os.mkdir(os.path.join(self.directory, version))
+        metadata = {'version': version,
+                    'generation': generation,
+                    'watermark': watermark,
+                    'chromosomes': {}}
+
+        chromosomes = set(observations)
+        if current is not None:
+            chromosomes.update(current.metadata['chromosomes'])
+
+        for i, chromosome in enumerate(sorted(chromosomes)):
+            directory = 'c%d' % i
+            path = os.path.join(self.directory, version, directory)
+            existing = current and current.chromosome(chromosome)
+            if chromosome not in observations:
+                # Unchanged, so we can just link the existing files.
+                os.mkdir(path)
+                for name in [name for name, _ in COLUMNS] + ['alleles']:
+                    os.link(os.path.join(existing.directory, name),
+                            os.path.join(path, name))
+                rows = len(existing)
+            elif existing is not None:
+                rows = _write_chromosome(
+                    path, heapq.merge(existing.rows(),
+                                      observations[chromosome]),
+                    existing.alleles)
+            else:
+                rows = _write_chromosome(path, observations[chromosome])
+            metadata['chromosomes'][chromosome] = {'directory': directory,
+                                                   'rows': rows}
+
+        path = os.path.join(self.directory, 'metadata')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.rename(path + '.tmp', path)
+
+        # Readers having the previous version memory-mapped can still use
+        # it after removal.
+        if current is not None:
+            shutil.rmtree(os.path.join(self.directory,
+                                       current.metadata['version']),
+                          ignore_errors=True)
+        self._snapshot = None
+        self._snapshot_key = None
+
+
+def _write_chromosome(path, observations, alleles=None, chunk_size=0x10000):
+    """
+    Write observations on one chromosome to column files in a new directory.
+
+    :arg alleles: Existing list of alleles, to keep their encoding.
+    :type alleles: list(tuple)
+
+    :return: Number of observations written.
+    :rtype: int
+    """
+    os.mkdir(path)
+    alleles = list(alleles or [])
+    allele_ids = {allele: i for i, allele in enumerate(alleles)}
+    zygosity_ids = {zygosity: i for i, zygosity in enumerate(ZYGOSITIES)}
+    files = [open(os.path.join(path, name), 'wb') for name, _ in COLUMNS]
+    rows = 0
+    try:
+        columns = [array.array(typecode) for _, typecode in COLUMNS]
+        for (position, reference, observed, sample_id, zygosity,
+             support) in observations:
+            allele = allele_ids.get((reference, observed))
+            if allele is None:
+                allele = allele_ids[reference, observed] = len(alleles)
+                alleles.append((reference, observed))
+            for column, value in zip(columns, (position, allele, sample_id,
+                                               zygosity_ids[zygosity],
+                                               support)):
+                column.append(value)
+            rows += 1
+            if len(columns[0]) >= chunk_size:
+                for f, column in zip(files, columns):
+                    column.tofile(f)
+                columns = [array.array(typecode) for _, typecode in COLUMNS]
+        for f, column in zip(files, columns):
+            column.tofile(f)
+    finally:
+        for f in files:
+            f.close()
+    with open(os.path.join(path, 'alleles'), 'w') as f:
+        json.dump(alleles, f)
+    return rows
@@ -0,0 +1,218 @@
+"""
+Partitioning of the observation and region tables by chromosome.
+
+On PostgreSQL (version 11 or later), the observation and region tables can
+be list partitioned by chromosome. Every chromosome gets its own partition,
+chromosomes without a partition end up in a default partition. Since the
+partition key must be part of the primary key, this changes the primary keys
+to (id, chromosome).
+
+These functions are used both from a database migration and from the
+``varda partition`` command. Foreign keys and indexes are recreated from
+their definitions in the database at the time of (un)partitioning.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+#: Tables partitioned by chromosome.
+TABLES = ['observation', 'region']
+
+
+def is_partitioned(connection):
+    """
+    Check if the observation table is partitioned.
+
+    :arg connection: Database connection.
+
+    :rtype: bool
+    """
+    if connection.dialect.name != 'postgresql':
+        return False
+    return bool(connection.execute(
+        "SELECT count(*) FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'observation'").scalar())
+
+
+def partition(connection):
+    """
+    Partition the observation and region tables by chromosome. Every
+    chromosome in the tables gets a partition.
+
+    Converting the tables copies all data.
+
+    :arg connection: Database connection.
+
+    :raise ValueError: If the database is not PostgreSQL, the tables are
+        already partitioned, or any observation or region has no chromosome.
+
+    :return: Chromosomes that got a partition.
+    :rtype: list(str)
+    """
+    if connection.dialect.name != 'postgresql':
+        raise ValueError('Partitioning is only supported on PostgreSQL')
+    if is_partitioned(connection):
+        raise ValueError('Tables are already partitioned')
+
+    # Check this before moving any data, the new primary key would fail on
+    # these rows after copying them.
+    for table in TABLES:
+        missing = connection.execute(
+            'SELECT count(*) FROM %s WHERE chromosome IS NULL' % table).scalar()
+        if missing:
+            raise ValueError('Cannot partition table %s by chromosome: %d '
+                             'rows have no chromosome' % (table, missing))
+
+    chromosomes = [chromosome for chromosome, in connection.execute(
+        'SELECT chromosome FROM observation UNION '
+        'SELECT chromosome FROM region ORDER BY chromosome')]
+
+    for table in TABLES:
+        constraints = _reflect_constraints(connection, table)
+        connection.execute(
+            'ALTER TABLE %(table)s RENAME TO %(table)s_unpartitioned'
+            % {'table': table})
+        connection.execute(
+            'CREATE TABLE %(table)s (LIKE %(table)s_unpartitioned '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY LIST (chromosome)' % {'table': table})
+        for i, chromosome in enumerate(chromosomes):
+            _create_partition(connection, table, i, chromosome)
+        connection.execute(
+            'CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT'
+            % {'table': table})
+        _move_data(connection, table, table + '_unpartitioned')
+        connection.execute(
+            'ALTER TABLE %(table)s ADD CONSTRAINT %(table)s_pkey '
+            'PRIMARY KEY (id, chromosome)' % {'table': table})
+        _create_constraints(connection, constraints)
+
+    return chromosomes
+
+
+def add_partitions(connection):
+    """
+    Give every chromosome in the default partitions of the observation and
+    region tables its own partition.
+
+    Rows of these chromosomes are moved out of the default partitions, which
+    are detached meanwhile.
+
+    :arg connection: Database connection.
+
+    :raise ValueError: If the tables are not partitioned.
+
+    :return: Chromosomes that got a partition.
+    :rtype: list(str)
+    """
+    if not is_partitioned(connection):
+        raise ValueError('Tables are not partitioned')
+
+    chromosomes = [chromosome for chromosome, in connection.execute(
+        'SELECT chromosome FROM observation_default UNION '
+        'SELECT chromosome FROM region_default ORDER BY chromosome')]
+    if not chromosomes:
+        return []
+
+    for table in TABLES:
+        # Partitions are numbered in order of creation.
+        first = connection.execute(
+            "SELECT count(*) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = '%s'::regclass "
+            "AND c.relname != '%s_default'" % (table, table)).scalar()
+        connection.execute(
+            'ALTER TABLE %(table)s DETACH PARTITION %(table)s_default'
+            % {'table': table})
+        for i, chromosome in enumerate(chromosomes):
+            _create_partition(connection, table, first + i, chromosome)
+        connection.execute(
+            'INSERT INTO %(table)s SELECT * FROM %(table)s_default'
+            % {'table': table})
+        connection.execute('TRUNCATE %s_default' % table)
+        connection.execute(
+            'ALTER TABLE %(table)s ATTACH PARTITION %(table)s_default DEFAULT'
+            % {'table': table})
+
+    return chromosomes
+
+
+def unpartition(connection):
+    """
+    Convert the partitioned observation and region tables back to ordinary
+    tables.
+
+    :arg connection: Database connection.
+
+    :raise ValueError: If the tables are not partitioned.
+    """
+    if not is_partitioned(connection):
+        raise ValueError('Tables are not partitioned')
+
+    for table in TABLES:
+        constraints = _reflect_constraints(connection, table)
+        connection.execute(
+            'ALTER TABLE %(table)s RENAME TO %(table)s_partitioned'
+            % {'table': table})
+        connection.execute(
+            'CREATE TABLE %(table)s (LIKE %(table)s_partitioned '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % {'table': table})
+        _move_data(connection, table, table + '_partitioned')
+        connection.execute(
+            'ALTER TABLE %(table)s ALTER COLUMN chromosome DROP NOT NULL'
+            % {'table': table})
+        connection.execute(
+            'ALTER TABLE %(table)s ADD CONSTRAINT %(table)s_pkey '
+            'PRIMARY KEY (id)' % {'table': table})
+        _create_constraints(connection, constraints)
+
+
+def _create_partition(connection, table, i, chromosome):
+    connection.execute(
+        "CREATE TABLE %(table)s_%(i)d PARTITION OF %(table)s "
+        "FOR VALUES IN ('%(chromosome)s')"
+        % {'table': table, 'i': i,
+           'chromosome': chromosome.replace("'", "''")})
+
+
+def _reflect_constraints(connection, table):
+    """
+    Get the definitions of the foreign keys and indexes (other than the
+    primary key) of a table, as SQL statements.
+    """
+    statements = [
+        'ALTER TABLE %s ADD CONSTRAINT %s %s' % (table, name, definition)
+        for name, definition in connection.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = '%s'::regclass AND contype = 'f' "
+            "ORDER BY conname" % table)]
+    # Indexes on a partitioned table are defined on the table only, the
+    # partitions have their own (attached) indexes.
+    statements.extend(
+        definition.replace(' ON ONLY ', ' ON ')
+        for definition, in connection.execute(
+            "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = '%s'::regclass AND NOT i.indisprimary "
+            "ORDER BY c.relname" % table))
+    return statements
+
+
+def _move_data(connection, table, source):
+    """
+    Copy all data from `source` to `table`, move the id sequence and drop
+    `source`.
+    """
+    connection.execute('INSERT INTO %s SELECT * FROM %s' % (table, source))
+    connection.execute(
+        'ALTER SEQUENCE %(table)s_id_seq OWNED BY %(table)s.id'
+        % {'table': table})
+    connection.execute('DROP TABLE %s' % source)
+
+
+def _create_constraints(connection, constraints):
+    for statement in constraints:
+        connection.execute(statement)
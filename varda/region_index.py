@@ -0,0 +1,314 @@
+"""
+Index on genomic positions for data source files.
+
+The index is similar in spirit to a `tabix <http://www.htslib.org/doc/tabix.html>`_
+index, but simpler. For every chromosome, it stores a list of checkpoints
+(the position and virtual offset of a record) at most one per BGZF block (or
+64 kilobytes of uncompressed data), together with the maximum record length
+on that chromosome. Records in a region can then be found by seeking to the
+last checkpoint before the region minus the maximum record length and
+reading from there.
+
+The index is only built for files where the records are sorted by position
+and grouped by chromosome.
+
+For uncompressed files, virtual offsets are just file offsets.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+import bisect
+import json
+import os
+
+
+#: Maximum length of a line while building a region index. Data with longer
+#: lines is not indexed, so the memory used for a partial line is bounded.
+MAX_LINE_LENGTH = 1024 * 1024
+
+
+class RegionIndexer(object):
+    """
+    Build a region index from records and their virtual offsets.
+
+    :arg filetype: Filetype of the data, see :func:`record_location`.
+    :type filetype: str
+    """
+    def __init__(self, filetype):
+        self.filetype = filetype
+        self.sorted = True
+        self._chromosomes = {}
+        self._current = None
+        self._previous_position = None
+        self._previous_block = None
+
+    def add(self, line, offset):
+        """
+        Add a line of data, starting at the given virtual offset.
+        """
+        if not self.sorted:
+            return
+        location = record_location(self.filetype, line)
+        if location is None:
+            return
+        chromosome, begin, end = location
+
+        if chromosome != self._current:
+            if chromosome in self._chromosomes:
+                # Chromosomes are not grouped.
+                self.sorted = False
+                return
+            self._chromosomes[chromosome] = {'max_length': 0,
+                                             'checkpoints': []}
+            self._current = chromosome
+            self._previous_position = None
+            self._previous_block = None
+        elif begin < self._previous_position:
+            self.sorted = False
+            return
+
+        entry = self._chromosomes[chromosome]
+        entry['max_length'] = max(entry['max_length'], end - begin + 1)
+        if offset >> 16 != self._previous_block:
+            entry['checkpoints'].append((begin, offset))
+            self._previous_block = offset >> 16
+        self._previous_position = begin
+
+    @property
+    def index(self):
+        """
+        The index as a dictionary, or `None` if the records are not sorted.
+        """
+        if not self.sorted:
+            return None
+        return {'filetype': self.filetype, 'chromosomes': self._chromosomes}
+
+
+class IndexingWriter(object):
+    """
+    File-like object for writing data while building a region index.
+
+    Data is passed on to the writer in the chunks it is written in, split
+    only at block boundaries of the writer. Record offsets are found by
+    scanning the chunks for newlines. If a line gets longer than
+    :data:`MAX_LINE_LENGTH`, indexing is stopped and no index is written.
+
+    :arg writer: File-like object opened for writing, with a `tell` method
+        returning virtual offsets (e.g., :class:`varda.bgzf.BgzfWriter`). If
+        it has a `block_size` attribute, virtual offsets are assumed to
+        address blocks of that many uncompressed bytes.
+    :arg filetype: Filetype of the data, see :func:`record_location`.
+    :type filetype: str
+    :arg index_path: Location to write the index to when closing.
+    :type index_path: str
+    """
+    def __init__(self, writer, filetype, index_path):
+        self.writer = writer
+        self.indexer = RegionIndexer(filetype)
+        self.index_path = index_path
+        self.indexing = True
+        self._block_size = getattr(writer, 'block_size', None)
+        self._partial = []
+        self._partial_length = 0
+        self._partial_offset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        """
+        Write `data`.
+        """
+        position = 0
+        while position < len(data):
+            offset = self.writer.tell()
+            if self._block_size is None:
+                piece = data[position:] if position else data
+            else:
+                # Offsets within the piece are only valid up to the end of
+                # the current block.
+                piece = data[position:position + self._block_size -
+                             (offset & 0xffff)]
+            if self.indexing:
+                self._scan(piece, offset)
+            self.writer.write(piece)
+            position += len(piece)
+
+    def close(self):
+        """
+        Close the writer and write the index.
+        """
+        if self.writer is None:
+            return
+        if self.indexing and self._partial:
+            self.indexer.add(''.join(self._partial), self._partial_offset)
+        self.writer.close()
+        self.writer = None
+        write_index(self.indexer.index if self.indexing else None,
+                    self.index_path)
+
+    def _scan(self, data, offset):
+        """
+        Add the lines in `data`, starting at virtual offset `offset`, to the
+        index.
+        """
+        add = self.indexer.add
+        start = 0
+        if self._partial:
+            end = data.find('\n')
+            self._partial_length += (len(data) if end < 0 else end)
+            if self._partial_length > MAX_LINE_LENGTH:
+                self._stop()
+                return
+            if end < 0:
+                self._partial.append(data)
+                return
+            self._partial.append(data[:end])
+            add(''.join(self._partial), self._partial_offset)
+            self._partial = []
+            start = end + 1
+
+        while True:
+            end = data.find('\n', start)
+            if end < 0:
+                break
+            if end - start > MAX_LINE_LENGTH:
+                self._stop()
+                return
+            add(data[start:end], offset + start)
+            start = end + 1
+
+        if start < len(data):
+            if len(data) - start > MAX_LINE_LENGTH:
+                self._stop()
+                return
+            self._partial = [data[start:]]
+            self._partial_length = len(data) - start
+            self._partial_offset = offset + start
+
+    def _stop(self):
+        """
+        Stop indexing.
+        """
+        self.indexing = False
+        self._partial = []
+
+
+def record_location(filetype, line):
+    """
+    Get the genomic location of a record.
+
+    For VCF and CSV (as written by annotation tasks) files, this is the
+    location of the reference allele. For BED files, this is the region.
+
+    :arg filetype: Filetype, one of ``vcf``, ``bed``, or ``csv``.
+    :type filetype: str
+    :arg line: Line of data.
+    :type line: str
+
+    :return: Tuple of chromosome, begin, and end (one-based, inclusive) for
+        the record, or `None` if the line is not a record.
+    :rtype: (str, int, int)
+    """
+    if not line.strip() or line.startswith(('#', 'track', 'browser')):
+        return None
+    fields = line.split('\t')
+    try:
+        if filetype == 'bed':
+            if len(fields) < 3:
+                # BED files may be separated by any whitespace.
+                fields = line.split()
+            return fields[0], int(fields[1]) + 1, int(fields[2])
+        if filetype == 'vcf':
+            position = int(fields[1])
+            return fields[0], position, position + len(fields[3]) - 1
+        if filetype == 'csv':
+            position = int(fields[1])
+            return fields[0], position, position + len(fields[2]) - 1
+    except (IndexError, ValueError):
+        pass
+    return None
+
+
+def write_index(index, path):
+    """
+    Write region index to a file, or remove the file if `index` is `None`.
+    """
+    if index is None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return
+    with open(path, 'w') as f:
+        json.dump(index, f)
+
+
+def read_index(path):
+    """
+    Read region index from a file, or return `None` if there is no index.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def iter_region(data, index, chromosome, begin=None, end=None):
+    """
+    Iterate over the records overlapping a region.
+
+    :arg data: File-like object opened for reading, with `seek` and
+        `readline` methods accepting virtual offsets.
+    :arg index: Region index for `data`.
+    :type index: dict
+    :arg chromosome: Chromosome name, as used in the data.
+    :type chromosome: str
+    :arg begin: Begin of the region (one-based, inclusive), or `None` for
+        the start of the chromosome.
+    :type begin: int
+    :arg end: End of the region (one-based, inclusive), or `None` for the
+        end of the chromosome.
+    :type end: int
+
+    :return: Iterator yielding lines.
+    """
+    try:
+        entry = index['chromosomes'][chromosome]
+    except KeyError:
+        return
+    filetype = index['filetype']
+    checkpoints = entry['checkpoints']
+    if not checkpoints:
+        return
+
+    # Records starting at this position or later may overlap the region. We
+    # start reading at the last checkpoint strictly before it, since records
+    # at the same position can span several blocks.
+    first = 1 if begin is None else begin - entry['max_length'] + 1
+    positions = [position for position, _ in checkpoints]
+    i = max(0, bisect.bisect_left(positions, first) - 1)
+    data.seek(checkpoints[i][1])
+
+    while True:
+        line = data.readline()
+        if not line:
+            break
+        location = record_location(filetype, line)
+        if location is None:
+            continue
+        record_chromosome, record_begin, record_end = location
+        if record_chromosome != chromosome:
+            break
+        if end is not None and record_begin > end:
+            break
+        if begin is not None and record_end < begin:
+            continue
+        yield line
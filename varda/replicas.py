@@ -0,0 +1,190 @@
+"""
+Routing of read-only queries to database replicas.
+
+Replicas are configured with the ``SQLALCHEMY_REPLICA_URIS`` setting and
+registered as Flask-SQLAlchemy binds (named ``replica0``, ``replica1``,
+etcetera). Queries are only sent to a replica after
+:meth:`RoutingSQLAlchemy.use_replica`, everything else goes to the primary
+database.
+
+A replica is only used if it has caught up with the primary database on the
+tables read, which we check by comparing their generation counters (see
+:class:`varda.models.Generation`). Since the counters are incremented in the
+same transaction as the changes, a client reading after its own write never
+gets stale data.
+
+API resources opt in to reading from a replica for GET requests (see
+:attr:`varda.api.resources.base.Resource.replica_views`), as does annotation
+writing for its frequency calculations.
+
+.. moduleauthor:: Martijn Vermaat <martijn@vermaat.name>
+
+.. Licensed under the MIT license, see the LICENSE file.
+"""
+
+
+from contextlib import contextmanager
+import random
+
+from flask.ext.sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, select
+from sqlalchemy.sql.expression import Select
+
+
+def replica_binds(app):
+    """
+    Register the replicas configured for `app` as Flask-SQLAlchemy binds.
+
+    :arg app: Flask application instance.
+    :type app: flask.Flask
+
+    :return: Bind keys of the replicas.
+    :rtype: list(str)
+    """
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = []
+    for i, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+        key = 'replica%d' % i
+        binds[key] = uri
+        keys.append(key)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    return keys
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that can route read-only queries to a replica.
+
+    Inside a :meth:`using_replica` block, SELECT statements are executed on
+    a replica (the same one for the entire block). As soon as the session
+    writes anything, all further statements in the block go to the primary
+    database, so we always read our own writes.
+    """
+    def __init__(self, db, **options):
+        self.db = db
+
+        #: Bind key of the replica in use, or `None` for the primary.
+        self.replica = None
+
+        #: Whether the session wrote to the primary while using a replica.
+        self.wrote = False
+
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and not self.wrote:
+            if (isinstance(clause, Select) and
+                    clause._for_update_arg is None):
+                return self.db.get_engine(self.app, bind=self.replica)
+            if clause is not None:
+                # Anything but a plain SELECT may write to the database.
+                self.wrote = True
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def caught_up(self, replica, table_names):
+        """
+        Check if a replica has all changes to a set of tables that were
+        committed on the primary database.
+
+        :arg replica: Bind key of the replica.
+        :type replica: str
+        :arg table_names: Names of the tables.
+        :type table_names: iterable(str)
+
+        :rtype: bool
+        """
+        # The models module imports from this module.
+        table = self.db.metadata.tables['generation']
+        statement = select([table.c.table_name, table.c.value]).where(
+            table.c.table_name.in_(set(table_names)))
+        primary = dict(self.db.get_engine(self.app).execute(
+            statement).fetchall())
+        replica = dict(self.db.get_engine(self.app, bind=replica).execute(
+            statement).fetchall())
+        return all(replica.get(table_name, -1) >= value
+                   for table_name, value in primary.items())
+
+    def use_replica(self, table_names=None):
+        """
+        Route read-only queries to a randomly chosen replica, until
+        :meth:`use_primary` is called or the session is removed. Without
+        replicas configured, this does nothing.
+
+        :arg table_names: If given, only use the replica if it has caught up
+            with the primary database on these tables (see
+            :meth:`caught_up`).
+        :type table_names: iterable(str)
+
+        :return: Whether a replica is used.
+        :rtype: bool
+        """
+        if self.replica is not None:
+            return True
+        replicas = self.app.extensions['sqlalchemy'].replicas
+        if not replicas:
+            return False
+        replica = random.choice(replicas)
+        if table_names is not None and not self.caught_up(replica,
+                                                          table_names):
+            return False
+        self.replica = replica
+        self.wrote = False
+        return True
+
+    def use_primary(self):
+        """
+        Route all queries to the primary database.
+        """
+        self.replica = None
+        self.wrote = False
+
+    @contextmanager
+    def using_replica(self, table_names=None):
+        """
+        Context manager routing read-only queries to a replica, see
+        :meth:`use_replica`.
+        """
+        if self.replica is not None:
+            yield
+            return
+        self.use_replica(table_names)
+        try:
+            yield
+        finally:
+            self.use_primary()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def _mark_written(session_or_context, *args):
+    # The bulk events get a context object instead of the session.
+    session = getattr(session_or_context, 'session', session_or_context)
+    session.wrote = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy integration using a :class:`RoutingSession`.
+    """
+    def init_app(self, app):
+        replicas = replica_binds(app)
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.extensions['sqlalchemy'].replicas = replicas
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def use_replica(self, table_names=None):
+        """
+        Route read-only queries in the current session to a replica, see
+        :meth:`RoutingSession.use_replica`.
+        """
+        return self.session().use_replica(table_names)
+
+    def using_replica(self, table_names=None):
+        """
+        Context manager routing read-only queries in the current session to
+        a replica, see :meth:`RoutingSession.using_replica`.
+        """
+        return self.session().using_replica(table_names)
@@ -16,31 +16,54 @@ from __future__ import division
 from collections import Counter, defaultdict
 from contextlib import contextmanager
 import hashlib
+import heapq
 import itertools
 import os
+import tempfile
 import time
 import uuid
 
 import binning
 from celery import current_task, current_app, Task, states
 from celery.utils.log import get_task_logger
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, func, or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from vcf.parser import _Info as VcfInfo, field_counts as vcf_field_counts
 import vcf
 
-from . import db, celery
+from . import db, celery, observation_store
 from .models import (Annotation, Coverage, DataSource, DataUnavailable,
-                     Observation, Sample, Region, Variation)
-from .utils import (calculate_frequency, digest, NoGenotypesInRecord,
-                    normalize_variant, normalize_chromosome, normalize_region,
-                    read_genotype, ReferenceMismatch)
+                     Generation, Observation, Sample, Region, Variation)
+from .utils import (current_generations, digest, frequency_calculators,
+                    known_sample_ids, NoGenotypesInRecord,
+                    normalize_variants, normalize_chromosome,
+                    normalize_region, read_genotype, ReferenceMismatch,
+                    sample_criterion)
 
 
+# Tables read for frequency calculations.
+FREQUENCY_TABLES = ['coverage', 'group_membership', 'observation', 'region',
+                    'sample']
+
 # Number of records to buffer before committing to the database.
 DB_BUFFER_SIZE = 5000
 
+# Number of records to normalize variants for at once.
+NORMALIZE_BLOCK_SIZE = 1000
+
+# Number of regions to sort in memory when merging regions.
+REGION_SORT_BUFFER_SIZE = 1000000
+
+# Maximum length of a region, longer (merged) regions are split into pieces
+# overlapping by `REGION_OVERLAP` positions. This bounds the scan for covering
+# regions (see :func:`varda.utils.covering_regions`).
+MAX_REGION_LENGTH = 100000
+REGION_OVERLAP = 1000
+
+# Number of rows to delete per transaction when purging data.
+PURGE_BATCH_SIZE = 10000
+
 
 logger = get_task_logger(__name__)
 
@@ -79,6 +102,16 @@ class VardaTask(Task):
             # Store the result because Celery wouldn't otherwise.
             self.backend.store_result(task_id, retval, status=states.SUCCESS)
 
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        """
+        Remove the database session after every task run on a worker, so no
+        state is kept between tasks and the connection is returned to the
+        pool. Eager tasks share the session of their caller, so we leave it
+        alone.
+        """
+        if not self.request.is_eager:
+            db.session.remove()
+
 
 class CleanTask(VardaTask):
     """
@@ -202,46 +235,52 @@ def annotate_variants(original_variants, annotated_variants,
 
     writer = vcf.Writer(annotated_variants, reader, lineterminator='\n')
 
+    calculators = frequency_calculators(query.samples for query in queries)
+
     # Number of lines read (i.e. comparable to what is reported by
     # ``varda.utils.digest``).
     current_record = len(reader._header_lines) + 1
 
     old_percentage = -1
-    for record in reader:
-        current_record += 1
-        percentage = min(int(current_record / original_records * 100), 99)
-        if percentage > old_percentage:
-            # Todo: Task state updating should be defined in the task itself,
-            #     perhaps we can give values using a callback.
-            try:
-                current_task.update_state(state='PROGRESS',
-                                          meta={'percentage': percentage})
-            except AttributeError:
-                # Hack for the unit tests were whe call this not from within
-                # a task.
-                pass
-            old_percentage = percentage
+    for block in _blocks(reader, NORMALIZE_BLOCK_SIZE):
+        variants = iter(normalize_variants([(record.CHROM, record.POS,
+                                             record.REF, str(allele))
+                                            for record in block
+                                            for allele in record.ALT]))
+
+        for record in block:
+            current_record += 1
+            percentage = min(int(current_record / original_records * 100), 99)
+            if percentage > old_percentage:
+                # Todo: Task state updating should be defined in the task
+                #     itself, perhaps we can give values using a callback.
+                try:
+                    current_task.update_state(state='PROGRESS',
+                                              meta={'percentage': percentage})
+                except AttributeError:
+                    # Hack for the unit tests were whe call this not from
+                    # within a task.
+                    pass
+                old_percentage = percentage
 
-        results = [[] for _ in queries]
-        for index, allele in enumerate(record.ALT):
-            try:
-                chromosome, position, reference, observed = normalize_variant(
-                    record.CHROM, record.POS, record.REF, str(allele))
-            except ReferenceMismatch as e:
-                raise ReadError(str(e))
+            results = [[] for _ in queries]
+            for _ in record.ALT:
+                variant = next(variants)
+                if isinstance(variant, ReferenceMismatch):
+                    raise ReadError(str(variant))
+                chromosome, position, reference, observed = variant
 
-            for i, query in enumerate(queries):
-                results[i].append(calculate_frequency(chromosome, position,
-                                                      reference, observed,
-                                                      samples=query.samples))
+                for i, calculator in enumerate(calculators):
+                    results[i].append(calculator(
+                        chromosome, position, reference, observed))
 
-        for query, result in zip(queries, results):
-            record.add_info(query.name + '_VN', [vn for vn, _ in result])
-            record.add_info(query.name + '_VF', [sum(vf.values()) for _, vf in result])
-            record.add_info(query.name + '_VF_HET', [vf['heterozygous'] for _, vf in result])
-            record.add_info(query.name + '_VF_HOM', [vf['homozygous'] for _, vf in result])
+            for query, result in zip(queries, results):
+                record.add_info(query.name + '_VN', [vn for vn, _ in result])
+                record.add_info(query.name + '_VF', [sum(vf.values()) for _, vf in result])
+                record.add_info(query.name + '_VF_HET', [vf['heterozygous'] for _, vf in result])
+                record.add_info(query.name + '_VF_HOM', [vf['homozygous'] for _, vf in result])
 
-        writer.write_record(record)
+            writer.write_record(record)
 
 
 def annotate_regions(original_regions, annotated_variants,
@@ -339,6 +378,11 @@ def annotate_regions(original_regions, annotated_variants,
 
     annotated_variants.write('#' + '\t'.join(header_fields) + '\n')
 
+    generations = current_generations()
+    calculators = frequency_calculators(
+        (query.samples for query in queries), generations)
+    known_ids = known_sample_ids(generations)
+
     old_percentage = -1
     for current_record, chromosome, begin, end in read_regions(original_regions):
         percentage = min(int(current_record / original_records * 100), 99)
@@ -363,8 +407,9 @@ def annotate_regions(original_regions, annotated_variants,
             Observation.position >= begin,
             Observation.position <= end,
             Observation.bin.in_(bins)
-        ).join(Variation).join(Sample).filter(
-            Sample.id.in_(all_sample_ids)
+        ).filter(
+            sample_criterion(Observation.sample_id, all_sample_ids,
+                             all_ids=known_ids)
         ).distinct(
             Observation.chromosome,
             Observation.position,
@@ -382,12 +427,11 @@ def annotate_regions(original_regions, annotated_variants,
             fields = [observation.chromosome, observation.position,
                       observation.reference, observation.observed]
 
-            for query in enumerate(queries):
-                vn, vf = calculate_frequency(observation.chromosome,
-                                             observation.position,
-                                             observation.reference,
-                                             observation.observed,
-                                             samples=query.samples)
+            for calculator in calculators:
+                vn, vf = calculator(observation.chromosome,
+                                    observation.position,
+                                    observation.reference,
+                                    observation.observed)
                 fields.extend([vn, sum(vf.values()), vf['heterozygous'],
                                vf['homozygous']])
 
@@ -437,6 +481,9 @@ def read_observations(observations, filetype='vcf', skip_filtered=True,
     # ``varda.utils.digest``).
     current_record = len(reader._header_lines) + 1
 
+    # Records are buffered so we can normalize their variants in blocks.
+    block = []
+
     for record in reader:
         current_record += 1
 
@@ -526,15 +573,49 @@ def read_observations(observations, filetype='vcf', skip_filtered=True,
             else:
                 alt_support = [{None: len(record.samples)}]
 
-        for index, allele in enumerate(record.ALT):
-            try:
-                chromosome, position, reference, observed = normalize_variant(
-                    record.CHROM, record.POS, record.REF, str(allele))
-            except ReferenceMismatch as e:
-                logger.info('Reference mismatch: %s', str(e))
+        block.append((current_record, record, alt_support))
+        if len(block) >= NORMALIZE_BLOCK_SIZE:
+            for observation in _normalize_observations(block):
+                yield observation
+            block = []
+
+    for observation in _normalize_observations(block):
+        yield observation
+
+
+def _blocks(iterable, size):
+    """
+    Split an iterable into lists of `size` items (the last list may be
+    shorter).
+    """
+    iterator = iter(iterable)
+    while True:
+        block = list(itertools.islice(iterator, size))
+        if not block:
+            return
+        yield block
+
+
+def _normalize_observations(block):
+    """
+    Normalize variants for a block of records read by
+    :func:`read_observations` and yield the resulting observations.
+    """
+    variants = normalize_variants([(record.CHROM, record.POS, record.REF,
+                                    str(allele))
+                                   for _, record, _ in block
+                                   for allele in record.ALT])
+    variants = iter(variants)
+
+    for current_record, record, alt_support in block:
+        for index in range(len(record.ALT)):
+            variant = next(variants)
+            if isinstance(variant, ReferenceMismatch):
+                logger.info('Reference mismatch: %s', str(variant))
                 if current_app.conf['REFERENCE_MISMATCH_ABORT']:
-                    raise ReadError(str(e))
+                    raise ReadError(str(variant))
                 continue
+            chromosome, position, reference, observed = variant
 
             # Todo: Ignore or abort?
             if len(reference) > 200 or len(observed) > 200:
@@ -568,6 +649,127 @@ def read_regions(regions, filetype='bed'):
         yield current_record, chromosome, begin + 1, end
 
 
+def merge_regions(regions, buffer_size=REGION_SORT_BUFFER_SIZE):
+    """
+    Merge overlapping and adjacent regions.
+
+    Regions are sorted in chunks of `buffer_size`. If there is more than one
+    chunk, the chunks are written to temporary files and merged from there,
+    so memory usage is bounded also for huge BED files.
+
+    :arg regions: Regions as tuples of chromosome, begin, and end (one-based
+        and inclusive).
+    :type regions: iterable(tuple)
+    :arg buffer_size: Maximum number of regions to sort in memory.
+    :type buffer_size: int
+
+    :return: Iterator yielding disjoint regions as tuples of chromosome,
+        begin, and end, ordered by chromosome and begin.
+    """
+    current = None
+    for chromosome, begin, end in _sort_regions(regions, buffer_size):
+        if (current is not None and chromosome == current[0] and
+            begin <= current[2] + 1):
+            current[2] = max(current[2], end)
+            continue
+        if current is not None:
+            yield tuple(current)
+        current = [chromosome, begin, end]
+    if current is not None:
+        yield tuple(current)
+
+
+def split_regions(regions, max_length=MAX_REGION_LENGTH,
+                  overlap=REGION_OVERLAP):
+    """
+    Split regions longer than `max_length` into pieces of at most that
+    length.
+
+    Consecutive pieces overlap by `overlap` positions, so every range of at
+    most `overlap` positions within a region is contained in (one or two of)
+    its pieces.
+
+    :arg regions: Regions as tuples of chromosome, begin, and end (one-based
+        and inclusive).
+    :type regions: iterable(tuple)
+    :arg max_length: Maximum length of a region.
+    :type max_length: int
+    :arg overlap: Number of positions consecutive pieces overlap, must be
+        smaller than `max_length`.
+    :type overlap: int
+
+    :return: Iterator yielding regions as tuples of chromosome, begin, and
+        end.
+    """
+    for chromosome, begin, end in regions:
+        while end - begin >= max_length:
+            yield chromosome, begin, begin + max_length - 1
+            begin += max_length - overlap
+        yield chromosome, begin, end
+
+
+def _sort_regions(regions, buffer_size):
+    """
+    Sort regions using temporary files if they don't fit in `buffer_size`.
+    """
+    regions = iter(regions)
+    chunks = []
+    try:
+        while True:
+            chunk = sorted(itertools.islice(regions, buffer_size))
+            if not chunks and len(chunk) < buffer_size:
+                for region in chunk:
+                    yield region
+                return
+            if not chunk:
+                break
+            f = tempfile.TemporaryFile()
+            for region in chunk:
+                f.write('%s\t%d\t%d\n' % region)
+            f.seek(0)
+            chunks.append(f)
+
+        for region in heapq.merge(*[_read_sorted_regions(f) for f in chunks]):
+            yield region
+    finally:
+        for f in chunks:
+            f.close()
+
+
+def _read_sorted_regions(f):
+    for line in f:
+        chromosome, begin, end = line.rstrip('\n').split('\t')
+        yield chromosome, int(begin), int(end)
+
+
+def delete_in_batches(model, criterion, batch_size=PURGE_BATCH_SIZE):
+    """
+    Delete rows in batches of primary keys, committing after each batch.
+
+    This keeps transactions short, so deleting many rows does not lock out
+    other writers for a long time.
+
+    :arg model: Model to delete rows of.
+    :arg criterion: Criterion selecting the rows to delete.
+    :arg batch_size: Maximum number of rows to delete per transaction.
+    :type batch_size: int
+
+    :return: Iterator yielding the number of rows deleted per batch.
+    """
+    last_id = 0
+    while True:
+        ids = [id_ for id_, in db.session.query(model.id).filter(
+            criterion, model.id > last_id
+        ).order_by(model.id).limit(batch_size)]
+        if not ids:
+            break
+        model.query.filter(model.id.in_(ids)).delete(
+            synchronize_session=False)
+        db.session.commit()
+        last_id = ids[-1]
+        yield len(ids)
+
+
 @celery.task(base=CleanTask)
 def import_variation(variation_id):
     """
@@ -613,8 +815,9 @@ def import_variation(variation_id):
                         'Identical data source already imported')
 
     def delete_observations():
-        variation.observations.delete()
-        db.session.commit()
+        for _ in delete_in_batches(Observation,
+                                   Observation.variation_id == variation.id):
+            pass
     current_task.register_cleanup(current_task.request.id,
                                   delete_observations)
 
@@ -680,10 +883,15 @@ def import_variation(variation_id):
     except ReadError as e:
         raise TaskError('invalid_observations', str(e))
 
+    db.session.commit()
+
     current_task.update_state(state='PROGRESS', meta={'percentage': 100})
     variation.task_done = True
     db.session.commit()
 
+    if observation_store.enabled:
+        update_observation_store.delay()
+
     logger.info('Finished task: import_variation(%d)', variation_id)
 
 
@@ -726,8 +934,8 @@ def import_coverage(coverage_id):
                         'Identical data source already imported')
 
     def delete_regions():
-        coverage.regions.delete()
-        db.session.commit()
+        for _ in delete_in_batches(Region, Region.coverage_id == coverage.id):
+            pass
     current_task.register_cleanup(current_task.request.id, delete_regions)
 
     # In case we are retrying after a failed import, delete any existing
@@ -739,17 +947,31 @@ def import_coverage(coverage_id):
     except DataUnavailable as e:
         raise TaskError(e.code, e.message)
 
+    # Progress is reported as the first half of the percentage while reading
+    # (and sorting) the regions, and the second half while writing them.
+    progress = {'percentage': -1}
+
+    def report(fraction, offset):
+        percentage = offset + min(int(fraction * 50), 49)
+        if percentage > progress['percentage']:
+            current_task.update_state(state='PROGRESS',
+                                      meta={'percentage': percentage})
+            progress['percentage'] = percentage
+
+    def read(regions):
+        for record, chromosome, begin, end \
+                in read_regions(regions, filetype=data_source.filetype):
+            report(record / data_source.records, 0)
+            yield chromosome, begin, end
+
     try:
         with data as regions:
-            old_percentage = -1
-            for i, (record, chromosome, begin, end) \
-                    in enumerate(read_regions(regions,
-                                              filetype=data_source.filetype)):
-                percentage = min(int(record / data_source.records * 100), 99)
-                if percentage > old_percentage:
-                    current_task.update_state(state='PROGRESS',
-                                              meta={'percentage': percentage})
-                    old_percentage = percentage
+            # Overlapping and adjacent regions would otherwise be counted
+            # twice in calculating coverage. Long merged regions are split
+            # again, they would widen every lookup of covering regions.
+            for i, (chromosome, begin, end) in enumerate(
+                    split_regions(merge_regions(read(regions)))):
+                report(i / data_source.records, 50)
                 db.session.add(Region(coverage, chromosome, begin, end))
                 if i % DB_BUFFER_SIZE == DB_BUFFER_SIZE - 1:
                     db.session.flush()
@@ -764,6 +986,28 @@ def import_coverage(coverage_id):
     logger.info('Finished task: import_coverage(%d)', coverage_id)
 
 
+@celery.task(base=VardaTask)
+def digest_data_source(data_source_id):
+    """
+    Calculate the digest and region index of a data source referencing a
+    local file (see :class:`varda.models.DataSource`).
+
+    :arg data_source_id: Data source to digest.
+    :type data_source_id: int
+    """
+    logger.info('Started task: digest_data_source(%d)', data_source_id)
+
+    data_source = DataSource.query.get(data_source_id)
+    if data_source is None:
+        raise TaskError('data_source_not_found', 'Data source not found')
+
+    data_source.digest_data()
+    data_source.index_data()
+    db.session.commit()
+
+    logger.info('Finished task: digest_data_source(%d)', data_source_id)
+
+
 @celery.task(base=VardaTask)
 def write_annotation(annotation_id):
     """
@@ -800,24 +1044,35 @@ def write_annotation(annotation_id):
              original_data_source.records) = digest(data)
         db.session.commit()
 
+    # The checksum of the annotated data is used as ETag when it is
+    # downloaded, so we invalidate it while (re)writing.
+    annotated_data_source.checksum = annotated_data_source.records = None
+    db.session.commit()
+
     try:
         original_data = original_data_source.data()
         annotated_data = annotated_data_source.data_writer()
     except DataUnavailable as e:
         raise TaskError(e.code, e.message)
 
+    # The frequency calculations only read from the database, so they can be
+    # done on a replica if it has all imported samples.
+    queries = annotation.queries
     try:
         with original_data as original, \
-                annotated_data as annotated_variants:
+                annotated_data as annotated_variants, \
+                db.using_replica(FREQUENCY_TABLES):
             annotate_data_source(original, annotated_variants,
                                  original_filetype=original_data_source.filetype,
                                  annotated_filetype=annotated_data_source.filetype,
-                                 queries=annotation.queries,
+                                 queries=queries,
                                  original_records=original_data_source.records)
     except ReadError as e:
         annotated_data_source.empty()
         raise TaskError('invalid_data_source', str(e))
 
+    annotated_data_source.digest_data()
+
     current_task.update_state(state='PROGRESS', meta={'percentage': 100})
     annotation.task_done = True
     db.session.commit()
@@ -825,6 +1080,193 @@ def write_annotation(annotation_id):
     logger.info('Finished task: write_annotation(%d)', annotation_id)
 
 
+@celery.task(base=VardaTask)
+def update_observation_store():
+    """
+    Bring the observation store up to date with the observation table.
+
+    New observations are added incrementally. If observations were deleted
+    (or committed out of order), which we detect by comparing the number of
+    observations already included, the store is rebuilt from scratch.
+    """
+    logger.info('Started task: update_observation_store')
+
+    if not observation_store.enabled:
+        logger.info('Finished task: update_observation_store')
+        return
+
+    with observation_store.lock():
+        snapshot = observation_store.snapshot()
+
+        # We read the generation before the observations, so at worst we
+        # include more observations than it reflects, making the store look
+        # outdated until the next update.
+        generation = Generation.current(['observation'])
+        if generation is None:
+            raise TaskError('generation_not_found',
+                            'No generation counter for observations')
+        generation = generation[0][0]
+        if snapshot is not None and snapshot.generation == generation:
+            logger.info('Finished task: update_observation_store')
+            return
+
+        watermark = db.session.query(func.max(Observation.id)).scalar() or 0
+
+        observations = db.session.query(
+            Observation.chromosome,
+            Observation.position,
+            Observation.reference,
+            Observation.observed,
+            Observation.sample_id,
+            Observation.zygosity,
+            Observation.support
+        ).filter(Observation.id <= watermark)
+
+        incremental = (
+            snapshot is not None and
+            Observation.query.filter(
+                Observation.id <= snapshot.watermark).count() == snapshot.rows)
+        if incremental:
+            observations = observations.filter(
+                Observation.id > snapshot.watermark)
+
+        # Observations are streamed per chromosome, so memory use does not
+        # depend on the number of (new) observations.
+        chromosomes = [chromosome for chromosome, in observations.with_entities(
+            Observation.chromosome).distinct()]
+        observation_store.write(
+            generation, watermark,
+            {chromosome: _observation_rows(observations.filter(
+                Observation.chromosome == chromosome
+            ).order_by(Observation.position))
+             for chromosome in chromosomes},
+            replace=not incremental)
+
+    logger.info('Finished task: update_observation_store')
+
+
+def _observation_rows(observations):
+    """
+    Iterate over observations from a query in batches, yielding tuples for
+    the observation store (without chromosome).
+    """
+    for observation in observations.yield_per(DB_BUFFER_SIZE):
+        yield tuple(observation[1:])
+
+
+@celery.task(base=VardaTask)
+def purge_sample(sample_id):
+    """
+    Delete a sample including its observations and regions.
+
+    The observations and regions are deleted in batches (see
+    :func:`delete_in_batches`), after which deleting the sample itself only
+    has to cascade to its (now empty) variations and coverages. Their data
+    sources are deleted too, unless they are used otherwise.
+    """
+    logger.info('Started task: purge_sample(%d)', sample_id)
+
+    current_task.update_state(state='PROGRESS', meta={'percentage': 0})
+
+    sample = Sample.query.get(sample_id)
+    if sample is None:
+        raise TaskError('sample_not_found', 'Sample not found')
+
+    if (not current_task.request.is_eager and sample.purge_task_uuid
+            and sample.purge_task_uuid != current_task.request.id):
+        raise TaskError('sample_purging', 'Sample is being purged by '
+                        'another task instance')
+
+    coverage_ids = [coverage.id for coverage in sample.coverages]
+    data_source_ids = {item.data_source_id for items in
+                       (sample.variations, sample.coverages)
+                       for item in items}
+    purges = [(Observation, Observation.sample_id == sample_id)]
+    if coverage_ids:
+        purges.append((Region, Region.coverage_id.in_(coverage_ids)))
+
+    total = sum(model.query.filter(criterion).count()
+                for model, criterion in purges)
+    deleted = 0
+    started = time.time()
+
+    for model, criterion in purges:
+        for count in delete_in_batches(model, criterion):
+            deleted += count
+            elapsed = time.time() - started
+            current_task.update_state(state='PROGRESS', meta={
+                'percentage': min(int(deleted / total * 100), 99),
+                'rows_per_second': int(deleted / elapsed) if elapsed else None
+            })
+
+    current_task.update_state(state='PROGRESS', meta={'percentage': 100})
+    db.session.delete(sample)
+    db.session.flush()
+    for data_source in DataSource.query.filter(
+            DataSource.id.in_(data_source_ids)):
+        if not (data_source.variations.count() or
+                data_source.coverages.count() or
+                data_source.annotations.count() or data_source.annotation):
+            db.session.delete(data_source)
+    db.session.commit()
+
+    elapsed = time.time() - started
+    logger.info('Purged %d rows in %.1f seconds (%.0f rows per second)',
+                deleted, elapsed, deleted / elapsed if elapsed else 0)
+
+    if deleted and observation_store.enabled:
+        update_observation_store.delay()
+
+    logger.info('Finished task: purge_sample(%d)', sample_id)
+
+
+def queue_purge(sample):
+    """
+    Queue :func:`purge_sample` for a deleted sample.
+
+    The task id is stored with the sample before the task is queued, so the
+    task can check it is the only one purging the sample.
+
+    :arg sample: Deleted sample.
+    :type sample: varda.models.Sample
+
+    :return: Task id.
+    :rtype: str
+    """
+    sample_id = sample.id
+    task_id = str(uuid.uuid4())
+    sample.purge_task_uuid = task_id
+    db.session.commit()
+    purge_sample.apply_async((sample_id,), task_id=task_id)
+    return task_id
+
+
+@celery.task(base=VardaTask)
+def purge_deleted_samples():
+    """
+    Queue :func:`purge_sample` for every sample that is deleted but not yet
+    purged, e.g., because its purge task failed.
+
+    Samples with a purge task that is still queued or running are skipped.
+
+    This is run on worker startup (see :mod:`varda.worker`), but could also
+    be scheduled periodically.
+    """
+    logger.info('Started task: purge_deleted_samples')
+
+    for sample in Sample.query.filter(Sample.deleted).all():
+        if sample.purge_task_uuid:
+            result = purge_sample.AsyncResult(sample.purge_task_uuid)
+            if result.state in ('PENDING', 'RECEIVED', 'STARTED', 'PROGRESS',
+                                'RETRY'):
+                continue
+        sample_id = sample.id
+        task_id = queue_purge(sample)
+        logger.info('Called task: purge_sample(%d) %s', sample_id, task_id)
+
+    logger.info('Finished task: purge_deleted_samples')
+
+
 @celery.task(base=VardaTask)
 def ping():
     """
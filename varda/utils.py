@@ -12,15 +12,20 @@ Various utilities for Varda.
 from __future__ import division
 
 import collections
+import functools
 import hashlib
 import itertools
 
-import binning
-from flask import current_app
-from sqlalchemy.sql import func
+from sqlalchemy import event
+from sqlalchemy.sql import (and_, bindparam, distinct, false, func, select,
+                            true)
+from sqlalchemy.util import LRUCache
 
-from . import db, genome
-from .models import Coverage, DataSource, Observation, Region, Sample, Variation
+from . import (checksums, chromosome_names, db, expressions, genome,
+               observation_store)
+from .alleles import allele_key, is_packed
+from .models import (Coverage, DataSource, Generation, group_membership,
+                     Observation, Region, Sample)
 
 
 class ReferenceMismatch(Exception):
@@ -38,28 +43,17 @@ class NoGenotypesInRecord(Exception):
     pass
 
 
-def digest(data):
+def digest(data, hash_function=hashlib.sha1):
     """
     Given a file-like object opened for reading, calculate a digest as SHA1
-    checksum and number of records.
+    checksum (or using another hash function) and number of records.
 
     Calculating the number of records is done in a naive way by counting the
     number of lines in the file, and as such includes empty and header lines.
-    """
-    def read_chunks(data, chunksize=0xf00000):
-        # Default chunksize is 16 megabytes.
-        while True:
-            chunk = data.read(chunksize)
-            if not chunk:
-                break
-            yield chunk
 
-    sha1 = hashlib.sha1()
-    records = 0
-    for chunk in read_chunks(data):
-        sha1.update(chunk)
-        records += chunk.count('\n')
-    return sha1.hexdigest(), records
+    See :mod:`varda.checksums`.
+    """
+    return checksums.digest(data, hash_function)
 
 
 def chromosome_compare_key(chromosome):
@@ -82,29 +76,16 @@ def chromosome_compare_key(chromosome):
 def normalize_chromosome(chromosome):
     """
     Try to get normalized chromosome name by reference lookup.
-    """
-    if chromosome.startswith('chr'):
-        chromosome = chromosome[3:]
-
-    if not genome:
-        for aliases in current_app.config['CHROMOSOME_ALIASES']:
-            if chromosome in aliases or 'chr' + chromosome in aliases:
-                return aliases[0]
-        return chromosome
 
-    if chromosome in genome:
-        return chromosome
-    elif 'chr' + chromosome in genome:
-        return 'chr' + chromosome
-
-    for aliases in current_app.config['CHROMOSOME_ALIASES']:
-        if chromosome in aliases or 'chr' + chromosome in aliases:
-            for alias in aliases:
-                if alias in genome:
-                    return alias
-
-    raise ReferenceMismatch('Chromosome "%s" not in reference genome' %
-                            chromosome)
+    See :class:`varda.chromosomes.ChromosomeNames`.
+    """
+    normalized = chromosome_names.normalize(chromosome)
+    if normalized is None:
+        if chromosome.startswith('chr'):
+            chromosome = chromosome[3:]
+        raise ReferenceMismatch('Chromosome "%s" not in reference genome' %
+                                chromosome)
+    return normalized
 
 
 def normalize_region(chromosome, begin, end):
@@ -152,18 +133,95 @@ def normalize_variant(chromosome, position, reference, observed):
         `position`, `reference`, `observed`.
     :rtype: (str, int, str, str)
     """
+    chromosome = normalize_chromosome(chromosome)
+    context = genome[chromosome] if genome else None
+    return _normalize_variant(chromosome, position, reference, observed,
+                              context)
+
+
+def normalize_variants(variants, max_gap=1000, flank=100):
+    """
+    Use reference to create normalized representations of a batch of
+    variants.
+
+    This gives the same results as calling :func:`normalize_variant` on each
+    variant, but reads the reference genome in windows around clusters of
+    nearby variants. Variants on the same chromosome are clustered if they
+    are at most `max_gap` positions apart.
+
+    :arg variants: Variants as tuples of `chromosome`, `position`,
+        `reference`, `observed` (see :func:`normalize_variant`).
+    :type variants: list(tuple(str, int, str, str))
+    :arg max_gap: Maximum distance between variants in a cluster.
+    :type max_gap: int
+    :arg flank: Number of positions to add on both sides of a window.
+    :type flank: int
+
+    :return: For each variant (in the original order), the normalized
+        variant representation as a tuple of `chromosome`, `position`,
+        `reference`, `observed`, or a :class:`ReferenceMismatch` instance
+        if the variant could not be normalized.
+    :rtype: list
+    """
+    results = [None] * len(variants)
+
+    located = []
+    for i, (chromosome, position, reference, observed) in enumerate(variants):
+        try:
+            chromosome = normalize_chromosome(chromosome)
+        except ReferenceMismatch as e:
+            results[i] = e
+            continue
+        located.append((chromosome, position, position + len(reference), i))
+    located.sort()
+
+    def normalize_cluster(cluster):
+        chromosome = cluster[0][0]
+        context = None
+        if genome:
+            context = ReferenceWindow(
+                genome[chromosome],
+                max(0, cluster[0][1] - 1 - flank),
+                max(end for _, _, end, _ in cluster) - 1 + flank)
+        for _, _, _, i in cluster:
+            _, position, reference, observed = variants[i]
+            try:
+                results[i] = _normalize_variant(chromosome, position,
+                                                reference, observed, context)
+            except ReferenceMismatch as e:
+                results[i] = e
+
+    cluster = []
+    for variant in located:
+        if cluster and (variant[0] != cluster[0][0] or
+                        variant[1] > cluster_end + max_gap):
+            normalize_cluster(cluster)
+            cluster = []
+        if not cluster:
+            cluster_end = variant[2]
+        cluster.append(variant)
+        cluster_end = max(cluster_end, variant[2])
+    if cluster:
+        normalize_cluster(cluster)
+
+    return results
+
+
+def _normalize_variant(chromosome, position, reference, observed, context):
+    """
+    Normalize variant on a normalized chromosome name, given the chromosome
+    sequence as `context` (`None` if there is no reference genome).
+    """
     reference = reference.upper()
     observed = observed.upper()
 
-    chromosome = normalize_chromosome(chromosome)
-
-    if genome:
-        if position > len(genome[chromosome]):
+    if context is not None:
+        if position > len(context):
             raise ReferenceMismatch('Position %d does not exist on chromosome'
                                     ' "%s" in reference genome' %
                                     (position, chromosome))
-        if (genome[chromosome][position - 1
-                               :position + len(reference) - 1].upper() !=
+        if (context[position - 1
+                    :position + len(reference) - 1].upper() !=
             reference):
             raise ReferenceMismatch('Sequence "%s" does not match reference'
                                     ' genome on "%s" at position %d' %
@@ -175,21 +233,56 @@ def normalize_variant(chromosome, position, reference, observed):
     # Todo: If reference == observed == '', there is no variant. Probably
     #     raise an exception in that case.
 
-    if not genome:
+    if context is None:
         return chromosome, position, reference, observed
 
     # Insertions and deletions can be moved to the left by looking for cyclic
     # permutations.
     if reference == '':
-        position, observed = move_left(genome[chromosome], position, observed)
+        position, observed = move_left(context, position, observed)
         observed = observed.upper()
     elif observed == '':
-        position, reference = move_left(genome[chromosome], position, reference)
+        position, reference = move_left(context, position, reference)
         reference = reference.upper()
 
     return chromosome, position, reference, observed
 
 
+class ReferenceWindow(object):
+    """
+    Window on a chromosome sequence that is kept in memory.
+
+    Subscripting works as on the chromosome sequence itself (zero-based
+    coordinates). Lookups outside the window are delegated to the chromosome
+    sequence, so left-shifting an indel in a repeat extending beyond the
+    window still gives the correct result.
+
+    :arg sequence: Chromosome sequence.
+    :type sequence: pyfaidx.FastaRecord
+    :arg start: Start of the window, zero-based.
+    :type start: int
+    :arg end: End of the window, zero-based, exclusive.
+    :type end: int
+    """
+    def __init__(self, sequence, start, end):
+        self.sequence = sequence
+        self.start = start
+        self.window = sequence[start:end]
+        self.end = start + len(self.window)
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            start, stop, step = n.indices(len(self.sequence))
+            if step == 1 and self.start <= start and stop <= self.end:
+                return self.window[start - self.start:stop - self.start]
+        elif self.start <= n < self.end:
+            return self.window[n - self.start]
+        return self.sequence[n]
+
+
 def trim_common(s1, s2):
     """
     Trim two sequences by removing the longest common prefix and suffix. Also
@@ -266,16 +359,37 @@ def move_left(context, position, sequence):
         permutation of `sequence` and its position in `context`.
     :rtype: (str, int)
     """
-    def lookup(p):
-        if position <= p < position + len(sequence):
-            return sequence[p - position].upper()
-        return context[p - 1].upper()
+    # Moving `sequence` to the left by one position is possible if the base
+    # left of it equals its last base. Repeating this, we can move it by `m`
+    # positions if the `m` bases left of it match the periodic extension of
+    # `sequence` to the left. Instead of comparing base by base, we compare
+    # blocks of context to this extension, doubling the block size every
+    # time a block matches completely (long repeats are not uncommon).
+    if not sequence:
+        return min(position, 1), sequence
+
+    length = len(sequence)
+    upper_sequence = sequence.upper()
+    block_size = max(length, 32)
 
     move = 0
-    while (position - move > 1 and
-           lookup(position - move - 1) ==
-           lookup(position + len(sequence) - move - 1)):
-        move += 1
+    while position - move > 1:
+        # Context block left of the current window (zero-based, half-open).
+        end = position - move - 1
+        start = max(0, end - block_size)
+        block = context[start:end].upper()
+
+        # Periodic extension of `sequence`, aligned to the block end.
+        rotation = (start + 1 - position) % length
+        expected = (upper_sequence[rotation:] + upper_sequence[:rotation]) * (
+            (end - start) // length + 1)
+        expected = expected[:end - start]
+
+        matched = _common_suffix_length(block, expected)
+        move += matched
+        if matched < end - start:
+            break
+        block_size *= 2
 
     if not move:
         # Note: This case is only needed because the general case fails for
@@ -288,6 +402,25 @@ def move_left(context, position, sequence):
             + sequence[:-move])
 
 
+def _common_suffix_length(s1, s2):
+    """
+    Length of the longest common suffix of two sequences of equal length.
+
+    We do a binary search on suffix equality, which has the string comparison
+    done in C instead of comparing character by character.
+    """
+    if s1 == s2:
+        return len(s1)
+    lower, upper = 0, len(s1) - 1
+    while lower < upper:
+        middle = (lower + upper + 1) // 2
+        if s1[-middle:] == s2[-middle:]:
+            lower = middle
+        else:
+            upper = middle - 1
+    return lower
+
+
 def read_genotype(call, prefer_likelihoods=False):
     """
     Read genotype from a call, either using GT or deducing it from GL or PL.
@@ -339,11 +472,565 @@ def read_genotype(call, prefer_likelihoods=False):
         return [int(a) for a in call.gt_alleles]
 
 
+def current_generations():
+    """
+    Get the current generation of every table.
+
+    Functions that query several generation cached values (see
+    :func:`generation_cached`) for a batch of work can read the generations
+    once with this function and pass them in, instead of querying a
+    generation for every value.
+
+    A generation is identified by its number and the date and time of the
+    change. Generation numbers start at 0 in every new database, so the
+    number alone would not distinguish a recreated database.
+
+    :return: Dictionary with for every table name a tuple of its generation
+        number and the date and time (UTC) of the last change.
+    :rtype: dict(str, tuple(int, datetime.datetime))
+    """
+    return {table_name: (value, modified) for table_name, value, modified
+            in db.session.query(Generation.table_name, Generation.value,
+                                Generation.modified)}
+
+
+def current_observations(generations=None):
+    """
+    Get the current version of the observation store if it is up to date with
+    the observation table.
+
+    :arg generations: Generations by table name (see
+        :func:`current_generations`), queried if not given.
+    :type generations: dict(str, tuple)
+
+    :return: Observation store version, or `None` if the store is disabled or
+        not up to date.
+    :rtype: :class:`varda.observation_store.Snapshot`
+    """
+    snapshot = observation_store.snapshot()
+    if snapshot is None:
+        return None
+    if generations is None:
+        generations = current_generations()
+    if generations.get('observation', (None, None))[0] != snapshot.generation:
+        return None
+    return snapshot
+
+
+#: Caches of the functions decorated with :func:`generation_cached`.
+_generation_caches = []
+
+
+def generation_cached(table_name):
+    """
+    Decorator caching the result of a function without arguments for the
+    current generation of a table.
+
+    The cache is per process, the generation counter makes sure it is
+    refreshed after any change to the table. The decorated function accepts
+    the generations by table name (see :func:`current_generations`) as an
+    optional argument, otherwise the generation is queried.
+
+    :arg table_name: Name of the table.
+    :type table_name: str
+    """
+    def decorator(f):
+        # Generation and result, replaced as a whole.
+        cache = [(None, None)]
+        _generation_caches.append(cache)
+
+        @functools.wraps(f)
+        def cached_f(generations=None):
+            generation, result = cache[0]
+            if generations is None:
+                generations = current_generations()
+            current = generations.get(table_name)
+            if current is None or current != generation:
+                result = f()
+                if current is not None:
+                    cache[0] = current, result
+            return result
+
+        return cached_f
+    return decorator
+
+
+def clear_generation_caches():
+    """
+    Empty the caches of all functions decorated with
+    :func:`generation_cached`.
+
+    This is done when creating an application and when creating the database
+    schema. A database recreated within the timestamp resolution of the
+    database server would otherwise have the same generations as the one the
+    cached values were read from.
+    """
+    for cache in _generation_caches:
+        cache[0] = None, None
+    _frequency_statements.clear()
+
+
+@event.listens_for(Generation.__table__, 'after_create')
+def _clear_generation_caches(target, connection, **kwargs):
+    clear_generation_caches()
+
+
+@generation_cached('region')
+def region_spans():
+    """
+    Get the longest region (as end minus begin) per chromosome.
+
+    :rtype: dict
+    """
+    return dict(db.session.query(
+        Region.chromosome,
+        func.max(Region.end - Region.begin)
+    ).group_by(Region.chromosome))
+
+
+def max_region_span(chromosome):
+    """
+    Get the longest region on a chromosome, measured as end minus begin.
+
+    :return: Longest region span, or `None` if there are no regions on the
+        chromosome.
+    :rtype: int
+    """
+    return region_spans().get(chromosome)
+
+
+@generation_cached('sample')
+def known_sample_ids():
+    """
+    Get the ids of all samples, active or not.
+
+    :rtype: frozenset(int)
+    """
+    return frozenset(sample_id for sample_id,
+                     in db.session.query(Sample.id))
+
+
+@generation_cached('coverage')
+def coverage_ids():
+    """
+    Get the ids of the coverage profiles of all samples.
+
+    :return: Tuple of a dictionary with for every sample id (that has
+        coverage) its coverage ids, and the set of all coverage ids.
+    :rtype: (dict(int, list(int)), frozenset(int))
+    """
+    by_sample = collections.defaultdict(list)
+    for coverage_id, sample_id in db.session.query(Coverage.id,
+                                                   Coverage.sample_id):
+        by_sample[sample_id].append(coverage_id)
+    return (dict(by_sample),
+            frozenset(itertools.chain.from_iterable(by_sample.values())))
+
+
+@generation_cached('sample')
+def known_samples_bitset():
+    """
+    Get the ids of all samples, active or not, as a bitset.
+
+    :return: Integer with bit `i` set iff there is a sample with id `i`.
+    :rtype: int
+    """
+    bitset = 0
+    for sample_id, in db.session.query(Sample.id):
+        bitset |= 1 << sample_id
+    return bitset
+
+
+@generation_cached('group_membership')
+def group_bitsets():
+    """
+    Get the samples in every group as a bitset.
+
+    :return: Dictionary with for every group id (that has samples) an
+        integer with bit `i` set iff the sample with id `i` is in the group.
+    :rtype: dict(int, int)
+    """
+    bitsets = collections.defaultdict(int)
+    for sample_id, group_id in db.session.query(
+            group_membership.c.sample_id, group_membership.c.group_id):
+        bitsets[group_id] |= 1 << sample_id
+    return dict(bitsets)
+
+
+def bitset_ids(bitset):
+    """
+    Get the ids in a bitset.
+
+    :arg bitset: Integer with bit `i` set iff `i` is in the set.
+    :type bitset: int
+
+    :return: Ids in the bitset, ordered.
+    :rtype: list(int)
+    """
+    return [i for i, bit in enumerate(reversed(bin(bitset)[2:]))
+            if bit == '1']
+
+
+def matching_sample_ids(expression, generations=None):
+    """
+    Get the ids of the samples matched by a query expression, active or not.
+
+    The expression is evaluated on bitsets of sample ids (see
+    :func:`group_bitsets`), so no database query is needed as long as groups
+    and samples don't change.
+
+    The cached bitsets are all validated against the same generations, and
+    group members are restricted to the known samples, so a group bitset can
+    never contribute samples the other caches don't know about.
+
+    :arg expression: Query expression AST with clauses on sample and group
+        ids.
+    :type expression: varda.expressions.Expression
+    :arg generations: Generations by table name (see
+        :func:`current_generations`), queried if not given.
+    :type generations: dict(str, tuple)
+
+    :return: Sample ids, ordered.
+    :rtype: list(int)
+    """
+    if generations is None:
+        generations = current_generations()
+    all_ids = known_sample_ids(generations)
+    known = known_samples_bitset(generations)
+    groups = group_bitsets(generations)
+
+    def evaluate_clause(field, value):
+        if field == 'sample':
+            # Don't blow up on huge non-existing sample ids.
+            sample_id = int(value)
+            return 1 << sample_id if sample_id in all_ids else 0
+        if field == 'group':
+            return groups.get(int(value), 0) & known
+        raise ValueError('can only query on sample or group')
+
+    return bitset_ids(expressions.evaluate_bitset(
+        expression, evaluate_clause, known))
+
+
+def sample_criterion(column, selected, all_ids=None):
+    """
+    Criterion restricting a sample id column to a set of samples.
+
+    Queries usually select all active samples, which can be thousands. If
+    the selected samples are the larger part of all samples, this excludes
+    the samples not selected (e.g., inactive samples) instead of listing
+    all selected samples.
+
+    This works just as well for other ids, e.g., coverage ids, if `all_ids`
+    is given.
+
+    Excluding samples is also correct if `all_ids` is somewhat out of date
+    (e.g., it was read at the start of a long annotation task), since ids
+    of samples added later are higher than any id in `all_ids`.
+
+    :arg column: Column with sample ids.
+    :arg selected: Sample ids.
+    :type selected: iterable(int)
+    :arg all_ids: All ids in `column`, by default :func:`known_sample_ids`.
+    :type all_ids: frozenset(int)
+    """
+    selected = set(selected)
+    if not selected:
+        return false()
+    if all_ids is None:
+        all_ids = known_sample_ids()
+    if not selected <= all_ids:
+        return column.in_(selected)
+    excluded = all_ids - selected
+    if len(excluded) >= len(selected):
+        return column.in_(selected)
+    if not excluded:
+        return column <= max(all_ids)
+    return and_(column <= max(all_ids), ~column.in_(excluded))
+
+
+def covering_regions(chromosome, begin, end):
+    """
+    Query for regions covering a range of positions.
+
+    Covering regions start at most the longest region span before `end`, so
+    the scan on the `region_span` index is bounded on both sides. Long
+    regions are split on import into overlapping pieces (see
+    :func:`varda.tasks.split_regions`), so a range can be covered by two
+    regions of the same coverage profile.
+
+    :arg begin: Begin of the range, one-based and inclusive.
+    :type begin: int
+    :arg end: End of the range, one-based and inclusive.
+    :type end: int
+
+    :rtype: sqlalchemy.orm.query.Query
+    """
+    span = max_region_span(chromosome)
+    if span is None:
+        return Region.query.filter(false())
+    return Region.query.filter(
+        Region.chromosome == chromosome,
+        Region.begin <= begin,
+        Region.begin >= end - span,
+        Region.end >= end)
+
+
+def observation_support(chromosome, position, reference, observed,
+                        sample_ids):
+    """
+    Query for the total support per zygosity of a variant within a set of
+    samples.
+
+    For alleles packed into their key (see :mod:`varda.alleles`), this query
+    can be answered from the `observation_frequency` covering index only.
+
+    :func:`calculate_frequency` uses the equivalent statement from
+    :func:`frequency_statement`.
+
+    :arg sample_ids: Sample ids.
+    :type sample_ids: list(int)
+
+    :return: Query yielding tuples of zygosity and total support.
+    :rtype: sqlalchemy.orm.query.Query
+    """
+    key = allele_key(reference, observed)
+    query = db.session.query(
+        Observation.zygosity,
+        func.sum(Observation.support)
+    ).filter(
+        Observation.chromosome == chromosome,
+        Observation.position == position,
+        Observation.allele_key == key,
+        sample_criterion(Observation.sample_id, sample_ids)
+    )
+    if not is_packed(key):
+        # Keys of unpacked alleles are not guaranteed to be unique.
+        query = query.filter(Observation.reference == reference,
+                             Observation.observed == observed)
+    return query.group_by(Observation.zygosity)
+
+
+#: Statements used by :func:`calculate_frequency`, by name and selected
+#: samples. See :func:`frequency_statement`.
+_frequency_statements = LRUCache(100)
+
+#: Compiled forms of the statements in :data:`_frequency_statements`.
+_compiled_cache = LRUCache(200)
+
+
+def frequency_statement(name, sample_ids, generations=None):
+    """
+    Get one of the statements used by :func:`calculate_frequency`, restricted
+    to a set of samples.
+
+    Building and compiling these statements takes more time than executing
+    them, so they are built once per set of samples and executed with bind
+    parameters for the variant (see :func:`execute_frequency_statement`).
+    Statements are rebuilt when the set of known samples (or coverage
+    profiles) changes, since the sample criterion depends on it.
+
+    The ``coverage`` statement restricts regions to the coverage profiles of
+    the selected samples directly (see :func:`coverage_ids`). These are
+    stored in the `region_span` index, so regions of other samples (e.g.,
+    inactive samples) are skipped in an index-only scan, without joining the
+    coverage table.
+
+    :arg name: Name of the statement, one of ``coverage`` (bind parameters
+        `chromosome`, `begin`, `end`, `min_begin`), ``packed_support``
+        (bind parameters `chromosome`, `position`, `allele_key`), or
+        ``unpacked_support`` (bind parameters `chromosome`, `position`,
+        `allele_key`, `reference`, `observed`).
+    :type name: str
+    :arg sample_ids: Sample ids.
+    :type sample_ids: iterable(int)
+    :arg generations: Generations by table name (see
+        :func:`current_generations`), queried if not given.
+    :type generations: dict(str, tuple)
+
+    :rtype: sqlalchemy.sql.expression.Select
+    """
+    sample_ids = frozenset(sample_ids)
+    if name == 'coverage':
+        known = coverage_ids(generations)
+    else:
+        known = known_sample_ids(generations)
+    cached = _frequency_statements.get((name, sample_ids))
+    if cached is not None and cached[0] is known:
+        return cached[1]
+
+    if name == 'coverage':
+        # Equivalent to counting the coverage profiles of
+        # :func:`covering_regions`.
+        by_sample, all_coverage_ids = known
+        selected = itertools.chain.from_iterable(
+            by_sample.get(sample_id, []) for sample_id in sample_ids)
+        statement = select([
+            func.count(distinct(Region.coverage_id))
+        ]).select_from(
+            Region.__table__
+        ).where(and_(
+            Region.chromosome == bindparam('chromosome'),
+            Region.begin <= bindparam('begin'),
+            Region.begin >= bindparam('min_begin'),
+            Region.end >= bindparam('end'),
+            sample_criterion(Region.coverage_id, selected,
+                             all_ids=all_coverage_ids)))
+    else:
+        # Equivalent to :func:`observation_support`.
+        criteria = [Observation.chromosome == bindparam('chromosome'),
+                    Observation.position == bindparam('position'),
+                    Observation.allele_key == bindparam('allele_key'),
+                    sample_criterion(Observation.sample_id, sample_ids,
+                                     all_ids=known)]
+        if name == 'unpacked_support':
+            criteria.extend([Observation.reference == bindparam('reference'),
+                             Observation.observed == bindparam('observed')])
+        statement = select([
+            Observation.zygosity,
+            func.sum(Observation.support)
+        ]).where(and_(*criteria)).group_by(Observation.zygosity)
+
+    _frequency_statements[name, sample_ids] = known, statement
+    return statement
+
+
+def execute_frequency_statement(statement, **params):
+    """
+    Execute a statement from :func:`frequency_statement`, reusing its
+    compiled form.
+
+    :return: Result of the statement.
+    :rtype: sqlalchemy.engine.ResultProxy
+    """
+    connection = db.session.connection(clause=statement)
+    return connection.execution_options(
+        compiled_cache=_compiled_cache).execute(statement, **params)
+
+
+class FrequencyCalculator(object):
+    """
+    Calculate frequencies of variants within a set of samples.
+
+    Everything that does not depend on the variant (statements, longest
+    region spans, pool sizes, the observation store version) is read once
+    on construction, so calculating the frequency of a variant takes at
+    most two queries. Use one calculator for a batch of variants, e.g., an
+    annotation task or API request, not for longer.
+
+    :arg samples: Calculate frequencies within these samples.
+    :type samples: list of Sample
+    :arg generations: Generations by table name (see
+        :func:`current_generations`), queried if not given.
+    :type generations: dict(str, tuple)
+    """
+    # Todo: Use constant definition for zygosity, probably shared with the
+    #     one used in the models.
+    zygosities = (None, 'homozygous', 'heterozygous')
+
+    def __init__(self, samples, generations=None):
+        if generations is None:
+            generations = current_generations()
+
+        sample_ids = [sample.id for sample in samples]
+        self.coverage_statement = frequency_statement(
+            'coverage',
+            [sample.id for sample in samples if sample.coverage_profile],
+            generations)
+        self.packed_statement = frequency_statement(
+            'packed_support', sample_ids, generations)
+        self.unpacked_statement = frequency_statement(
+            'unpacked_support', sample_ids, generations)
+        self.region_spans = region_spans(generations)
+        self.snapshot = current_observations(generations)
+        self.sample_ids = set(sample_ids)
+
+        # Number of individuals in samples without coverage profile.
+        self.pool_size = sum(sample.pool_size for sample in samples
+                             if not sample.coverage_profile)
+
+    def __call__(self, chromosome, position, reference, observed):
+        """
+        Calculate frequency for a variant.
+
+        :arg chromosome: Chromosome name.
+        :type chromosome: str
+        :arg position: One-based position where `reference` and `observed`
+            start on the reference genome
+        :type position: int
+        :arg reference: Reference sequence.
+        :type reference: str
+        :arg observed: Observed sequence.
+        :type observed: str
+
+        :return: A tuple of the number of individuals having coverage and a
+            dictionary with for every zygosity the ratio of individuals with
+            observed allele and zygosity.
+        :rtype: (int, dict)
+        """
+        end_position = position + max(1, len(reference)) - 1
+
+        # Coverage over samples with coverage profile (see the
+        # :func:`covering_regions` query).
+        span = self.region_spans.get(chromosome)
+        if span is None:
+            coverage = 0
+        else:
+            coverage = execute_frequency_statement(
+                self.coverage_statement, chromosome=chromosome,
+                begin=position, end=end_position,
+                min_begin=end_position - span).scalar()
+
+        coverage += self.pool_size
+
+        if not coverage:
+            return 0, {zygosity: 0 for zygosity in self.zygosities}
+
+        if self.snapshot is not None:
+            counts = collections.Counter(self.snapshot.support(
+                chromosome, position, reference, observed, self.sample_ids))
+        else:
+            # Counts of observations per zygosity (see the
+            # :func:`observation_support` query).
+            key = allele_key(reference, observed)
+            statement = (self.packed_statement if is_packed(key)
+                         else self.unpacked_statement)
+            counts = collections.Counter(dict(execute_frequency_statement(
+                statement, chromosome=chromosome, position=position,
+                allele_key=key, reference=reference,
+                observed=observed).fetchall()))
+
+        return coverage, {zygosity: counts[zygosity] / coverage
+                          for zygosity in self.zygosities}
+
+
+def frequency_calculators(sample_sets, generations=None):
+    """
+    Create a :class:`FrequencyCalculator` for every set of samples, reading
+    the generations only once.
+
+    :arg sample_sets: Sets of samples.
+    :type sample_sets: iterable(list of Sample)
+    :arg generations: Generations by table name (see
+        :func:`current_generations`), queried if not given.
+    :type generations: dict(str, tuple)
+
+    :rtype: list(FrequencyCalculator)
+    """
+    sample_sets = list(sample_sets)
+    if sample_sets and generations is None:
+        generations = current_generations()
+    return [FrequencyCalculator(samples, generations)
+            for samples in sample_sets]
+
+
 def calculate_frequency(chromosome, position, reference, observed,
                         samples=None):
     """
     Calculate frequency for a variant within a set of samples.
 
+    For more than one variant, use a :class:`FrequencyCalculator`.
+
     :arg chromosome: Chromosome name.
     :type chromosome: str
     :arg position: One-based position where `reference` and `observed` start
@@ -361,48 +1048,5 @@ def calculate_frequency(chromosome, position, reference, observed,
         observed allele and zygosity.
     :rtype: (int, dict)
     """
-    samples = samples or []
-
-    # Todo: Use constant definition for zygosity, probably shared with the
-    #     one used in the models.
-    zygosities = (None, 'homozygous', 'heterozygous')
-
-    end_position = position + max(1, len(reference)) - 1
-    bins = binning.containing_bins(position - 1, end_position)
-
-    # Coverage over samples with coverage profile.
-    coverage = Region.query.join(Coverage).filter(
-        Region.bin.in_(bins),
-        Region.chromosome == chromosome,
-        Region.begin <= position,
-        Region.end >= end_position,
-        Coverage.sample_id.in_(sample.id for sample in samples
-                               if sample.coverage_profile)
-    ).count()
-
-    # Add the number of individuals in samples without coverage profile.
-    coverage += sum(sample.pool_size for sample in samples
-                    if not sample.coverage_profile)
-
-    if not coverage:
-        return 0, {zygosity: 0 for zygosity in zygosities}
-
-    # Counts of observations per zygosity.
-    counts = db.session.query(
-        Observation.zygosity,
-        func.sum(Observation.support)
-    ).join(Variation).filter(
-        Observation.bin.in_(bins),
-        Observation.chromosome == chromosome,
-        Observation.position == position,
-        Observation.reference == reference,
-        Observation.observed == observed,
-        Variation.sample_id.in_(sample.id for sample in samples)
-    ).group_by(Observation.zygosity)
-
-    counts = collections.Counter(dict(counts))
-
-    frequency = {zygosity: counts[zygosity] / coverage
-                 for zygosity in zygosities}
-
-    return coverage, frequency
+    return FrequencyCalculator(samples or [])(chromosome, position,
+                                              reference, observed)
@@ -7,14 +7,15 @@ Helper module for celery to run a worker.
 """
 
 
-from celery.signals import worker_process_init
+from celery.signals import worker_process_init, worker_ready
 
-from . import create_app, genome
+from . import create_app, db, genome
 
 
 @worker_process_init.connect
 def init_genome(**kwargs):
-    if not genome:
+    # A memory-mapped genome can be shared between processes.
+    if not genome or genome.mapped:
         return
     # Duplicate the open file object of the reference genome. This is needed
     # because file descriptors are inherited after fork, and thus shared
@@ -23,8 +24,34 @@ def init_genome(**kwargs):
     genome.faidx.file = open(f.name, f.mode)
 
 
+@worker_process_init.connect
+def dispose_engines(**kwargs):
+    # Pooled database connections are inherited after fork, and would be
+    # shared between worker processes. Discard them, so that every process
+    # opens its own connections.
+    db.session.remove()
+    for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or ()):
+        db.get_engine(app, bind=bind).dispose()
+
+
+@worker_ready.connect
+def resume_purges(**kwargs):
+    # Purging a deleted sample may have failed, in which case it would not be
+    # retried. Purges that are still queued or running are left alone (see
+    # tasks.purge_deleted_samples).
+    tasks.purge_deleted_samples.delay()
+
+
 # Todo: Should we make it possible to use create_reverse_proxied_app here?
-create_app().app_context().push()
+app = create_app()
+
+# A worker process runs one task at a time, so it can do with a smaller
+# connection pool than a web server process.
+for setting in 'POOL_SIZE', 'MAX_OVERFLOW':
+    if app.config['WORKER_' + setting] is not None:
+        app.config['SQLALCHEMY_' + setting] = app.config['WORKER_' + setting]
+
+app.app_context().push()
 
 
-from . import celery  # noqa
+from . import celery, tasks  # noqa